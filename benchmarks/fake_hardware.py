@@ -0,0 +1,274 @@
+"""Simulated camera and GPIO so final new.py can run on any Linux box.
+
+install() registers fake `libcamera` and `picamera2` modules and selects
+gpiozero's mock pin factory; load_app() then imports final new.py (whose
+file name is not importable as a module) into a scratch working directory.
+
+The fake Picamera2 delivers frames on a fixed clock (FakeCameraTiming.fps)
+with a configurable readout latency, using a small pool of pregenerated
+frames with gradients, a moving bar and sensor-like noise so JPEG encoding
+costs about what it does on a real scene. Only the picamera2 calls the
+app makes are implemented; picamera2.encoders is deliberately missing, so
+the hardware JPEG passthrough reports itself unavailable.
+"""
+import importlib.util
+import os
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "final new.py")
+
+
+class FakeCameraTiming:
+    """Knobs for the simulated sensor; change before the app creates its camera."""
+    fps = 30.0  # Sensor frame clock
+    readout_latency = 0.005  # Added to every request/array readout, seconds
+    mode_switch_latency = 0.15  # Still-mode reconfigure + readout, seconds
+    autofocus_time = 0.12  # Scanning time after an AfTrigger, seconds
+    start_latency = 0.05  # camera.start(), seconds
+    pool_size = 4  # Distinct pregenerated frames per configuration
+
+
+def _scene(height, width, channels, index):
+    """Gradient scene with a moving bar and noise, roughly as compressible as a real image.
+
+    Drawn at preview size and scaled up, with a tiled noise patch, so even
+    4K stills take a fraction of a second to generate.
+    """
+    import cv2
+    small_w, small_h = min(width, 640), min(height, 480)
+    x = np.linspace(0, 255, small_w, dtype=np.float32)[np.newaxis, :]
+    y = np.linspace(0, 128, small_h, dtype=np.float32)[:, np.newaxis]
+    base = x * 0.7 + y * 0.3
+    bar = (index * small_w // FakeCameraTiming.pool_size) % max(1, small_w - small_w // 8)
+    base[:, bar:bar + small_w // 8] = 230
+    planes = [np.clip(base * (0.6 + 0.2 * c), 0, 255).astype(np.uint8) for c in range(min(channels, 3))]
+    frame = cv2.resize(np.dstack(planes), (width, height), interpolation=cv2.INTER_LINEAR)
+    frame = frame.reshape(height, width, len(planes))
+    noise = np.random.default_rng(index).integers(-6, 7, (64, 64, len(planes)), dtype=np.int16)
+    noise = np.tile(noise, (height // 64 + 1, width // 64 + 1, 1))[:height, :width]
+    frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    if channels == 4:
+        frame = np.concatenate([frame, np.full((height, width, 1), 255, np.uint8)], axis=-1)
+    return frame
+
+
+class _FramePool:
+    """Pregenerated frames per (stream size, format), so producing a frame costs nothing."""
+
+    def __init__(self):
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def get(self, size, fmt, index):
+        key = (tuple(size), fmt)
+        with self._lock:
+            frames = self._frames.get(key)
+            if frames is None:
+                width, height = size
+                if fmt == "YUV420":
+                    frames = [np.full((height * 3 // 2, width), 128, np.uint8)
+                              for _ in range(FakeCameraTiming.pool_size)]
+                    for i, frame in enumerate(frames):
+                        frame[:height] = _scene(height, width, 1, i)[..., 0]
+                else:
+                    channels = 4 if fmt.startswith("X") else 3
+                    frames = [_scene(height, width, channels, i) for i in range(FakeCameraTiming.pool_size)]
+                self._frames[key] = frames
+        return frames[index % len(frames)]
+
+
+_pool = _FramePool()
+
+
+class FakeRequest:
+    def __init__(self, camera, config, frame_index):
+        self._camera = camera
+        self._config = config
+        self._frame_index = frame_index
+
+    def make_array(self, name):
+        stream = self._config[name]
+        return _pool.get(stream["size"], stream.get("format", "XBGR8888"), self._frame_index)
+
+    def make_buffer(self, name):
+        return self.make_array(name).reshape(-1)
+
+    def get_metadata(self):
+        return self._camera.capture_metadata(wait=False)
+
+    def release(self):
+        pass
+
+
+class _CopyingRequest(FakeRequest):
+    """A request whose arrays are copies, like picamera2's CompletedRequest.make_array."""
+
+    def make_array(self, name):
+        return super().make_array(name).copy()
+
+
+class MappedArray:
+    def __init__(self, request, stream, write=True):
+        self._request = request
+        self._stream = stream
+
+    def __enter__(self):
+        self.array = self._request.make_array(self._stream)
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Picamera2:
+    def __init__(self, *args, **kwargs):
+        self.camera_config = None
+        self.started = False
+        self._controls = {}
+        self._af_started = None
+        self._frame_index = 0
+        self._next_frame = time.monotonic()
+
+    def create_preview_configuration(self, main=None, lores=None, controls=None, **kwargs):
+        config = {"main": dict(main or {"size": (640, 480), "format": "XBGR8888"}), "controls": controls or {}}
+        if lores:
+            config["lores"] = dict(lores)
+        config.update(kwargs)
+        return config
+
+    create_video_configuration = create_preview_configuration
+
+    def create_still_configuration(self, main=None, controls=None, **kwargs):
+        return self.create_preview_configuration(main=main or {"size": (2592, 1944), "format": "RGB888"},
+                                                 controls=controls, **kwargs)
+
+    def configure(self, config):
+        self.camera_config = config
+
+    def start(self, *args, **kwargs):
+        time.sleep(FakeCameraTiming.start_latency)
+        self.started = True
+        self._next_frame = time.monotonic()
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.started = False
+
+    def set_controls(self, controls):
+        self._controls.update(controls)
+        if "AfTrigger" in controls:
+            self._af_started = time.monotonic()
+
+    def _wait_frame(self):
+        """Blocks until the next frame on the sensor clock, plus readout latency."""
+        if not self.started:
+            raise RuntimeError("Camera is not running")
+        now = time.monotonic()
+        if self._next_frame > now:
+            time.sleep(self._next_frame - now)
+            now = self._next_frame
+        self._next_frame = max(now, self._next_frame) + 1.0 / FakeCameraTiming.fps
+        if FakeCameraTiming.readout_latency:
+            time.sleep(FakeCameraTiming.readout_latency)
+        self._frame_index += 1
+        return self._frame_index
+
+    def capture_request(self, *args, **kwargs):
+        return FakeRequest(self, self.camera_config, self._wait_frame())
+
+    def capture_array(self, name="main"):
+        return FakeRequest(self, self.camera_config, self._wait_frame()).make_array(name).copy()
+
+    def capture_buffer(self, name="main"):
+        return self.capture_array(name).reshape(-1)
+
+    def capture_metadata(self, wait=True):
+        if wait:
+            self._wait_frame()
+        af_state = 0  # Idle
+        if self._af_started is not None:
+            scanning = time.monotonic() - self._af_started < FakeCameraTiming.autofocus_time
+            af_state = 1 if scanning else 2  # Scanning, then Focused
+        return {
+            "AfState": af_state,
+            "LensPosition": 1.5,
+            "ExposureTime": 10000,
+            "AnalogueGain": 1.0,
+            "ColourGains": (1.8, 1.5),
+            "SensorTimestamp": time.monotonic_ns(),
+        }
+
+    def switch_mode(self, config):
+        time.sleep(FakeCameraTiming.mode_switch_latency / 2)
+        self.camera_config = config
+
+    def switch_mode_and_capture_array(self, config, name="main", **kwargs):
+        time.sleep(FakeCameraTiming.mode_switch_latency)
+        stream = config[name]
+        return _pool.get(stream["size"], stream.get("format", "RGB888"), self._frame_index).copy()
+
+    def switch_mode_and_capture_request(self, config, **kwargs):
+        time.sleep(FakeCameraTiming.mode_switch_latency)
+        return _CopyingRequest(self, config, self._frame_index)
+
+    def capture_file(self, file_output, name="main", format=None, **kwargs):
+        import cv2
+        image = self.capture_array(name)[..., :3]
+        if isinstance(file_output, str):
+            cv2.imwrite(file_output, image)
+        else:
+            file_output.write(cv2.imencode("." + (format or "jpeg"), image)[1].tobytes())
+
+    def stop_encoder(self, *args, **kwargs):
+        pass
+
+
+def _fake_libcamera():
+    module = types.ModuleType("libcamera")
+
+    class _Enum:
+        def __init__(self, **members):
+            self.__dict__.update(members)
+
+    module.controls = types.SimpleNamespace(
+        AfModeEnum=_Enum(Manual=0, Auto=1, Continuous=2),
+        AfTriggerEnum=_Enum(Start=0, Cancel=1),
+        AfStateEnum=_Enum(Idle=0, Scanning=1, Focused=2, Failed=3),
+        AeExposureModeEnum=_Enum(Normal=0, Short=1, Long=2),
+    )
+
+    class Transform:
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    module.Transform = Transform
+    return module
+
+
+def install():
+    """Registers the fake modules and gpiozero's mock pins; call before load_app()."""
+    os.environ["GPIOZERO_PIN_FACTORY"] = "mock"
+    sys.modules["libcamera"] = _fake_libcamera()
+    picamera2 = types.ModuleType("picamera2")
+    picamera2.Picamera2 = Picamera2
+    picamera2.MappedArray = MappedArray
+    sys.modules["picamera2"] = picamera2
+
+
+def load_app(workdir, app_path=APP_PATH):
+    """Imports final new.py with workdir as the current directory (img/, thumbnails/ and the index go there)."""
+    install()
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("final_new", app_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["final_new"] = module
+    spec.loader.exec_module(module)
+    return module
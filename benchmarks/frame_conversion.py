@@ -0,0 +1,94 @@
+"""Micro-benchmark for the stream frame conversion stage.
+
+Compares the original generate_frames() conversion (np.frombuffer, slice off
+the X channel, fancy-index to BGR) against the app's own FrameConverter (one
+cv2.cvtColor into a preallocated output), using a synthetic XBGR8888 frame
+at the stream resolution. final new.py is loaded against the simulated
+hardware in fake_hardware.py, so the numbers follow the shipped class.
+
+Usage:
+    python benchmarks/frame_conversion.py [--frames 300] [--width 480] [--height 640]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_hardware  # noqa: E402
+
+
+def legacy_convert(frame_buffer, width, height):
+    """The conversion generate_frames() used before FrameConverter."""
+    frame_array = np.frombuffer(frame_buffer, dtype=np.uint8)
+    frame_bgra = frame_array.reshape((height, width, 4))
+    frame = frame_bgra[:, :, 0:3]
+    return frame[:, :, [2, 1, 0]]
+
+
+def measure(convert, frame, width, height, frames):
+    # Warm up so one-off allocations are not attributed to the steady state
+    for _ in range(5):
+        convert(frame)
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        convert(frame)
+    elapsed = time.perf_counter() - start
+
+    # numpy reports its data buffers to tracemalloc, so a per-frame copy shows
+    # up as a peak of roughly one frame above the baseline
+    tracemalloc.start()
+    allocations = 0
+    worst_peak = 0
+    for _ in range(frames):
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        convert(frame)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        worst_peak = max(worst_peak, peak)
+        if peak >= width * height:
+            allocations += 1
+    tracemalloc.stop()
+
+    return {
+        "ms_per_frame": elapsed * 1000 / frames,
+        "frame_sized_allocations_per_frame": allocations / frames,
+        "peak_bytes_per_frame": worst_peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=480)
+    parser.add_argument("--height", type=int, default=640)
+    args = parser.parse_args()
+
+    app = fake_hardware.load_app(tempfile.mkdtemp(prefix="rf-bench-"))
+    app.logging.getLogger().setLevel(app.logging.WARNING)
+
+    # Shaped like the mapped camera buffer FrameConverter.from_request hands over
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(args.height, args.width, 4), dtype=np.uint8)
+
+    converter = app.FrameConverter((args.width, args.height))
+    reference = legacy_convert(frame, args.width, args.height)
+    if not np.array_equal(reference, converter.convert(frame)):
+        raise SystemExit("Converters disagree on the output frame")
+
+    print(f"Synthetic XBGR8888 frame {args.width}x{args.height}, {args.frames} frames")
+    for name, convert in (("before (fancy-index copy)", lambda f: legacy_convert(f, args.width, args.height)),
+                          ("after (FrameConverter.convert)", converter.convert)):
+        result = measure(convert, frame, args.width, args.height, args.frames)
+        print(f"{name:32s} {result['ms_per_frame']:7.3f} ms/frame  "
+              f"{result['frame_sized_allocations_per_frame']:4.2f} frame allocs/frame  "
+              f"{result['peak_bytes_per_frame'] / 1024:9.1f} KiB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""End-to-end load generator: concurrent MJPEG viewers, dashboard polling and capture storms.
+
+Ramps the number of /video_feed viewers in steps while dashboard clients
+poll the status endpoints and a capture client POSTs /capture at a fixed
+rate. For every step it reports each viewer's achieved fps and its frame
+inter-arrival p50/p95/p99, the API latencies per endpoint, and marks the
+first step at which the stream collapses (median viewer fps below
+--collapse-ratio of the target, p99 inter-arrival above --collapse-gap, or
+a viewer failing).
+
+By default the app is started in-process on the simulated camera from
+benchmarks/fake_hardware.py; pass --url to load a real device instead.
+
+Usage:
+    python benchmarks/load_test.py [--steps 1,2,5,10,20] [--step-seconds 10]
+                                   [--pollers 1] [--capture-interval 2]
+                                   [--server threaded|async] [--url http://<device-ip>:5000]
+                                   [--output load_results.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+STATUS_ENDPOINTS = ('/system_status', '/device_status', '/stream_status', '/power_status')
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def latency_summary(samples):
+    if not samples:
+        return None
+    return {"count": len(samples), "p50_ms": ms(statistics.median(samples)),
+            "p95_ms": ms(percentile(samples, 0.95)), "p99_ms": ms(percentile(samples, 0.99))}
+
+
+class Viewer(threading.Thread):
+    """One MJPEG consumer that timestamps every complete frame."""
+
+    def __init__(self, host, port, stop):
+        super().__init__(daemon=True)
+        self.host, self.port, self.stop = host, port, stop
+        self.arrivals = []
+        self.error = None
+        self.connect_started = None
+
+    def run(self):
+        self.connect_started = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            conn.request('GET', '/video_feed')
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            buffer = b''
+            while not self.stop.is_set():
+                chunk = response.read1(65536)
+                if not chunk:
+                    raise RuntimeError("stream ended")
+                buffer += chunk
+                buffer = self._consume(buffer)
+            conn.close()
+        except (OSError, RuntimeError, http.client.HTTPException) as e:
+            if not self.stop.is_set():
+                self.error = str(e)
+
+    def _consume(self, buffer):
+        """Strips complete multipart frames off the buffer, recording their arrival."""
+        while True:
+            start = buffer.find(b'--frame\r\n')
+            header_end = buffer.find(b'\r\n\r\n', start)
+            if start < 0 or header_end < 0:
+                return buffer
+            length = None
+            for line in buffer[start:header_end].split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            if length is None:
+                raise RuntimeError("frame without Content-Length")
+            frame_end = header_end + 4 + length
+            if len(buffer) < frame_end:
+                return buffer
+            self.arrivals.append(time.perf_counter())
+            buffer = buffer[frame_end:]
+
+    def summary(self, window_start):
+        arrivals = [t for t in self.arrivals if t >= window_start]
+        gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+        elapsed = (arrivals[-1] - arrivals[0]) if len(arrivals) > 1 else 0
+        return {
+            # Connect to first frame, including the camera wake-up in /video_feed
+            "first_frame_ms": ms(self.arrivals[0] - self.connect_started) if self.arrivals else None,
+            "fps": round((len(arrivals) - 1) / elapsed, 2) if elapsed else 0.0,
+            "frames": len(arrivals),
+            "gap_p50_ms": ms(statistics.median(gaps)) if gaps else None,
+            "gap_p95_ms": ms(percentile(gaps, 0.95)) if gaps else None,
+            "gap_p99_ms": ms(percentile(gaps, 0.99)) if gaps else None,
+            "error": self.error,
+        }
+
+
+class ApiClient(threading.Thread):
+    """Calls a list of (method, path) requests every interval, recording (start, latency) per path."""
+
+    def __init__(self, host, port, requests, interval, stop):
+        super().__init__(daemon=True)
+        self.host, self.port, self.requests, self.interval, self.stop = host, port, requests, interval, stop
+        self.latencies = {path: [] for _, path in requests}
+        self.errors = {path: 0 for _, path in requests}
+
+    def run(self):
+        conn = None
+        next_round = time.perf_counter()
+        while not self.stop.is_set():
+            for method, path in self.requests:
+                start = time.perf_counter()
+                try:
+                    if conn is None:
+                        conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+                    conn.request(method, path)
+                    response = conn.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        self.errors[path] += 1
+                    else:
+                        self.latencies[path].append((start, time.perf_counter() - start))
+                except (OSError, http.client.HTTPException):
+                    self.errors[path] += 1
+                    conn = None
+            next_round += self.interval
+            self.stop.wait(max(0.0, next_round - time.perf_counter()))
+
+
+def start_local_server(mode, args):
+    """Loads the app on the simulated camera and serves it from a background thread."""
+    import fake_hardware
+    fake_hardware.FakeCameraTiming.fps = args.camera_fps
+    workdir = tempfile.mkdtemp(prefix="rf-load-")
+    app = fake_hardware.load_app(workdir)
+    app.logging.getLogger().setLevel(app.logging.WARNING)
+    app.logging.getLogger('werkzeug').setLevel(app.logging.WARNING)
+    app.select_stream_encoder()
+    app.initialize_camera()
+    app.set_system_state(app.SystemState.RUNNING)
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    if mode == "async":
+        import asyncio
+
+        def serve():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            app.run_async_server('127.0.0.1', port)
+        threading.Thread(target=serve, daemon=True).start()
+    else:
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', port, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return app, '127.0.0.1', port
+
+
+def run_step(host, port, viewer_count, args):
+    stop = threading.Event()
+    viewers = [Viewer(host, port, stop) for _ in range(viewer_count)]
+    pollers = [ApiClient(host, port, [('GET', path) for path in STATUS_ENDPOINTS], args.poll_interval, stop)
+               for _ in range(args.pollers)]
+    capturers = []
+    if args.capture_interval:
+        capturers.append(ApiClient(host, port, [('POST', '/capture')], args.capture_interval, stop))
+    for client in viewers + pollers + capturers:
+        client.start()
+
+    time.sleep(args.warmup)  # Viewers connect and the producer settles before measuring
+    window_start = time.perf_counter()
+    time.sleep(args.step_seconds)
+    stop.set()
+    for client in viewers + pollers + capturers:
+        client.join(timeout=5)
+
+    per_viewer = [viewer.summary(window_start) for viewer in viewers]
+    api = {}
+    for client in pollers + capturers:
+        for path, samples in client.latencies.items():
+            entry = api.setdefault(path, {"samples": [], "errors": 0})
+            # Calls made while viewers were still connecting are not part of the step
+            entry["samples"].extend(latency for start, latency in samples if start >= window_start)
+            entry["errors"] += client.errors[path]
+    return per_viewer, {path: {**(latency_summary(entry["samples"]) or {}), "errors": entry["errors"]}
+                        for path, entry in api.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="load an already running server instead of the simulated one")
+    parser.add_argument("--server", choices=("threaded", "async"), default="threaded",
+                        help="serving mode for the in-process simulated server")
+    parser.add_argument("--steps", type=lambda v: [int(n) for n in v.split(",")], default=[1, 2, 5, 10, 20])
+    parser.add_argument("--step-seconds", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--pollers", type=int, default=1, help="dashboard clients polling the status endpoints")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--capture-interval", type=float, default=2.0, help="seconds between POST /capture; 0 disables")
+    parser.add_argument("--target-fps", type=float, help="expected stream fps (default: the app's STREAM_FRAMERATE)")
+    parser.add_argument("--camera-fps", type=float, default=30.0, help="simulated sensor frame rate")
+    parser.add_argument("--collapse-ratio", type=float, default=0.5)
+    parser.add_argument("--collapse-gap", type=float, default=1.0, help="p99 inter-arrival seconds")
+    parser.add_argument("--output", default="load_results.json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    if args.url:
+        parts = urllib.parse.urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+        target_fps = args.target_fps
+        if target_fps is None:
+            parser.error("--target-fps is required with --url")
+    else:
+        app, host, port = start_local_server(args.server, args)
+        target_fps = args.target_fps or app.STREAM_FRAMERATE
+
+    steps, collapse_at = [], None
+    for viewer_count in args.steps:
+        per_viewer, api = run_step(host, port, viewer_count, args)
+        fps = [v["fps"] for v in per_viewer]
+        worst_p99 = max((v["gap_p99_ms"] or 0) for v in per_viewer)
+        failed = sum(1 for v in per_viewer if v["error"] or v["frames"] < 2)
+        first_frame = [v["first_frame_ms"] for v in per_viewer if v["first_frame_ms"] is not None]
+        collapsed = (statistics.median(fps) < args.collapse_ratio * target_fps
+                     or worst_p99 > args.collapse_gap * 1000 or failed > 0)
+        if collapsed and collapse_at is None:
+            collapse_at = viewer_count
+        steps.append({"viewers": viewer_count, "fps_median": statistics.median(fps), "fps_min": min(fps),
+                      "gap_p99_ms_worst": worst_p99, "failed_viewers": failed, "collapsed": collapsed,
+                      "first_frame_ms_max": max(first_frame) if first_frame else None,
+                      "per_viewer": per_viewer, "api": api})
+
+        api_text = ", ".join(f"{path} p95 {entry.get('p95_ms')} ms" + (f" ({entry['errors']} err)" if entry['errors'] else "")
+                             for path, entry in api.items())
+        print(f"{viewer_count:3d} viewers: fps median {statistics.median(fps):5.2f} min {min(fps):5.2f}, "
+              f"worst p99 gap {worst_p99:7.1f} ms, slowest first frame {max(first_frame, default=0):7.1f} ms, "
+              f"{failed} failed{'  COLLAPSED' if collapsed else ''}")
+        print(f"    {api_text}")
+
+    print(f"Stream collapse point: {collapse_at if collapse_at else 'not reached'}"
+          f"{' viewers' if collapse_at else f' (up to {args.steps[-1]} viewers)'}")
+    with open(output, 'w') as f:
+        json.dump({
+            "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "target": args.url or f"simulated/{args.server}",
+                     "target_fps": target_fps, "pollers": args.pollers, "poll_interval": args.poll_interval,
+                     "capture_interval": args.capture_interval, "step_seconds": args.step_seconds},
+            "collapse_at_viewers": collapse_at,
+            "steps": steps,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
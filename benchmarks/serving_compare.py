@@ -0,0 +1,139 @@
+"""Compares the threaded and async serving modes under many stream viewers.
+
+Opens N MJPEG viewers against a running server (half of them "slow": they
+read only a few KiB per second), then measures /system_status latency from
+a separate poller while the viewers stay connected. When the server runs on
+the same machine, pass its PID to also sample resident memory and thread
+count from /proc.
+
+Start the server in each mode (SERVER_MODE = "threaded" / "async" in
+final new.py) and run this against it, e.g.:
+
+    python benchmarks/serving_compare.py --url http://127.0.0.1:5000 --pid <server pid> --viewers 40
+"""
+import argparse
+import json
+import socket
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+
+def proc_status(pid):
+    """VmRSS (KiB) and thread count of the server process, if readable."""
+    if not pid:
+        return None
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                fields[key] = value.split()[0] if value.split() else ""
+    except OSError:
+        return None
+    return {"rss_kib": int(fields.get("VmRSS", 0)), "threads": int(fields.get("Threads", 0))}
+
+
+class Viewer(threading.Thread):
+    """One MJPEG client on a raw socket so the read rate can be throttled."""
+
+    def __init__(self, host, port, slow, stop):
+        super().__init__(daemon=True)
+        self.host, self.port, self.slow, self.stop = host, port, slow, stop
+        self.bytes_read = 0
+        self.error = None
+
+    def run(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=10)
+            # A small receive buffer makes a slow reader apply backpressure quickly
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+            sock.sendall(f"GET /video_feed HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode())
+            while not self.stop.is_set():
+                chunk = sock.recv(4096 if self.slow else 65536)
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                if self.slow:
+                    time.sleep(0.5)
+            sock.close()
+        except OSError as e:
+            self.error = str(e)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def poll_latency(url, count, interval):
+    samples, errors = [], 0
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                response.read()
+            samples.append((time.perf_counter() - start) * 1000)
+        except OSError:
+            errors += 1
+        time.sleep(interval)
+    return samples, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--pid", type=int, default=0, help="server PID, for memory/thread sampling")
+    parser.add_argument("--viewers", type=int, default=40)
+    parser.add_argument("--polls", type=int, default=100)
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds to let viewers connect")
+    parser.add_argument("--json", action="store_true", help="print one JSON object instead of text")
+    args = parser.parse_args()
+
+    parts = urllib.parse.urlsplit(args.url)
+    host, port = parts.hostname, parts.port or 80
+    status_url = args.url.rstrip("/") + "/system_status"
+
+    idle_status = proc_status(args.pid)
+    idle_latency, _ = poll_latency(status_url, 20, 0.02)
+
+    stop = threading.Event()
+    viewers = [Viewer(host, port, slow=(i % 2 == 1), stop=stop) for i in range(args.viewers)]
+    for viewer in viewers:
+        viewer.start()
+    time.sleep(args.settle)
+
+    loaded_status = proc_status(args.pid)
+    loaded_latency, poll_errors = poll_latency(status_url, args.polls, 0.02)
+    stop.set()
+    for viewer in viewers:
+        viewer.join(timeout=5)
+
+    result = {
+        "viewers": args.viewers,
+        "viewers_failed": sum(1 for v in viewers if v.error or v.bytes_read == 0),
+        "idle": idle_status,
+        "loaded": loaded_status,
+        "status_ms_idle_p50": statistics.median(idle_latency) if idle_latency else None,
+        "status_ms_p50": statistics.median(loaded_latency) if loaded_latency else None,
+        "status_ms_p95": percentile(loaded_latency, 0.95) if loaded_latency else None,
+        "status_errors": poll_errors,
+    }
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(f"{args.viewers} viewers ({result['viewers_failed']} failed to stream)")
+    for label in ("idle", "loaded"):
+        status = result[label]
+        if status:
+            print(f"  {label:6s} RSS {status['rss_kib'] / 1024:6.1f} MiB  threads {status['threads']}")
+    print(f"  /system_status p50 idle {result['status_ms_idle_p50']:.1f} ms, "
+          f"under load p50 {result['status_ms_p50']:.1f} ms / p95 {result['status_ms_p95']:.1f} ms, "
+          f"{poll_errors} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""Hardware-free benchmark suite for final new.py.
+
+Runs the app against the simulated camera and mock GPIO in
+benchmarks/fake_hardware.py and measures:
+
+  startup     import, encoder probe and camera init, in a fresh interpreter
+  stream      delivered fps and process CPU per frame for one /video_feed viewer,
+              plus the per-stage means from /metrics
+  capture     POST /capture until the job reports "saved" (p50/p95 and job timings)
+  list_files  index reconcile and /list_files latency on 10k and 100k-file directories
+
+Results are written as JSON. Pass --compare with an earlier results file to
+print the change per metric and exit non-zero when any metric regressed by
+more than --tolerance.
+
+Usage:
+    python benchmarks/suite.py [--output benchmark_results.json] [--compare old.json]
+                               [--files 10000,100000] [--fps 30] [--readout-ms 5]
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_hardware  # noqa: E402
+
+HIGHER_IS_BETTER = ("fps",)
+NOISE_FLOOR = 0.5  # Absolute change (ms, fps or %) below which --compare never flags a regression
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def stage_means(app):
+    """Mean seconds per stage from the app's /metrics text."""
+    sums, counts = {}, {}
+    for line in app.render_metrics().splitlines():
+        match = re.match(r'rf_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)', line)
+        if match:
+            kind, stage, value = match.groups()
+            (sums if kind == "sum" else counts)[stage] = float(value)
+    return {stage: ms(sums[stage] / counts[stage]) for stage in sums if counts.get(stage)}
+
+
+def configure_camera(args):
+    fake_hardware.FakeCameraTiming.fps = args.fps
+    fake_hardware.FakeCameraTiming.readout_latency = args.readout_ms / 1000
+    fake_hardware.FakeCameraTiming.mode_switch_latency = args.mode_switch_ms / 1000
+
+
+def startup_probe(workdir, args):
+    """Runs in a child interpreter so imports are cold; prints one JSON line."""
+    start = time.perf_counter()
+    configure_camera(args)
+    app = fake_hardware.load_app(workdir)
+    imported = time.perf_counter()
+    app.logging.getLogger().setLevel(app.logging.WARNING)
+    app.select_stream_encoder()
+    probed = time.perf_counter()
+    app.initialize_camera()
+    ready = time.perf_counter()
+    print(json.dumps({
+        "import_ms": ms(imported - start),
+        "encoder_probe_ms": ms(probed - imported),
+        "camera_init_ms": ms(ready - probed),
+        "total_ms": ms(ready - start),
+        "camera_initialized": bool(app.camera_initialized),
+    }))
+
+
+def bench_startup(args):
+    results = []
+    for _ in range(args.startup_runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--startup-probe", workdir,
+                 "--fps", str(args.fps), "--readout-ms", str(args.readout_ms),
+                 "--mode-switch-ms", str(args.mode_switch_ms)],
+                check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(r[key] for r in results)
+            for key in results[0] if key != "camera_initialized"}
+
+
+def bench_stream(app, args):
+    app.initialize_camera()
+    app.set_system_state(app.SystemState.RUNNING)
+    client = app.app.test_client()
+    response = client.get('/video_feed', buffered=False)
+    frames = iter(response.response)
+    for _ in range(3):
+        next(frames)  # Producer warm-up
+
+    frame_count = 0
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    while time.perf_counter() - wall_start < args.stream_seconds:
+        next(frames)
+        frame_count += 1
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    response.close()
+    time.sleep(0.5)  # Let the producer notice and stop
+
+    return {
+        "configured_fps": app.STREAM_FRAMERATE,
+        "fps": round(frame_count / wall, 2),
+        "cpu_ms_per_frame": ms(cpu / frame_count) if frame_count else None,
+        "cpu_percent": round(cpu / wall * 100, 1),
+        "encoder": app.encoder_stats['backend'],
+        "stage_ms": stage_means(app),
+    }
+
+
+def bench_capture(app, args):
+    client = app.app.test_client()
+    totals, timings = [], []
+    # One unmeasured capture first: it builds the fake camera's still frames
+    for attempt in range(args.captures + 1):
+        start = time.perf_counter()
+        job_id = client.post('/capture').get_json()['job_id']
+        while True:
+            job = client.get(f'/capture/{job_id}').get_json()
+            if job['status'] in ('saved', 'failed', 'cancelled'):
+                break
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        if job['status'] != 'saved':
+            raise RuntimeError(f"capture {job_id} ended {job['status']}: {job.get('error')}")
+        if attempt:
+            totals.append(elapsed)
+            timings.append(job['timings'])
+        time.sleep(0.35)  # Capture LED feedback holds the worker briefly
+    return {
+        "count": len(totals),
+        "latency_ms_p50": ms(statistics.median(totals)),
+        "latency_ms_p95": ms(percentile(totals, 0.95)),
+        "timings_ms_median": {name: statistics.median(t[name] for t in timings if name in t)
+                              for name in timings[0]},
+    }
+
+
+def _populate(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    base = time.time() - count
+    for i in range(count):
+        path = os.path.join(directory, f"RF_pic_bench_{i:07d}.jpeg")
+        with open(path, 'wb'):
+            pass
+        os.utime(path, (base + i, base + i))
+
+
+def _time_requests(client, url, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+    return samples
+
+
+def bench_list_files(app, args, workdir):
+    client = app.app.test_client()
+    original_index = app.image_index
+    results = {}
+    try:
+        for count in args.files:
+            directory = os.path.join(workdir, f"files_{count}")
+            _populate(directory, count)
+            index = app.ImageIndex(os.path.join(workdir, f"index_{count}.db"), directory)
+            start = time.perf_counter()
+            index.reconcile()
+            cold_reconcile = time.perf_counter() - start
+            start = time.perf_counter()
+            index.reconcile()
+            warm_reconcile = time.perf_counter() - start
+            app.image_index = index
+
+            first_page = _time_requests(client, '/list_files?per_page=50', args.list_repeats)
+            middle_page = _time_requests(client, f'/list_files?per_page=50&page={count // 100}',
+                                         args.list_repeats)
+            cursor_walk = []
+            cursor = None
+            for _ in range(args.list_repeats):
+                url = '/list_files?per_page=50' + (f'&cursor={cursor}' if cursor else '')
+                start = time.perf_counter()
+                cursor = client.get(url).get_json()['next_cursor']
+                cursor_walk.append(time.perf_counter() - start)
+            results[str(count)] = {
+                "reconcile_cold_ms": ms(cold_reconcile),
+                "reconcile_warm_ms": ms(warm_reconcile),
+                "first_page_ms_p50": ms(statistics.median(first_page)),
+                "first_page_ms_p95": ms(percentile(first_page, 0.95)),
+                "middle_page_ms_p50": ms(statistics.median(middle_page)),
+                "cursor_page_ms_p50": ms(statistics.median(cursor_walk)),
+            }
+    finally:
+        app.image_index = original_index
+    return results
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current, previous_path, tolerance):
+    """Prints per-metric changes; returns the names of metrics that regressed past tolerance."""
+    with open(previous_path) as f:
+        previous = flatten(json.load(f)["results"])
+    regressions = []
+    print(f"\nCompared with {previous_path}:")
+    for name, value in sorted(flatten(current).items()):
+        old = previous.get(name)
+        if not old or name.endswith(("configured_fps", ".count")):
+            continue
+        change = (value - old) / old
+        worse = -change if name.rsplit(".", 1)[-1].startswith(HIGHER_IS_BETTER) else change
+        flag = ""
+        # Sub-half-millisecond shifts are scheduler noise, whatever the percentage
+        if worse > tolerance and abs(value - old) >= NOISE_FLOOR:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:55s} {old:10.3f} -> {value:10.3f} ({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a fraction")
+    parser.add_argument("--files", type=lambda v: [int(n) for n in v.split(",")], default=[10000, 100000])
+    parser.add_argument("--fps", type=float, default=30.0, help="simulated sensor frame rate")
+    parser.add_argument("--readout-ms", type=float, default=5.0, help="simulated per-frame readout latency")
+    parser.add_argument("--mode-switch-ms", type=float, default=150.0, help="simulated still-capture mode switch")
+    parser.add_argument("--stream-seconds", type=float, default=10.0)
+    parser.add_argument("--captures", type=int, default=5)
+    parser.add_argument("--list-repeats", type=int, default=50)
+    parser.add_argument("--startup-runs", type=int, default=3)
+    parser.add_argument("--startup-probe", metavar="WORKDIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_probe:
+        startup_probe(args.startup_probe, args)
+        return
+    output = os.path.abspath(args.output)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    results = {"startup": bench_startup(args)}
+    print(f"startup: {results['startup']}")
+
+    configure_camera(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        app = fake_hardware.load_app(workdir)
+        app.logging.getLogger().setLevel(app.logging.WARNING)
+        app.select_stream_encoder()
+        results["stream"] = bench_stream(app, args)
+        print(f"stream: {results['stream']}")
+        results["capture"] = bench_capture(app, args)
+        print(f"capture: {results['capture']}")
+        results["list_files"] = bench_list_files(app, args, workdir)
+        print(f"list_files: {results['list_files']}")
+        app.shutdown_camera()
+        os.chdir(os.path.dirname(output))
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(fake_hardware.APP_PATH)).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "simulated_camera": {"fps": args.fps, "readout_ms": args.readout_ms,
+                                 "mode_switch_ms": args.mode_switch_ms},
+        },
+        "results": results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if compare_path:
+        regressions = compare(results, compare_path, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
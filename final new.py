@@ -1,14 +1,30 @@
 from libcamera import controls, Transform
 from gpiozero import Button, LED
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from signal import pause
-from flask import Flask, Response, send_from_directory, request, jsonify
-from picamera2 import Picamera2
+from flask import Flask, Response, send_from_directory, send_file, request, jsonify
+from picamera2 import Picamera2, MappedArray
 import cv2
+import numpy as np
 import threading
+import io
+import json
+import base64
+import hashlib
+import sqlite3
+import tarfile
+import zipfile
+import queue
+import uuid
+import bisect
+import struct
+import heapq
+from collections import deque, OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from subprocess import check_call
 import os
+import sys
 import logging
 
 # Setup basic logging
@@ -17,13 +33,210 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Initialize Flask app
 app = Flask(__name__)
 IMAGE_DIRECTORY = "img/"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+IMAGE_INDEX_PATH = "image_index.db"  # SQLite index of IMAGE_DIRECTORY used by /list_files
+THUMBNAIL_DIRECTORY = "thumbnails/"
+THUMBNAIL_SIZES = (160, 320, 640)  # Allowed long-edge sizes for /thumbnails (bounds the cache's variety)
+THUMBNAIL_DEFAULT_SIZE = 320  # Generated in the background right after each capture
+THUMBNAIL_CACHE_MB = 64  # On-disk thumbnail cache budget; least recently used thumbnails are evicted
+THUMBNAIL_JPEG_QUALITY = 75
+IMAGE_CACHE_MAX_AGE = 3600  # Cache-Control max-age for /images (captures never change once written)
+IMAGE_X_SENDFILE = False  # Let a front-end server (nginx X-Accel/lighttpd) send image files itself
+ARCHIVE_CHUNK_SIZE = 64 * 1024  # Read size when streaming /images/archive
 
-# Ensure image directory exists
+# --- Storage ---
+STORAGE_WRITE_QUEUE = 6  # Encoded images waiting to be written (a 4K JPEG is 2-4 MB)
+STORAGE_WRITE_DEADLINE = 5.0  # Longest a capture waits for a write-queue slot before it fails (seconds)
+STORAGE_FSYNC_BATCH = 4  # Images written back to back and made durable with one round of fsyncs
+STORAGE_QUOTA_MB = 0  # Space IMAGE_DIRECTORY may use; 0 = no quota, only STORAGE_MIN_FREE_MB applies
+STORAGE_MIN_FREE_MB = 256  # Free space kept on the card; images are evicted below it
+STORAGE_EVICTION_POLICY = "exported"  # "exported" (downloaded/archived only), "oldest" (exported first) or "off"
+
+app.config['USE_X_SENDFILE'] = IMAGE_X_SENDFILE
+
+# Ensure image directories exist
 os.makedirs(IMAGE_DIRECTORY, exist_ok=True)
+os.makedirs(THUMBNAIL_DIRECTORY, exist_ok=True)
+
+# --- Metrics ---
+# Always-on counters and histograms for /metrics (Prometheus text format).
+# Recording is a bisect plus a few additions under a per-metric lock, so it
+# stays cheap enough to leave on on a Zero W.
+
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _metric_labels(label, value):
+    return f'{{{label}="{value}"}}' if label else ''
+
+class Counter:
+    """Monotonic counter, optionally split by one label."""
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value=None, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda item: str(item[0]))
+        for label_value, value in values:
+            lines.append(f"{self.name}{_metric_labels(self.label, label_value)} {value}")
+        return lines
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self._read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self._read()}"]
+
+class Histogram:
+    """Fixed-bucket histogram, optionally split by one label."""
+
+    def __init__(self, name, help_text, label=None, buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, label_value=None):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted(((k, list(v[0]), v[1], v[2]) for k, v in self._series.items()),
+                              key=lambda item: str(item[0]))
+        for label_value, counts, total, count in snapshot:
+            prefix = f'{self.label}="{label_value}",' if self.label else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{_metric_labels(self.label, label_value)} {total:.6f}")
+            lines.append(f"{self.name}_count{_metric_labels(self.label, label_value)} {count}")
+        return lines
+
+class InstrumentedLock:
+    """threading.Lock that records wait time and contention under a name."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(blocking=False):
+            lock_wait_seconds.observe(0.0, self.name)
+            return True
+        if not blocking:
+            lock_contended_total.inc(self.name)
+            return False
+        lock_contended_total.inc(self.name)
+        wait_start = time.perf_counter()
+        acquired = self._lock.acquire(timeout=timeout)
+        lock_wait_seconds.observe(time.perf_counter() - wait_start, self.name)
+        if not acquired:
+            lock_timeouts_total.inc(self.name)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+stage_seconds = Histogram("rf_stage_seconds", "Time spent per pipeline stage", label="stage")
+lock_wait_seconds = Histogram("rf_lock_wait_seconds", "Time spent waiting to acquire a lock", label="lock")
+lock_contended_total = Counter("rf_lock_contended_total", "Lock acquisitions that had to wait", label="lock")
+lock_timeouts_total = Counter("rf_lock_timeouts_total", "Lock acquisitions that timed out", label="lock")
+camera_wake_seconds = Histogram("rf_camera_wake_seconds", "Camera start request to first frame",
+                                label="kind")
+camera_command_wait_seconds = Histogram("rf_camera_command_wait_seconds",
+                                        "Time camera commands spent queued for the camera thread", label="command")
+camera_command_seconds = Histogram("rf_camera_command_seconds", "Time camera commands ran on the camera thread",
+                                   label="command")
+camera_command_timeouts_total = Counter("rf_camera_command_timeouts_total",
+                                        "Camera commands whose caller stopped waiting", label="command")
+camera_commands_expired_total = Counter("rf_camera_commands_expired_total",
+                                        "Camera commands dropped because their deadline passed in the queue",
+                                        label="command")
+stream_frames_total = Counter("rf_stream_frames_total", "Stream frames by outcome", label="result")
+captures_total = Counter("rf_captures_total", "Capture jobs by outcome", label="result")
+memory_degradations_total = Counter("rf_memory_degradations_total",
+                                    "Actions taken to stay within MEMORY_BUDGET_MB", label="action")
+storage_writes_total = Counter("rf_storage_writes_total", "Image writes by outcome", label="result")
+storage_evictions_total = Counter("rf_storage_evictions_total", "Images deleted to stay within quota and free space",
+                                  label="reason")
+storage_write_seconds = Histogram("rf_storage_write_seconds", "Image write queued to durably on disk")
+snapshots_total = Counter("rf_snapshots_total", "Snapshot requests by how they were served", label="source")
+stream_encode_seconds_saved = Counter("rf_stream_encode_seconds_saved_total",
+                                      "Estimated encode time avoided by change detection", label="profile")
+stream_bytes_saved = Counter("rf_stream_bytes_saved_total",
+                             "Estimated bytes not sent to viewers because the scene was unchanged", label="profile")
+# Gauges read globals defined further down, at scrape time
+stream_viewers = Gauge("rf_stream_viewers", "Connected /video_feed viewers",
+                       lambda: total_viewers())
+camera_queue_depth = Gauge("rf_camera_queue_depth", "Commands waiting for the camera thread",
+                           lambda: camera_actor.queue_depth)
+capture_queue_depth = Gauge("rf_capture_queue_depth", "Capture jobs waiting to run",
+                            lambda: capture_queue.qsize())
+memory_tracked_bytes = Gauge("rf_memory_tracked_bytes", "Bytes held by the buffer consumers in the memory budget",
+                              lambda: memory_governor.total)
+storage_queue_depth = Gauge("rf_storage_queue_depth", "Encoded images waiting to be written",
+                            lambda: storage_manager.queue_depth)
+storage_free_bytes = Gauge("rf_storage_free_bytes", "Free space on the image filesystem at the last check",
+                           lambda: storage_manager.free_bytes or 0)
+postprocess_queue_depth = Gauge("rf_capture_postprocess_queue_depth", "Read-out frames waiting for encode and write",
+                                lambda: postprocess_queue.qsize())
+metrics_registry = [stage_seconds, lock_wait_seconds, lock_contended_total, lock_timeouts_total,
+                    camera_wake_seconds, camera_command_wait_seconds, camera_command_seconds, camera_command_timeouts_total,
+                    camera_commands_expired_total, stream_frames_total, captures_total, snapshots_total, memory_degradations_total,
+                    storage_writes_total, storage_evictions_total, storage_write_seconds, stream_encode_seconds_saved,
+                    stream_bytes_saved, stream_viewers,
+                    camera_queue_depth, capture_queue_depth, postprocess_queue_depth, storage_queue_depth,
+                    storage_free_bytes, memory_tracked_bytes]
+
+def observe_stage(stage, start):
+    """Records time.perf_counter() - start under rf_stage_seconds{stage=...}."""
+    stage_seconds.observe(time.perf_counter() - start, stage)
+
+def render_metrics():
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
 
 # --- Global State & Locks ---
-state_lock = threading.Lock()
-camera_lock = threading.Lock()
+state_lock = InstrumentedLock("state")
 blink_lock = threading.Lock()
 
 timer = time.time()
@@ -36,8 +249,6 @@ RPI_ZERO_MODE = True  # Optimize for Raspberry Pi Zero W (512MB RAM, single-core
 INACTIVITY_IDLE_TIMEOUT = 300  # 5 minutes to idle mode
 INACTIVITY_SHUTDOWN_TIMEOUT = 0  # DISABLED - No automatic shutdown
 CLIENT_TIMEOUT = 60  # Client idle timeout
-MONITOR_CHECK_INTERVAL = 10  # Reduce polling frequency (from 5s to 10s)
-VIDEO_STREAM_ACTIVE = False  # Track if video stream is being watched
 DEEP_SLEEP_ENABLED = False  # DISABLED - Aggressive power saving off
 
 # --- Camera Streaming Optimization (RPi Zero W) ---
@@ -46,63 +257,516 @@ STREAM_FRAMERATE = 10  # 10 FPS for smoothness on Zero (was 20 FPS)
 STREAM_JPEG_QUALITY = 50  # Reduced quality for faster encoding (was 60)
 STREAM_BUFFER_SIZE = 8  # Reduced buffer to save RAM on Zero
 STREAM_TIMEOUT = 30  # Timeout for stream operations
+STREAM_ENCODER = "auto"  # "auto" (fastest probed CPU backend), "opencv", "simplejpeg" or "picamera2" (hardware MJPEG, opt-in)
+ENCODER_PROBE_FRAMES = 5  # Synthetic frames encoded per backend when probing at startup
+
+# --- Adaptive Streaming ---
+ADAPTIVE_STREAM_ENABLED = True  # Adjust quality/frame rate at runtime instead of fixed frame skipping
+STREAM_TARGET_LATENCY = 0.25  # Target encode + send time per frame (seconds)
+STREAM_QUALITY_BOUNDS = (30, 70)  # Min/max JPEG quality the controller may use
+STREAM_FRAMERATE_BOUNDS = (2, STREAM_FRAMERATE)  # Min/max frame rate the controller may use
+STREAM_QUALITY_STEP = 5  # JPEG quality change per adjustment
+STREAM_ADAPT_INTERVAL = 2.0  # Seconds of measurements per controller decision
+
+# --- Stream Profiles ---
+# /video_feed?profile=<name>. "stream" picks the camera output: "main" at
+# STREAM_RESOLUTION or "lores", the ISP's hardware-scaled output at the
+# profile's resolution. Each profile has its own producer, started by its
+# first viewer and stopped with its last one.
+STREAM_PROFILES = {
+    "low": {"stream": "lores", "resolution": (240, 320), "quality": 40, "framerate": 5, "adaptive": False},
+    "medium": {"stream": "main", "resolution": STREAM_RESOLUTION, "quality": STREAM_JPEG_QUALITY,
+               "framerate": STREAM_FRAMERATE, "adaptive": ADAPTIVE_STREAM_ENABLED},
+    "high": {"stream": "main", "resolution": STREAM_RESOLUTION, "quality": 80, "framerate": STREAM_FRAMERATE,
+             "adaptive": False},
+}
+STREAM_DEFAULT_PROFILE = "medium"  # Served when no profile is requested; the only one using the hardware encoder
+
+# --- Change Detection ---
+CHANGE_DETECTION_ENABLED = False  # Skip the JPEG encode for stream frames that match the last one sent
+CHANGE_DETECTION_CELL = 16  # Thumbnail cell size in pixels; each cell averages 16 samples of the green channel
+CHANGE_DETECTION_THRESHOLD = 6  # Grey levels a cell must move by to count as changed
+CHANGE_DETECTION_MIN_AREA = 0.002  # Fraction of cells that must change before a new frame is encoded
+CHANGE_KEEPALIVE_INTERVAL = 2.0  # Seconds between re-sends of the last frame while the scene is static
+
+# --- Snapshots ---
+SNAPSHOT_MAX_AGE = 2.0  # /snapshot.jpg serves a cached stream frame up to this old (seconds); ?max_age= overrides
+SNAPSHOT_GRAB_TIMEOUT = 3.0  # How long snapshot requests wait for a fresh grab, camera start included (seconds)
+
+# --- State Events ---
+EVENTS_HISTORY = 100  # Recent events kept so a reconnecting /events client can catch up (Last-Event-ID)
+EVENTS_KEEPALIVE = 15.0  # Seconds between keep-alive comments on a quiet /events stream
+EVENTS_LONG_POLL_TIMEOUT = 30.0  # Longest /events?since= waits for an event (seconds)
 
 # --- Image Capture Optimization ---
 CAPTURE_RESOLUTION = (3840, 2160)  # High quality capture (4K resolution)
 CAPTURE_JPEG_QUALITY = 85  # High quality for captures
-AUTOFOCUS_TIMEOUT = 5  # Max time for autofocus
+AUTOFOCUS_TIMEOUT = 5  # Upper limit for autofocus; capture proceeds as soon as focus locks or fails
+AUTOFOCUS_SETTLE_FRAMES = 3  # Frames after AfTrigger before a stale Focused/Failed state is trusted
+CAPTURE_JOB_HISTORY = 50  # Finished capture jobs kept for /capture/<id>
+BURST_MAX_FRAMES = 20  # Upper limit for frames in one burst/interval job
+BURST_MAX_INTERVAL = 3600  # Longest allowed interval between scheduled frames (seconds)
+BURST_HOLD_STILL_INTERVAL = 2.0  # Stay in still mode between frames up to this interval (seconds)
+CAPTURE_QUEUE_LIMIT = 4  # Capture jobs allowed to wait for the camera; further requests get 503
+CAPTURE_POSTPROCESS_QUEUE = 1 if RPI_ZERO_MODE else 2  # Read-out frames waiting for encode + write (4K RGB is ~24 MB each)
+CAPTURE_EXIF_ENABLED = True  # Write capture time, UV LED state and exposure into each image's EXIF
+
+# --- Zero-Shutter-Lag Capture ---
+ZSL_ENABLED = False  # Keep a ring of recent high-res frames so captures need no mode switch or autofocus wait
+ZSL_RESOLUTIONS = [(3840, 2160), (2304, 1296), (1920, 1080), (1280, 720)]  # Largest that fits the budget is used
+ZSL_RING_FRAMES = 6  # Frames kept in the ring
+ZSL_FRAME_INTERVAL = 0.4  # Seconds between ring frames (ring covers FRAMES x INTERVAL, > capture button hold time)
+ZSL_MEMORY_BUDGET_MB = 48  # Max RAM for the ring (Zero W has 512 MB in total)
+ZSL_MIN_FREE_MB = 96  # Fall back to normal captures if free memory would drop below this
+ZSL_CAMERA_BUFFERS = 3  # Camera buffers while the high-res main stream is configured
+
+# --- Memory Budget ---
+MEMORY_BUDGET_MB = 128  # RAM the large buffers (camera, ZSL ring, stream frames, captures) may use together
+MEMORY_HIGH_WATER = 0.85  # Fraction of the budget from which new allocations are made smaller
+MEMORY_MIN_FREE_MB = 64  # System MemAvailable floor; below it the budget counts as exhausted
+MEMORY_REDUCED_CAMERA_BUFFERS = 3  # Camera buffers configured while memory is under pressure
+MEMORY_CAPTURE_DEFER_TIMEOUT = 30.0  # Longest a capture waits for memory before it fails (seconds)
+MEMORY_PROFILE_FRAMES = 5  # Stack depth recorded per allocation while profiling is on
+MEMORY_PROFILE_TOP = 15  # Allocation sites listed by /memory while profiling is on
+
+# --- Camera Actor ---
+CAMERA_COMMAND_TIMEOUT = 5.0  # Default deadline for a camera command (queue wait + run), seconds
+CAMERA_INIT_TIMEOUT = 10.0  # Deadline for camera start/stop commands, seconds
+CAPTURE_READOUT_TIMEOUT = 15.0  # Deadline for a full-resolution still readout, seconds
+CAMERA_LIVENESS_WINDOW = 2.0  # A frame this recent proves the camera is alive without probing it, seconds
+CAMERA_START_SETTLE = 0.5  # Settle time after a cold start (new Picamera2 + configure), seconds
+CAMERA_RESUME_SETTLE = 0.0  # Settle time after resuming the configured camera from idle, seconds
 
 # --- Threading Optimization ---
 FLASK_WORKERS = 1 if RPI_ZERO_MODE else 4  # Single worker for Zero W
 FLASK_THREADS = 2 if RPI_ZERO_MODE else 4  # Limited threads for Zero W
+SERVER_MODE = "threaded"  # "threaded" (Flask server, thread per connection) or "async" (asyncio, needs aiohttp)
+ASYNC_EXECUTOR_WORKERS = FLASK_THREADS  # Threads for blocking camera/GPIO/route calls in async mode
+ASYNC_MAX_PENDING = 32  # Requests allowed to wait for an executor thread before new ones get 503
 
 # --- Hardware Setup ---
 # Configure camera but DON'T start it immediately - only start on demand
 camera = None
 camera_initialized = False
 
+stream_source = ("main", "XBGR8888")  # (camera stream, format) the live stream reads from
+lores_resolution = None  # Size of the camera's lores output, None when it is not configured
+camera_mode = "preview"  # "still" while a burst holds the sensor in still mode; only the camera thread changes it
+
+# --- Camera Actor ---
+
+class CameraCommandExpired(Exception):
+    """A camera command's deadline passed before the camera thread got to it."""
+
+class CameraActor:
+    """Owns the camera: every hardware call runs on one thread, in submission order.
+
+    Callers submit a function and wait on a Future with a deadline instead of
+    taking a lock, so nothing else in the app (state_lock, request threads,
+    the monitors) ever blocks behind camera I/O it did not ask for. A command
+    still queued when its deadline passes is dropped rather than run late.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def on_camera_thread(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, name, fn, *args, deadline=CAMERA_COMMAND_TIMEOUT):
+        """Queues fn(*args) for the camera thread and returns its Future."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="camera", daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((name, fn, args, future, time.perf_counter(), time.monotonic() + deadline))
+        return future
+
+    def call(self, name, fn, *args, timeout=CAMERA_COMMAND_TIMEOUT):
+        """Runs fn(*args) on the camera thread and returns its result.
+
+        Raises TimeoutError if it has not finished within timeout seconds
+        (a command that never started is then cancelled), and re-raises
+        whatever the command raised. Calls made from the camera thread
+        itself run inline.
+        """
+        if self.on_camera_thread():
+            return fn(*args)
+        future = self.submit(name, fn, *args, deadline=timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:  # Only an alias of the builtin TimeoutError from Python 3.11
+            future.cancel()
+            camera_command_timeouts_total.inc(name)
+            raise TimeoutError(f"camera command '{name}' did not finish within {timeout}s")
+
+    def _run(self):
+        while True:
+            name, fn, args, future, queued_at, deadline = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue  # Caller gave up before we got here
+            started = time.perf_counter()
+            camera_command_wait_seconds.observe(started - queued_at, name)
+            if time.monotonic() > deadline:
+                camera_commands_expired_total.inc(name)
+                future.set_exception(CameraCommandExpired(f"camera command '{name}' expired in queue"))
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                camera_command_seconds.observe(time.perf_counter() - started, name)
+
+camera_actor = CameraActor()
+
+def available_memory_mb():
+    """MemAvailable from /proc/meminfo in MB, or None where it cannot be read."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+# --- Memory Governor ---
+
+class MemoryBudgetExceeded(RuntimeError):
+    """No memory could be found for an allocation within its deadline."""
+
+class MemoryGovernor:
+    """Accounts the large buffers per consumer and keeps them within MEMORY_BUDGET_MB.
+
+    Long-lived consumers (camera buffers, ZSL ring, stream frames, encoded
+    frames) report their size as it changes; captures reserve their
+    full-resolution frame before the readout and release it once saved.
+    Under pressure the rest of the app degrades instead of allocating: the
+    camera is configured with fewer buffers, new viewers of streams that are
+    not already running are refused, extra stream profiles are shed, and
+    captures wait (status "deferred") until earlier ones are saved.
+    A tracemalloc profiling mode can be switched on at runtime.
+    """
+
+    def __init__(self, budget_mb):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self._cond = threading.Condition()
+        self._current = {}
+        self._peak = {}
+        self._peak_total = 0
+        self._total = 0
+
+    @property
+    def total(self):
+        with self._cond:
+            return self._total
+
+    def _account(self, consumer, delta):
+        """Applies a size change; caller holds the lock."""
+        current = max(0, self._current.get(consumer, 0) + delta)
+        self._total += current - self._current.get(consumer, 0)
+        self._current[consumer] = current
+        self._peak[consumer] = max(self._peak.get(consumer, 0), current)
+        self._peak_total = max(self._peak_total, self._total)
+        if delta < 0:
+            self._cond.notify_all()
+
+    def set(self, consumer, nbytes):
+        with self._cond:
+            self._account(consumer, nbytes - self._current.get(consumer, 0))
+
+    def add(self, consumer, nbytes):
+        with self._cond:
+            self._account(consumer, nbytes)
+
+    def release(self, consumer, nbytes):
+        if nbytes:
+            self.add(consumer, -nbytes)
+
+    def _fits(self, nbytes):
+        if self._total + nbytes > self.budget:
+            return False
+        available = available_memory_mb()
+        return available is None or available - nbytes / (1024 * 1024) >= MEMORY_MIN_FREE_MB
+
+    def pressure(self):
+        """"ok", "high" (past MEMORY_HIGH_WATER) or "critical" (budget or system memory exhausted)."""
+        with self._cond:
+            used = self._total / self.budget
+        available = available_memory_mb()
+        if used >= 1.0 or (available is not None and available < MEMORY_MIN_FREE_MB):
+            return "critical"
+        if used >= MEMORY_HIGH_WATER or (available is not None and available < MEMORY_MIN_FREE_MB * 1.5):
+            return "high"
+        return "ok"
+
+    def reserve(self, consumer, nbytes, timeout=0.0, on_wait=None):
+        """Accounts nbytes to consumer once they fit, waiting up to timeout.
+
+        on_wait runs once, outside the lock, if the reservation has to wait.
+        Raises MemoryBudgetExceeded when the deadline passes.
+        """
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._cond:
+                if self._fits(nbytes):
+                    self._account(consumer, nbytes)
+                    return nbytes
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if waited:
+                    # Released buffers notify; system memory is re-read at least every second
+                    self._cond.wait(min(remaining, 1.0))
+                    continue
+            waited = True
+            if on_wait is not None:
+                on_wait()
+        memory_degradations_total.inc(f"{consumer}_refused")
+        raise MemoryBudgetExceeded(f"no memory for {nbytes / (1024 * 1024):.0f} MB of {consumer} "
+                                   f"within {timeout:.0f}s")
+
+    def camera_buffer_count(self, wanted):
+        """Buffers to configure the camera with: fewer while memory is under pressure."""
+        if wanted > MEMORY_REDUCED_CAMERA_BUFFERS and self.pressure() != "ok":
+            memory_degradations_total.inc("camera_buffers_reduced")
+            logging.warning(f"Memory under pressure: configuring {MEMORY_REDUCED_CAMERA_BUFFERS} camera buffers "
+                            f"instead of {wanted}")
+            return MEMORY_REDUCED_CAMERA_BUFFERS
+        return wanted
+
+    def set_profiling(self, enabled):
+        """Starts or stops tracemalloc; tracing slows allocations noticeably while on."""
+        import tracemalloc
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_PROFILE_FRAMES)
+            logging.info("Memory profiling started")
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logging.info("Memory profiling stopped")
+
+    def _profile(self):
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        )).statistics('traceback')
+        return {
+            'traced_mb': round(current / (1024 * 1024), 2),
+            'traced_peak_mb': round(peak / (1024 * 1024), 2),
+            'top': [{
+                'size_kb': round(stat.size / 1024, 1),
+                'count': stat.count,
+                'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            } for stat in statistics[:MEMORY_PROFILE_TOP]],
+        }
+
+    def status(self):
+        mb = lambda nbytes: round(nbytes / (1024 * 1024), 2)
+        with self._cond:
+            consumers = {name: {'current_mb': mb(self._current[name]), 'peak_mb': mb(self._peak[name])}
+                         for name in sorted(self._current)}
+            total, peak_total = self._total, self._peak_total
+        available = available_memory_mb()
+        return {
+            'budget_mb': mb(self.budget),
+            'tracked_mb': mb(total),
+            'tracked_peak_mb': mb(peak_total),
+            'available_mb': round(available, 1) if available is not None else None,
+            'pressure': self.pressure(),
+            'consumers': consumers,
+            'profile': self._profile(),
+        }
+
+memory_governor = MemoryGovernor(MEMORY_BUDGET_MB)
+
+def choose_zsl_resolution():
+    """Largest ZSL resolution whose ring fits the budget and leaves ZSL_MIN_FREE_MB free.
+
+    Returns None when ZSL is disabled or memory is too tight, in which case
+    the camera is configured for streaming only and captures use the normal
+    mode-switch path.
+    """
+    if not ZSL_ENABLED:
+        return None
+    available = available_memory_mb()
+    for width, height in ZSL_RESOLUTIONS:
+        # Ring frames plus the spare swapped out while a capture is saved
+        ring_mb = (ZSL_RING_FRAMES + 1) * width * height * 3 / (1024 * 1024)
+        if ring_mb > ZSL_MEMORY_BUDGET_MB:
+            continue
+        if available is not None and available - ring_mb < ZSL_MIN_FREE_MB:
+            logging.warning(f"ZSL disabled: {available:.0f} MB free, ring needs {ring_mb:.0f} MB")
+            return None
+        return (width, height)
+    logging.warning(f"ZSL disabled: no resolution fits a {ZSL_MEMORY_BUDGET_MB} MB ring")
+    return None
+
+class CameraLifecycle:
+    """Liveness and wake-up bookkeeping for the camera.
+
+    Successful frame grabs mark the camera live, so initialize_camera() on a
+    running camera costs nothing while frames are flowing and probes with a
+    single metadata read only once they have gone stale. A failed grab marks
+    it failed, and only then is Picamera2 torn down and re-created. Idle
+    stops the camera but keeps it configured, so waking is a camera.start().
+    Methods that touch the camera run on the camera thread.
+    """
+
+    def __init__(self):
+        self.state = "closed"  # "closed", "stopped" (configured, ready to resume) or "running"
+        self.configured_for = None  # ZSL resolution (or None) the stopped camera is configured for
+        self.failed = False
+        self.last_frame_at = None
+        self._wake = None  # (kind, requested at) until the first frame after a start arrives
+        self.last_wake = None
+        self.wake_history = deque(maxlen=20)
+
+    def frame_ok(self):
+        now = time.monotonic()
+        self.last_frame_at = now
+        self.failed = False
+        if self._wake is not None:
+            kind, requested_at = self._wake
+            self._wake = None
+            seconds = now - requested_at
+            camera_wake_seconds.observe(seconds, kind)
+            self.last_wake = {'kind': kind, 'ms': round(seconds * 1000, 1)}
+            self.wake_history.append(self.last_wake)
+            logging.info(f"Camera {kind} start: first frame after {seconds * 1000:.0f} ms")
+
+    def frame_failed(self):
+        self.failed = True
+
+    def is_live(self):
+        """True if a frame arrived within CAMERA_LIVENESS_WINDOW and nothing has failed since."""
+        return (self.state == "running" and not self.failed and self.last_frame_at is not None
+                and time.monotonic() - self.last_frame_at < CAMERA_LIVENESS_WINDOW)
+
+    def started(self, kind, requested_at):
+        self.state = "running"
+        self.failed = False
+        self._wake = (kind, requested_at)
+
+    def status(self):
+        age = None if self.last_frame_at is None else round((time.monotonic() - self.last_frame_at) * 1000)
+        return {
+            'state': self.state,
+            'failed': self.failed,
+            'last_frame_age_ms': age,
+            'last_wake': self.last_wake,
+            'wake_ms': [wake['ms'] for wake in self.wake_history],
+        }
+
+camera_lifecycle = CameraLifecycle()
+
 def initialize_camera():
-    """Lazy initialization of camera with optimized settings for RPi Zero W."""
-    global camera, camera_initialized
+    """Makes sure the camera is running (on the camera thread); returns camera_initialized."""
+    if camera_initialized and camera_lifecycle.is_live():
+        return True  # Frames are flowing; no need to queue behind them
+    requested_at = time.monotonic()
+    try:
+        camera_actor.call("initialize", _initialize_camera, requested_at, timeout=CAMERA_INIT_TIMEOUT)
+    except Exception as e:
+        logging.error(f"Camera initialization did not complete: {e}")
+    return camera_initialized
+
+def _initialize_camera(requested_at):
+    """Running camera: cached liveness or one cheap probe. Stopped camera: resume. Otherwise a full start."""
+    global camera, camera_initialized, camera_mode
     if camera_initialized and camera:
-        # Check if camera is still functional
+        if camera_lifecycle.is_live():
+            return
+        if not camera_lifecycle.failed:
+            try:
+                # Frames have gone stale (nobody streaming); one metadata read proves it is alive
+                camera.capture_metadata()
+                camera_lifecycle.frame_ok()
+                return
+            except Exception as e:
+                logging.warning(f"Camera appears to be initialized but not responsive: {e}")
+        # Real failure: fall through to a full re-create
+        _close_camera()
+    
+    zsl_resolution = choose_zsl_resolution()
+    if (camera and camera_lifecycle.state == "stopped" and not camera_lifecycle.failed
+            and camera_lifecycle.configured_for == zsl_resolution):
         try:
-            # Try a simple operation to verify camera is responsive
-            camera.capture_buffer("main")
+            # Fast resume: same Picamera2 instance and configuration, just restart streaming
+            camera.start()
+            camera_mode = "preview"
+            camera_initialized = True
+            camera_lifecycle.started("resume", requested_at)
+            if zsl_resolution:
+                frame_ring.allocate(zsl_resolution)
+            time.sleep(CAMERA_RESUME_SETTLE)
+            logging.info("Camera resumed")
             return
         except Exception as e:
-            logging.warning(f"Camera appears to be initialized but not responsive: {e}")
-            # Try to restart camera
-            try:
-                camera.stop()
-            except:
-                pass
-            camera_initialized = False
+            logging.warning(f"Camera resume failed, re-creating: {e}")
+            _close_camera()
+    
+    _create_camera(zsl_resolution, requested_at)
+
+def _create_camera(zsl_resolution, requested_at):
+    """Cold start: new Picamera2 instance, full configuration, then start."""
+    global camera, camera_initialized, stream_source, lores_resolution, camera_mode
     
     # Clean up any existing camera instance
-    if camera:
-        try:
-            camera.stop()
-        except:
-            pass
-        camera = None
+    _close_camera()
     
     try:
         camera = Picamera2()
         transform = Transform(rotation=90)
         
-        # Optimize camera configuration for RPi Zero W
-        # Use proper format for streaming
-        main_config = {
-            "format": 'XBGR8888',  # Using XBGR for better OpenCV compatibility
-            "size": STREAM_RESOLUTION
-        }
-        
-        camera.configure(camera.create_preview_configuration(
-            main=main_config,
-            transform=transform,
-            buffer_count=STREAM_BUFFER_SIZE
-        ))
+        if zsl_resolution:
+            # Full-size frames for the ZSL ring on main; the stream comes from
+            # the ISP's hardware-scaled lores output so it costs no CPU resize
+            buffer_count = memory_governor.camera_buffer_count(ZSL_CAMERA_BUFFERS)
+            camera.configure(camera.create_preview_configuration(
+                main={"format": "RGB888", "size": zsl_resolution},
+                lores={"format": "YUV420", "size": STREAM_RESOLUTION},
+                transform=transform,
+                buffer_count=buffer_count
+            ))
+            stream_source = ("lores", "YUV420")
+            lores_resolution = STREAM_RESOLUTION
+            memory_governor.set("camera_buffers", _camera_buffer_bytes(zsl_resolution, 3, lores_resolution,
+                                                                       buffer_count))
+        else:
+            # Optimize camera configuration for RPi Zero W
+            # Use proper format for streaming
+            main_config = {
+                "format": 'XBGR8888',  # Using XBGR for better OpenCV compatibility
+                "size": STREAM_RESOLUTION
+            }
+            
+            # Profiles on "lores" get their frames scaled by the ISP, not the CPU
+            lores_sizes = [profile["resolution"] for profile in STREAM_PROFILES.values()
+                           if profile["stream"] == "lores"]
+            lores_resolution = max(lores_sizes) if lores_sizes else None
+            buffer_count = memory_governor.camera_buffer_count(STREAM_BUFFER_SIZE)
+            camera.configure(camera.create_preview_configuration(
+                main=main_config,
+                lores={"format": "YUV420", "size": lores_resolution} if lores_resolution else None,
+                transform=transform,
+                buffer_count=buffer_count
+            ))
+            stream_source = ("main", "XBGR8888")
+            memory_governor.set("camera_buffers", _camera_buffer_bytes(STREAM_RESOLUTION, 4, lores_resolution,
+                                                                       buffer_count))
+        camera_lifecycle.configured_for = zsl_resolution
         
         # Set controls before starting camera
         # Using automatic exposure for better adaptation to lighting conditions
@@ -117,35 +781,200 @@ def initialize_camera():
         })
         
         camera.start()
+        camera_mode = "preview"
+        camera_lifecycle.started("cold", requested_at)
         
         # Small delay to let camera settle
-        time.sleep(0.5)
+        time.sleep(CAMERA_START_SETTLE)
         
         camera_initialized = True
+        if zsl_resolution:
+            frame_ring.allocate(zsl_resolution)
+        else:
+            frame_ring.release()
         logging.info(f"Camera initialized (RPi Zero W mode: {RPI_ZERO_MODE})")
     except Exception as e:
         logging.error(f"Failed to initialize camera: {e}")
-        camera_initialized = False
-        if camera:
-            try:
-                camera.stop()
-            except:
-                pass
-            camera = None
+        _close_camera()
 
-def shutdown_camera():
-    """Gracefully shutdown camera to save power."""
+def _close_camera():
+    """Stops and releases the Picamera2 instance, ignoring errors from a broken camera."""
     global camera, camera_initialized
+    camera_initialized = False
+    if camera:
+        detach_stream_encoder()
+        try:
+            camera.stop()
+        except Exception:
+            pass
+        try:
+            camera.close()
+        except Exception:
+            pass
+        camera = None
+    camera_lifecycle.state = "closed"
+    camera_lifecycle.configured_for = None
+    memory_governor.set("camera_buffers", 0)
+
+def _camera_buffer_bytes(main_size, bytes_per_pixel, lores_size, buffer_count):
+    """Size of the camera's DMA buffers: every buffer holds a main and (if configured) a YUV420 lores frame."""
+    per_buffer = main_size[0] * main_size[1] * bytes_per_pixel
+    if lores_size:
+        per_buffer += lores_size[0] * lores_size[1] * 3 // 2
+    return per_buffer * buffer_count
+
+def suspend_camera():
+    """Stops streaming for idle but keeps the camera configured for a fast resume."""
+    try:
+        camera_actor.call("suspend", _suspend_camera, timeout=CAMERA_INIT_TIMEOUT)
+    except Exception as e:
+        logging.error(f"Camera suspend did not complete: {e}")
+
+def _suspend_camera():
+    global camera_initialized
     if camera_initialized and camera:
         try:
+            detach_stream_encoder()
             camera.stop()
-            camera.close()  # Properly close the camera
             camera_initialized = False
-            logging.info("Camera shutdown.")
+            camera_lifecycle.state = "stopped"
+            frame_ring.release()  # Give the ring's RAM back while the camera is off
+            logging.info("Camera stopped (configured, ready to resume).")
         except Exception as e:
-            logging.error(f"Failed to shutdown camera: {e}")
-        finally:
-            camera = None
+            logging.error(f"Failed to stop camera, closing it: {e}")
+            _close_camera()
+
+def shutdown_camera():
+    """Closes the camera completely (power off); the next start is a cold one."""
+    try:
+        camera_actor.call("shutdown", _shutdown_camera, timeout=CAMERA_INIT_TIMEOUT)
+    except Exception as e:
+        logging.error(f"Camera shutdown did not complete: {e}")
+
+def _shutdown_camera():
+    """Gracefully shutdown camera to save power."""
+    if camera:
+        frame_ring.release()  # Give the ring's RAM back while the camera is off
+        _close_camera()
+        logging.info("Camera shutdown.")
+
+# --- Zero-Shutter-Lag Ring ---
+
+class FrameRing:
+    """Memory-bounded ring of recent full-size frames for zero-shutter-lag captures.
+
+    All arrays are allocated once when the camera is configured. Storing a
+    frame copies the camera buffer into the oldest slot, and taking one swaps
+    it with a spare array, so a capture can be encoded and saved while the
+    ring keeps recording and nothing is allocated per frame.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = []
+        self._times = []
+        self._metadata = []
+        self._spare = None
+        self._next = 0
+
+    @property
+    def active(self):
+        with self._lock:
+            return bool(self._slots)
+
+    def allocate(self, resolution):
+        width, height = resolution
+        with self._lock:
+            if self._slots and self._slots[0].shape[:2] == (height, width):
+                return
+            self._slots = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(ZSL_RING_FRAMES)]
+            self._times = [None] * ZSL_RING_FRAMES
+            self._metadata = [None] * ZSL_RING_FRAMES
+            self._spare = np.empty((height, width, 3), dtype=np.uint8)
+            self._next = 0
+        memory_governor.set("zsl_ring", (ZSL_RING_FRAMES + 1) * width * height * 3)
+        ring_mb = (ZSL_RING_FRAMES + 1) * width * height * 3 / (1024 * 1024)
+        logging.info(f"ZSL ring allocated: {ZSL_RING_FRAMES} x {width}x{height} ({ring_mb:.0f} MB)")
+
+    def release(self):
+        with self._lock:
+            if not self._slots:
+                return
+            self._slots = []
+            self._times = []
+            self._metadata = []
+            self._spare = None
+        memory_governor.set("zsl_ring", 0)
+        logging.info("ZSL ring released")
+
+    def store(self, request):
+        """Copies the request's main stream into the oldest slot."""
+        with self._lock:
+            if not self._slots:
+                return
+            index = self._next
+            with MappedArray(request, "main") as mapped:
+                np.copyto(self._slots[index], mapped.array[:, :, :3])
+            self._times[index] = time.monotonic()
+            self._metadata[index] = request.get_metadata()
+            self._next = (index + 1) % len(self._slots)
+
+    def take(self, when):
+        """Removes and returns (frame, timestamp, metadata) for the frame closest to `when`.
+
+        Returns None if the ring holds no frames or a previous frame has not
+        been given back yet. Pass the frame to give_back() once it is saved.
+        """
+        with self._lock:
+            candidates = [i for i, t in enumerate(self._times) if t is not None]
+            if not candidates or self._spare is None:
+                return None
+            index = min(candidates, key=lambda i: abs(self._times[i] - when))
+            frame, frame_time, metadata = self._slots[index], self._times[index], self._metadata[index]
+            self._slots[index], self._times[index] = self._spare, None
+            self._spare = None
+            return frame, frame_time, metadata
+
+    def give_back(self, frame):
+        with self._lock:
+            if self._slots and self._spare is None and frame.shape == self._slots[0].shape:
+                self._spare = frame
+
+frame_ring = FrameRing()
+
+def zsl_recorder():
+    """Keeps the ZSL ring filled with recent main-stream frames while RUNNING."""
+    last_memory_check = time.monotonic()
+    while True:
+        time.sleep(ZSL_FRAME_INTERVAL)
+        if not frame_ring.active or system_state != SystemState.RUNNING or not camera_initialized:
+            continue
+        
+        # Give the memory back if the rest of the system needs it; captures
+        # then fall back to the normal mode-switch path
+        if time.monotonic() - last_memory_check > 10:
+            last_memory_check = time.monotonic()
+            available = available_memory_mb()
+            if available is not None and available < ZSL_MIN_FREE_MB:
+                logging.warning(f"Memory tight ({available:.0f} MB free), releasing ZSL ring")
+                frame_ring.release()
+                continue
+        
+        try:
+            camera_actor.call("zsl_frame", _store_ring_frame, timeout=1.0)
+        except Exception as e:
+            logging.warning(f"ZSL frame grab failed: {e}")
+
+def _store_ring_frame():
+    """Camera-thread command: copies the current main-stream frame into the ZSL ring."""
+    if camera_mode != "preview" or not camera_initialized:
+        return
+    frame_request = camera.capture_request()
+    try:
+        frame_ring.store(frame_request)
+    finally:
+        frame_request.release()
+    camera_lifecycle.frame_ok()
 
 # Define the buttons and LEDs
 led1_button = Button(2)
@@ -175,13 +1004,88 @@ led2.off()  # Changed from .on() to save battery
 status_led.blink(on_time=0.5, off_time=0.5)  # Blink instead of solid for better battery
 power_indicator_led.on()  # Device is powered on
 
+# --- State Events ---
+
+class EventBus:
+    """Numbered history of state changes for /events (server-sent events or long-poll).
+
+    publish() appends an event and wakes waiting clients; ids only grow, so a
+    client resumes with the last id it saw. Kinds published with dedupe=True
+    (state, LEDs) are skipped when nothing actually changed.
+    """
+
+    def __init__(self, history):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self._last = {}  # kind -> data of its latest event, for dedupe
+        self._listeners = set()
+
+    @property
+    def last_id(self):
+        with self._cond:
+            return self._seq
+
+    def add_listener(self, callback):
+        """Registers a callback run after each publish (used by async mode)."""
+        with self._cond:
+            self._listeners.add(callback)
+
+    def remove_listener(self, callback):
+        with self._cond:
+            self._listeners.discard(callback)
+
+    def publish(self, kind, data, dedupe=False):
+        with self._cond:
+            if dedupe and self._last.get(kind) == data:
+                return
+            self._last[kind] = data
+            self._seq += 1
+            self._events.append({'id': self._seq, 'type': kind, 'time': round(time.time(), 3), 'data': data})
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    def _since(self, last_id):
+        if last_id == self._seq:
+            return []
+        if last_id > self._seq or not self._events or self._events[0]['id'] > last_id + 1:
+            return None  # From before a restart, or older than the history: resync from /state
+        return [event for event in self._events if event['id'] > last_id]
+
+    def since(self, last_id):
+        """Events after last_id, or None if some have already dropped out of the history."""
+        with self._cond:
+            return self._since(last_id)
+
+    def wait(self, last_id, timeout):
+        """Like since(), but blocks up to timeout for the first event; [] if none arrived."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = self._since(last_id)
+                if events != []:
+                    return events
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+
+event_bus = EventBus(EVENTS_HISTORY)
+
+def publish_leds():
+    """Pushes the UV LED states to /events if they changed."""
+    event_bus.publish("leds", {'UV_A': led1.is_active, 'UV_B': led2.is_active}, dedupe=True)
+
 # --- Helper Functions ---
 
 def update_timer():
-    """Safely update the global inactivity timer."""
+    """Safely update the global inactivity timer and re-arm the inactivity deadlines."""
     global timer
     with state_lock:
         timer = time.time()
+    arm_inactivity_deadlines()
 
 def set_system_state(new_state):
     """Updates the system state and sets status LED pattern accordingly."""
@@ -190,7 +1094,8 @@ def set_system_state(new_state):
     update_status_led()
 
 def update_status_led():
-    """Updates status LED based on current system state."""
+    """Updates status LED based on current system state; every state change passes through here."""
+    event_bus.publish("state", {'state': system_state, 'power_on': device_power_on}, dedupe=True)
     if system_state == SystemState.POWERED_OFF:
         # Off when powered off
         status_led.off()
@@ -253,6 +1158,8 @@ def power_on_device():
         system_state = SystemState.RUNNING
     logging.info("System boot complete - RUNNING")
     update_status_led()
+    # Powering on counts as activity; without it nothing would arm the idle/shutdown deadlines
+    update_timer()
 
 def power_off_device():
     """Powers off the device gracefully."""
@@ -283,206 +1190,1880 @@ def power_off_device():
     # Note: Device doesn't actually power off - stays in low-power state
     # This allows power button to wake it up
 
-def monitor_client():
-    """Periodically checks if the client has timed out - reduced polling frequency."""
-    timeout_duration = timedelta(seconds=CLIENT_TIMEOUT)
-    while True:
-        time.sleep(MONITOR_CHECK_INTERVAL)
-        
-        # Skip if device is powered off
-        if not device_power_on or system_state == SystemState.POWERED_OFF:
-            continue
-        
-        with state_lock:
-            if client_status['last_ping']:
-                if datetime.now() - client_status['last_ping'] > timeout_duration:
-                    client_status['status'] = False
-                    logging.info("Client timeout detected.")
-
-def shutdown_monitor():
-    """Handles automatic power-off and idle LED states - optimized for battery."""
-    global timer, system_state
-    idle_mode_active = False
+# --- Inactivity Scheduler ---
 
-    while True:
-        # Increased sleep interval to reduce CPU polling
-        time.sleep(MONITOR_CHECK_INTERVAL)
-        
-        # Skip all auto-shutdown logic since it's disabled
-        if INACTIVITY_SHUTDOWN_TIMEOUT == 0:
-            time.sleep(10)  # Just sleep and continue
-            continue
-            
-        with state_lock:
-            current_time = time.time()
-            duration = current_time - timer
-            is_client_active = client_status["status"]
-
-        # Power off after INACTIVITY_SHUTDOWN_TIMEOUT of inactivity and no active client
-        if duration > INACTIVITY_SHUTDOWN_TIMEOUT and not is_client_active:
-            logging.warning("Inactivity shutdown triggered.")
-            set_system_state(SystemState.SHUTTING_DOWN)
-            # Brief warning blinks before shutdown
-            for _ in range(3):
-                led1.toggle()
-                led2.toggle()
-                time.sleep(0.15)
-            time.sleep(1)  # Allow status LED to blink
-            shutdown_camera()  # Ensure camera is off before shutdown
-            check_call(['sudo', 'poweroff'])
-
-        # Enter idle mode after INACTIVITY_IDLE_TIMEOUT seconds
-        if duration > INACTIVITY_IDLE_TIMEOUT and not is_client_active:
-            if not idle_mode_active:
-                logging.info("Entering idle mode: Shutting down power-hungry components.")
-                if led1.is_active: 
-                    led1.off()
-                if led2.is_active: 
-                    led2.off()
-                shutdown_camera()  # Power down camera in idle
-                idle_mode_active = True
-                set_system_state(SystemState.IDLE)
-        else:
-            # Exit idle mode if activity occurred
-            if idle_mode_active:
-                idle_mode_active = False
-                logging.info("Exiting idle mode: Initializing camera.")
-                initialize_camera()
-                set_system_state(SystemState.RUNNING)
+class DeadlineScheduler:
+    """Runs callbacks at monotonic deadlines from a single thread.
 
-def capture_image():
-    """Captures a still image in high quality - optimized for RPi Zero W."""
-    global system_state
-    
+    Deadlines live in a heap keyed by name; scheduling a key again replaces
+    its deadline (the old heap entry is skipped when it surfaces). The thread
+    sleeps on a condition variable until the earliest deadline, or
+    indefinitely when nothing is armed, so an idle device is not woken.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []  # (deadline, sequence, key)
+        self._armed = {}  # key -> (sequence, callback)
+        self._sequence = 0
+        self._thread = None
+
+    def schedule(self, key, delay, callback):
+        """Runs callback after delay seconds, replacing any pending deadline for key."""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+                self._thread.start()
+            self._sequence += 1
+            self._armed[key] = (self._sequence, callback)
+            heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay), self._sequence, key))
+            self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            self._armed.pop(key, None)
+
+    def pending(self):
+        """{key: seconds until due} for armed deadlines."""
+        now = time.monotonic()
+        with self._cond:
+            live = {sequence: key for key, (sequence, _) in self._armed.items()}
+            return {live[sequence]: round(deadline - now, 3)
+                    for deadline, sequence, _ in self._heap if sequence in live}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    # Drop entries that were rescheduled or cancelled
+                    while self._heap and self._armed.get(self._heap[0][2], (None,))[0] != self._heap[0][1]:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                _, _, key = heapq.heappop(self._heap)
+                _, callback = self._armed.pop(key)
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Scheduled task '{key}' failed: {e}")
+
+scheduler = DeadlineScheduler()
+idle_mode_active = False
+
+def mark_client_active(activate=True):
+    """Records a client ping and arms the client-timeout deadline."""
     with state_lock:
         client_status['last_ping'] = datetime.now()
+        if activate:
+            client_status['status'] = True
+    scheduler.schedule('client_timeout', CLIENT_TIMEOUT, _client_timed_out)
+
+def arm_inactivity_deadlines():
+    """(Re)arms the idle and shutdown deadlines from the activity timer; wakes the device if idle."""
+    with state_lock:
+        last_activity = timer
+    elapsed = time.time() - last_activity
+    scheduler.schedule('idle', INACTIVITY_IDLE_TIMEOUT - elapsed, _check_inactivity)
+    if INACTIVITY_SHUTDOWN_TIMEOUT > 0:
+        scheduler.schedule('shutdown', INACTIVITY_SHUTDOWN_TIMEOUT - elapsed, _check_inactivity)
+    if idle_mode_active and elapsed < INACTIVITY_IDLE_TIMEOUT:
+        scheduler.schedule('wake', 0, _exit_idle)
+
+def _client_timed_out():
+    if not device_power_on or system_state == SystemState.POWERED_OFF:
+        return
+    with state_lock:
+        client_status['status'] = False
+    logging.info("Client timeout detected.")
+    # Idle or shutdown deadlines may have passed while the client kept the device up
+    _check_inactivity()
+
+def _check_inactivity():
+    """Runs when an inactivity deadline is due: powers off or enters idle unless a client is active."""
+    global idle_mode_active
+    if not device_power_on or system_state == SystemState.POWERED_OFF:
+        return
+    with state_lock:
+        duration = time.time() - timer
+        is_client_active = client_status["status"]
+    if is_client_active:
+        return  # Re-checked when the client times out
     
-    update_timer()
-    ledc.on()
-    
-    timestamp = datetime.now().strftime("%Y-%m-%dT%H_%M_%S")
-    filename = f"RF_pic_{timestamp}.jpeg"
-    path = os.path.join(IMAGE_DIRECTORY, filename)
-    
-    try:
-        # Ensure camera is initialized
-        if not camera_initialized:
-            initialize_camera()
-        
-        # Lock camera to prevent conflict with video stream
-        with camera_lock:
-            logging.info("Starting autofocus for high-quality capture...")
-            
-            # Set high-quality parameters before capture
-            camera.set_controls({
-                "AfMode": controls.AfModeEnum.Auto,
-                "AfTrigger": controls.AfTriggerEnum.Start,
-                "AeEnable": True,  # Use automatic exposure instead of fixed
-                "AnalogueGain": 1.0,
-                "ColorCorrectionMatrix": [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]  # Identity matrix for neutral colors
-            })
-            
-            # Wait for autofocus to complete
-            time.sleep(AUTOFOCUS_TIMEOUT)
-            
-            # Capture at full resolution for high quality
-            capture_config = camera.create_still_configuration(
-                main={"format": "RGB888", "size": CAPTURE_RESOLUTION}
-            )
-            camera.switch_mode_and_capture_file(capture_config, path)
-            
-            logging.info(f"High-quality capture complete: {path}")
-            
-    except Exception as e:
-        logging.error(f"Capture failed: {e}")
-        # Fallback: use basic capture
-        try:
-            with camera_lock:
-                camera.capture_file(path)
-                logging.info(f"Captured (fallback): {path}")
-        except Exception as e2:
-            logging.error(f"Fallback capture also failed: {e2}")
+    # Power off after INACTIVITY_SHUTDOWN_TIMEOUT of inactivity and no active client
+    if INACTIVITY_SHUTDOWN_TIMEOUT > 0 and duration >= INACTIVITY_SHUTDOWN_TIMEOUT:
+        logging.warning("Inactivity shutdown triggered.")
+        set_system_state(SystemState.SHUTTING_DOWN)
+        # Brief warning blinks before shutdown
+        for _ in range(3):
+            led1.toggle()
+            led2.toggle()
+            time.sleep(0.15)
+        time.sleep(1)  # Allow status LED to blink
+        shutdown_camera()  # Ensure camera is off before shutdown
+        check_call(['sudo', 'poweroff'])
+        return
     
-    finally:
-        time.sleep(0.3)  # Short feedback time
-        ledc.off()
+    # Enter idle mode after INACTIVITY_IDLE_TIMEOUT seconds
+    if duration >= INACTIVITY_IDLE_TIMEOUT and not idle_mode_active:
+        logging.info("Entering idle mode: Shutting down power-hungry components.")
+        if led1.is_active: 
+            led1.off()
+        if led2.is_active: 
+            led2.off()
+        publish_leds()
+        suspend_camera()  # Stop the camera in idle, keeping it configured for a fast wake
+        idle_mode_active = True
+        event_bus.publish("idle", {'active': True, 'inactive_seconds': round(duration)})
+        set_system_state(SystemState.IDLE)
 
-# --- Flask Routes ---
+def _exit_idle():
+    """Runs as soon as activity is recorded while idle."""
+    global idle_mode_active
+    if not idle_mode_active:
+        return
+    idle_mode_active = False
+    event_bus.publish("idle", {'active': False})
+    logging.info("Exiting idle mode: Initializing camera.")
+    initialize_camera()
+    set_system_state(SystemState.RUNNING)
 
-@app.route('/ping')
-def ping():
-    """Ping endpoint - should reset idle timer and wake device."""
-    global system_state
-    
-    with state_lock:
-        client_status['last_ping'] = datetime.now()
-        client_status['status'] = True
+class CaptureStatus:
+    QUEUED = "queued"
+    DEFERRED = "deferred"  # Waiting for memory before the readout
+    FOCUSING = "focusing"
+    EXPOSING = "exposing"
+    SAVING = "saving"
+    SAVED = "saved"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class CaptureRejected(Exception):
+    """The capture pipeline is full; the request should be retried later."""
+
+capture_queue = queue.Queue(maxsize=CAPTURE_QUEUE_LIMIT)
+capture_jobs = OrderedDict()  # Most recent CAPTURE_JOB_HISTORY jobs, oldest first
+capture_jobs_lock = threading.Lock()
+capture_worker_thread = None
+
+def _new_capture_job(kind, **fields):
+    job = {
+        'id': uuid.uuid4().hex[:12],
+        'kind': kind,
+        'status': CaptureStatus.QUEUED,
+        'filename': None,
+        'focus_state': None,
+        'error': None,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'timings': {},
+        '_queued_at': time.monotonic(),
+        '_cancel': threading.Event(),
+    }
+    job.update(fields)
+    return job
+
+def _enqueue_capture_job(job):
+    global capture_worker_thread
     
+    mark_client_active(activate=False)
     update_timer()
     
-    # Wake up from idle if needed
-    if system_state == SystemState.IDLE:
+    try:
+        storage_manager.admit()
+    except StorageFull as e:
+        captures_total.inc("rejected")
+        raise CaptureRejected(str(e)) from None
+    # Refuse rather than pile full-resolution frames up in RAM
+    if postprocess_queue.full():
+        captures_total.inc("rejected")
+        raise CaptureRejected("captures are still being saved")
+    with capture_jobs_lock:
+        try:
+            capture_queue.put_nowait(job)
+        except queue.Full:
+            captures_total.inc("rejected")
+            raise CaptureRejected(f"{CAPTURE_QUEUE_LIMIT} captures already waiting") from None
+        capture_jobs[job['id']] = job
+        while len(capture_jobs) > CAPTURE_JOB_HISTORY:
+            capture_jobs.popitem(last=False)
+        if capture_worker_thread is None:
+            capture_worker_thread = threading.Thread(target=capture_worker, daemon=True)
+            capture_worker_thread.start()
+    start_postprocess_worker()
+    logging.info(f"Capture job {job['id']} ({job['kind']}) queued")
+    return job['id']
+
+def submit_capture(trigger_at=None):
+    """Queues a still capture and returns its job id; the capture worker does the rest.
+
+    Raises CaptureRejected when the queue or the post-processing backlog is full.
+    trigger_at is the time.monotonic() moment the user wanted; with ZSL the
+    ring frame closest to it is saved. Defaults to now.
+    """
+    return _enqueue_capture_job(_new_capture_job(
+        'single',
+        source=None,
+        _trigger_at=trigger_at if trigger_at is not None else time.monotonic(),
+    ))
+
+def submit_burst(count, interval=0.0):
+    """Queues `count` stills spaced `interval` seconds apart (0 = back-to-back)."""
+    return _enqueue_capture_job(_new_capture_job(
+        'burst',
+        count=count,
+        interval=interval,
+        filenames=[],
+        frames=[],
+    ))
+
+def cancel_capture_job(job_id):
+    """Asks a queued or running job to stop before its next frame. False if unknown."""
+    with capture_jobs_lock:
+        job = capture_jobs.get(job_id)
+    if job is None:
+        return False
+    job['_cancel'].set()
+    return True
+
+def get_capture_job(job_id):
+    """Returns a JSON-ready copy of a capture job, or None if unknown or expired."""
+    with capture_jobs_lock:
+        job = capture_jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = {}
+        for key, value in job.items():
+            if key.startswith('_'):
+                continue
+            if isinstance(value, dict):
+                value = dict(value)
+            elif isinstance(value, list):
+                value = [dict(item) if isinstance(item, dict) else item for item in value]
+            snapshot[key] = value
+        return snapshot
+
+def _update_capture_job(job, **changes):
+    with capture_jobs_lock:
+        job.update(changes)
+    if changes.get('status') in (CaptureStatus.SAVED, CaptureStatus.FAILED, CaptureStatus.CANCELLED):
+        captures_total.inc(changes['status'])
+        event_bus.publish("capture", {'job_id': job['id'], 'kind': job['kind'], 'status': job['status'],
+                                      'filename': job['filename'], 'error': job['error']})
+
+def _record_capture_timing(job, name, start):
+    with capture_jobs_lock:
+        job['timings'][name] = round((time.monotonic() - start) * 1000, 1)
+
+def wait_for_autofocus(timeout=None):
+    """Watches per-frame AfState metadata until an autofocus cycle finishes.
+
+    Returns "focused", "failed", "timeout" or "unsupported" (no AfState in
+    the metadata, i.e. a fixed-focus module). AUTOFOCUS_TIMEOUT is only the
+    upper limit; normally this returns as soon as focus locks.
+    """
+    timeout = AUTOFOCUS_TIMEOUT if timeout is None else timeout
+    stage_start = time.perf_counter()
+    try:
+        return _wait_for_autofocus(timeout)
+    finally:
+        observe_stage("autofocus", stage_start)
+
+def _wait_for_autofocus(timeout):
+    deadline = time.monotonic() + timeout
+    frames = 0
+    scanning_seen = False
+    while time.monotonic() < deadline:
+        # One command per frame, so stream frames interleave with the polling
+        metadata = camera_actor.call("capture_metadata", lambda: camera.capture_metadata())
+        af_state = metadata.get("AfState")
+        if af_state is None:
+            return "unsupported"
+        frames += 1
+        if af_state == controls.AfStateEnum.Scanning:
+            scanning_seen = True
+            continue
+        # The first frames after AfTrigger may still carry the previous cycle's
+        # result, so only trust a final state once scanning has been seen
+        if not scanning_seen and frames <= AUTOFOCUS_SETTLE_FRAMES:
+            continue
+        if af_state == controls.AfStateEnum.Focused:
+            return "focused"
+        if af_state == controls.AfStateEnum.Failed:
+            return "failed"
+    logging.warning(f"Autofocus did not settle within {timeout}s")
+    return "timeout"
+
+def capture_worker():
+    """Runs queued capture jobs one at a time."""
+    while True:
+        job = capture_queue.get()
+        try:
+            if job['_cancel'].is_set():
+                _update_capture_job(job, status=CaptureStatus.CANCELLED)
+            elif job['kind'] == 'burst':
+                run_burst_job(job)
+            else:
+                run_capture_job(job)
+        except Exception as e:
+            logging.error(f"Capture job {job['id']} crashed: {e}")
+            _update_capture_job(job, status=CaptureStatus.FAILED, error=str(e))
+        finally:
+            capture_queue.task_done()
+
+reserved_filenames = set()  # Names handed out whose files are not written yet
+reserved_filenames_lock = threading.Lock()
+
+def _new_capture_filename(index=None):
+    """RF_pic_<timestamp>[_<index>].jpeg, with a counter if that second is already taken.
+
+    The name stays reserved until release_capture_filename(), since the file
+    itself is written later by the post-processing worker.
+    """
+    timestamp = datetime.now().strftime("%Y-%m-%dT%H_%M_%S")
+    stem = f"RF_pic_{timestamp}" if index is None else f"RF_pic_{timestamp}_{index:03d}"
+    filename = f"{stem}.jpeg"
+    counter = 1
+    with reserved_filenames_lock:
+        while filename in reserved_filenames or os.path.exists(os.path.join(IMAGE_DIRECTORY, filename)):
+            filename = f"{stem}-{counter}.jpeg"
+            counter += 1
+        reserved_filenames.add(filename)
+    return filename
+
+def release_capture_filename(filename):
+    with reserved_filenames_lock:
+        reserved_filenames.discard(filename)
+
+# --- Capture Post-Processing ---
+
+postprocess_queue = queue.Queue(maxsize=CAPTURE_POSTPROCESS_QUEUE)
+postprocess_thread = None
+
+def _exif_ifd(entries, offset):
+    """Packs one little-endian TIFF IFD starting at `offset`, followed by its out-of-line values."""
+    entries = sorted(entries)
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    table, data = [], b''
+    for tag, kind, count, value in entries:
+        if len(value) <= 4:
+            field = value.ljust(4, b'\0')
+        else:
+            field = struct.pack('<I', data_offset + len(data))
+            data += value + (b'\0' if len(value) % 2 else b'')
+        table.append(struct.pack('<HHI', tag, kind, count) + field)
+    return struct.pack('<H', len(entries)) + b''.join(table) + struct.pack('<I', 0) + data
+
+def _exif_segment(fields):
+    """APP1 EXIF segment with the capture time, UV LED state and exposure settings.
+
+    ImageDescription holds the UV LED state, the Exif IFD the exposure time,
+    ISO equivalent of the analogue gain and the capture time, and
+    UserComment every field as JSON for tools that want the raw values.
+    """
+    ascii_value = lambda text: text.encode('ascii', 'replace') + b'\0'
+    taken = fields['time'].strftime("%Y:%m:%d %H:%M:%S")
+    description = ascii_value(f"UV_A={'on' if fields['uv_a'] else 'off'} UV_B={'on' if fields['uv_b'] else 'off'}")
+    comment = b'ASCII\0\0\0' + json.dumps({k: v for k, v in fields.items() if k != 'time'}).encode()
+    exif_entries = [
+        (0x9003, 2, 20, ascii_value(taken)),  # DateTimeOriginal
+        (0x9286, 7, len(comment), comment),  # UserComment
+    ]
+    if fields.get('exposure_us'):
+        exif_entries.append((0x829A, 5, 1, struct.pack('<II', int(fields['exposure_us']), 1000000)))  # ExposureTime
+    if fields.get('analogue_gain'):
+        iso = min(65535, round(fields['analogue_gain'] * 100))
+        exif_entries.append((0x8827, 3, 1, struct.pack('<H', iso)))  # ISOSpeedRatings
+    ifd0_entries = [
+        (0x010E, 2, len(description), description),  # ImageDescription
+        (0x0132, 2, 20, ascii_value(taken)),  # DateTime
+    ]
+    # IFD0 size does not depend on the pointer's value, so measure it with a placeholder
+    pointer = lambda offset: (0x8769, 4, 1, struct.pack('<I', offset))  # ExifIFD
+    exif_offset = 8 + len(_exif_ifd(ifd0_entries + [pointer(0)], 8))
+    tiff = (b'II*\0' + struct.pack('<I', 8) + _exif_ifd(ifd0_entries + [pointer(exif_offset)], 8)
+            + _exif_ifd(exif_entries, exif_offset))
+    payload = b'Exif\0\0' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+def _capture_exif_fields(metadata):
+    """EXIF fields for a frame read out now: wall-clock time, UV LED state and the frame's exposure."""
+    metadata = metadata or {}
+    fields = {
+        'time': datetime.now(),
+        'uv_a': led1.is_active,
+        'uv_b': led2.is_active,
+        'exposure_us': metadata.get('ExposureTime'),
+        'analogue_gain': metadata.get('AnalogueGain'),
+        'lens_position': metadata.get('LensPosition'),
+    }
+    if metadata.get('ColourGains'):
+        fields['colour_gains'] = list(metadata['ColourGains'])
+    return fields
+
+def _save_jpeg(image, path, exif_fields=None):
+    """Encodes at CAPTURE_JPEG_QUALITY, adds EXIF and queues the write; returns the storage manager's Future."""
+    stage_start = time.perf_counter()
+    ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, CAPTURE_JPEG_QUALITY])
+    if not ret:
+        raise RuntimeError("JPEG encoding failed")
+    data = buffer.tobytes()
+    if exif_fields is not None and CAPTURE_EXIF_ENABLED:
+        data = data[:2] + _exif_segment(exif_fields) + data[2:]  # Right after SOI
+    observe_stage("capture_encode", stage_start)
+    return storage_manager.write(path, data)
+
+def queue_postprocess(image, path, exif_fields, done, reserved=0):
+    """Hands a read-out frame to the post-processing worker; blocks while its queue is full.
+
+    done(error) runs once the file is durably written (error None) or failed,
+    on the storage writer thread. The frame's `reserved` capture_frames bytes
+    are released as soon as it is encoded.
+    """
+    start_postprocess_worker()
+    postprocess_queue.put((image, path, exif_fields, done, reserved))
+
+def start_postprocess_worker():
+    global postprocess_thread
+    with capture_jobs_lock:
+        if postprocess_thread is None:
+            postprocess_thread = threading.Thread(target=postprocess_worker, name="postprocess", daemon=True)
+            postprocess_thread.start()
+
+def postprocess_worker():
+    """Encodes captured frames in order, off the capture worker, and queues them for writing."""
+    while True:
+        image, path, exif_fields, done, reserved = postprocess_queue.get()
+        try:
+            written = _save_jpeg(image, path, exif_fields)
+        except Exception as e:
+            logging.error(f"Saving {os.path.basename(path)} failed: {e}")
+            written = Future()
+            written.set_exception(e)
+        del image
+        memory_governor.release("capture_frames", reserved)
+        written.add_done_callback(lambda future, path=path, done=done: _capture_written(path, done, future))
+        postprocess_queue.task_done()
+
+def _capture_written(path, done, future):
+    """Write completion: frees the reserved file name and reports to the capture job."""
+    release_capture_filename(os.path.basename(path))
+    try:
+        done(future.exception())
+    except Exception as e:
+        logging.error(f"Capture completion for {os.path.basename(path)} failed: {e}")
+
+def _reserve_capture_memory(job):
+    """Accounts one full-resolution frame before its readout, deferring the job while memory is short.
+
+    While it waits the job reports "deferred" and extra stream profiles are
+    shed so their buffers free up. Returns the bytes to release once the
+    frame is saved; raises MemoryBudgetExceeded after MEMORY_CAPTURE_DEFER_TIMEOUT.
+    """
+    width, height = CAPTURE_RESOLUTION
+    previous_status = job['status']
+    
+    def deferred():
+        memory_degradations_total.inc("capture_deferred")
+        logging.warning(f"Capture {job['id']} deferred: waiting for memory")
+        _update_capture_job(job, status=CaptureStatus.DEFERRED)
+        shed_stream_profiles()
+    
+    reserved = memory_governor.reserve("capture_frames", width * height * 3, MEMORY_CAPTURE_DEFER_TIMEOUT, deferred)
+    if job['status'] == CaptureStatus.DEFERRED:
+        _update_capture_job(job, status=previous_status)
+    return reserved
+
+def _capture_still(job):
+    """Autofocuses on the live preview, then reads out one full-resolution still."""
+    _update_capture_job(job, status=CaptureStatus.FOCUSING)
+    logging.info("Starting autofocus for high-quality capture...")
+    focus_start = time.monotonic()
+    # Set high-quality parameters before capture
+    camera_actor.call("set_controls", lambda: camera.set_controls({
+        "AfMode": controls.AfModeEnum.Auto,
+        "AfTrigger": controls.AfTriggerEnum.Start,
+        "AeEnable": True,  # Use automatic exposure instead of fixed
+        "AnalogueGain": 1.0,
+        "ColorCorrectionMatrix": [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]  # Identity matrix for neutral colors
+    }))
+    
+    # Wait for autofocus to lock or fail; the stream keeps running meanwhile
+    focus_state = wait_for_autofocus()
+    _record_capture_timing(job, 'focus_ms', focus_start)
+    _update_capture_job(job, focus_state=focus_state)
+    
+    _update_capture_job(job, status=CaptureStatus.EXPOSING)
+    exposure_start = time.monotonic()
+    image, metadata = camera_actor.call("still_readout", _read_still, timeout=CAPTURE_READOUT_TIMEOUT)
+    _record_capture_timing(job, 'exposure_ms', exposure_start)
+    return image, metadata
+
+def _read_still():
+    """Camera-thread command: one full-resolution frame and its metadata via a mode switch and back."""
+    detach_stream_encoder()  # Hardware stream encoder must be off for the mode switch
+    # Capture at full resolution; RGB888 arrays are BGR-ordered, ready for OpenCV
+    capture_config = camera.create_still_configuration(
+        main={"format": "RGB888", "size": CAPTURE_RESOLUTION}
+    )
+    stage_start = time.perf_counter()
+    request = camera.switch_mode_and_capture_request(capture_config)
+    try:
+        image = request.make_array("main")
+        metadata = request.get_metadata()
+    finally:
+        request.release()
+    observe_stage("still_capture", stage_start)
+    return image, metadata
+
+def run_capture_job(job):
+    """Captures a still image in high quality - optimized for RPi Zero W.
+
+    Only the sensor readout occupies the camera thread. Autofocus runs on the live
+    preview, JPEG encoding happens on the post-processing worker and the SD
+    card write on the storage manager's writer, so the stream resumes as soon
+    as the frame is read out and the next capture can start while this one is saved.
+    With a ZSL ring active the frame comes straight from the ring instead.
+    """
+    job_start = time.monotonic()
+    _record_capture_timing(job, 'queued_ms', job['_queued_at'])
+    ledc.on()
+    
+    filename = _new_capture_filename()
+    path = os.path.join(IMAGE_DIRECTORY, filename)
+    queued = False
+    reserved = 0
+    ring_frame = None
+    
+    try:
+        # Ensure camera is initialized
+        if not camera_initialized:
+            initialize_camera()
+        
+        # Zero-shutter-lag: save the buffered frame nearest the trigger, no mode switch
+        ring_frame = frame_ring.take(job['_trigger_at']) if frame_ring.active else None
+        if ring_frame is not None:
+            image, frame_time, metadata = ring_frame
+            _update_capture_job(job, source="zsl",
+                                frame_offset_ms=round((frame_time - job['_trigger_at']) * 1000, 1))
+        else:
+            # ZSL frames are already accounted to the ring; a still readout needs its own memory
+            reserved = _reserve_capture_memory(job)
+            image, metadata = _capture_still(job)
+            _update_capture_job(job, source="still")
+        exif_fields = _capture_exif_fields(metadata)
+        
+        _update_capture_job(job, status=CaptureStatus.SAVING)
+        save_start = time.monotonic()
+        
+        def saved(error):
+            if ring_frame is not None:
+                frame_ring.give_back(ring_frame[0])
+            _record_capture_timing(job, 'save_ms', save_start)
+            _record_capture_timing(job, 'total_ms', job_start)
+            if error is not None:
+                _update_capture_job(job, status=CaptureStatus.FAILED, error=str(error))
+                return
+            _update_capture_job(job, status=CaptureStatus.SAVED, filename=filename)
+            logging.info(f"High-quality capture complete: {path}")
+        
+        queue_postprocess(image, path, exif_fields, saved, reserved)
+        queued = True  # The worker releases the filename and the reservation, saved() the ring frame
+        
+    except MemoryBudgetExceeded as e:
+        # The fallback would need the same full-size frame; give up instead
+        logging.error(f"Capture failed: {e}")
+        _record_capture_timing(job, 'total_ms', job_start)
+        _update_capture_job(job, status=CaptureStatus.FAILED, error=str(e))
+    
+    except Exception as e:
+        logging.error(f"Capture failed: {e}")
+        # Fallback: use basic capture
+        try:
+            stage_start = time.perf_counter()
+            buffer = io.BytesIO()
+            camera_actor.call("capture_file", lambda: camera.capture_file(buffer, format='jpeg'),
+                              timeout=CAPTURE_READOUT_TIMEOUT)
+            storage_manager.write(path, buffer.getvalue()).result(timeout=STORAGE_WRITE_DEADLINE)
+            observe_stage("fallback_capture", stage_start)
+            logging.info(f"Captured (fallback): {path}")
+            _record_capture_timing(job, 'total_ms', job_start)
+            _update_capture_job(job, status=CaptureStatus.SAVED, filename=filename, error=str(e))
+        except Exception as e2:
+            logging.error(f"Fallback capture also failed: {e2}")
+            _record_capture_timing(job, 'total_ms', job_start)
+            _update_capture_job(job, status=CaptureStatus.FAILED, error=str(e2))
+    
+    finally:
+        if not queued:
+            release_capture_filename(filename)
+            memory_governor.release("capture_frames", reserved)
+            if ring_frame is not None:
+                # Without its spare buffer back the ring stops handing out frames for good
+                frame_ring.give_back(ring_frame[0])
+        time.sleep(0.3)  # Short feedback time
+        ledc.off()
+
+def _lock_burst_controls():
+    """Camera-thread command: freezes the settled focus, exposure and white balance.
+
+    Returns (locked controls, preview config, still config) for the series.
+    """
+    metadata = camera.capture_metadata()
+    locked_controls = {
+        "AeEnable": False,
+        "ExposureTime": metadata["ExposureTime"],
+        "AnalogueGain": metadata["AnalogueGain"],
+    }
+    if "LensPosition" in metadata:
+        locked_controls.update(AfMode=controls.AfModeEnum.Manual, LensPosition=metadata["LensPosition"])
+    if "ColourGains" in metadata:
+        locked_controls.update(AwbEnable=False, ColourGains=metadata["ColourGains"])
+    camera.set_controls(locked_controls)
+    still_config = camera.create_still_configuration(
+        main={"format": "RGB888", "size": CAPTURE_RESOLUTION},
+        controls=locked_controls
+    )
+    return locked_controls, camera.camera_config, still_config
+
+def _enter_still_mode(still_config):
+    """Camera-thread command: holds the sensor in still mode; stream and ZSL grabs pause."""
+    global camera_mode
+    # In the same command as the switch, so the stream cannot restart the hardware encoder in between
+    detach_stream_encoder()
+    camera.switch_mode(still_config)
+    camera_mode = "still"
+
+def _restore_preview(preview_config, restore_controls):
+    """Camera-thread command: back to the live preview with automatic focus and exposure."""
+    global camera_mode
+    if camera is None:
+        return
+    if camera_mode == "still":
+        camera.switch_mode(preview_config)
+        camera_mode = "preview"
+    if restore_controls:
+        camera.set_controls({
+            "AeEnable": True,
+            "AwbEnable": True,
+            "AfMode": controls.AfModeEnum.Continuous,
+        })
+
+def run_burst_job(job):
+    """Captures a burst or interval series with one still configuration.
+
+    Focus and exposure are settled once on the live preview and then locked
+    for every frame. For back-to-back or short intervals the camera stays in
+    still mode for the whole series; for longer intervals it returns to the
+    preview between frames (so the stream keeps running) but still reuses
+    the same configuration and locked controls instead of refocusing.
+    Every camera step is a separate camera-thread command, so other camera
+    users are never locked out for the length of the series.
+    """
+    job_start = time.monotonic()
+    _record_capture_timing(job, 'queued_ms', job['_queued_at'])
+    ledc.on()
+    
+    locked_controls = None
+    preview_config = None
+    try:
+        if not camera_initialized:
+            initialize_camera()
+        
+        _update_capture_job(job, status=CaptureStatus.FOCUSING)
+        focus_start = time.monotonic()
+        camera_actor.call("set_controls", lambda: camera.set_controls({
+            "AfMode": controls.AfModeEnum.Auto,
+            "AfTrigger": controls.AfTriggerEnum.Start,
+            "AeEnable": True,
+        }))
+        focus_state = wait_for_autofocus()
+        
+        # Freeze the settled focus, exposure and white balance for the series
+        locked_controls, preview_config, still_config = camera_actor.call("lock_controls", _lock_burst_controls)
+        _record_capture_timing(job, 'focus_ms', focus_start)
+        _update_capture_job(job, focus_state=focus_state, status=CaptureStatus.EXPOSING)
+        
+        hold_still_mode = job['interval'] <= BURST_HOLD_STILL_INTERVAL
+        if hold_still_mode:
+            switch_start = time.monotonic()
+            camera_actor.call("switch_mode", _enter_still_mode, still_config, timeout=CAPTURE_READOUT_TIMEOUT)
+            _record_capture_timing(job, 'mode_switch_ms', switch_start)
+        
+        series_start = time.monotonic()
+        failed_frames = []
+        frame_writes = []  # One Future per frame, resolved once it is on disk
+        cancelled = True  # Until the loop runs to completion
+        for index in range(job['count']):
+            due = series_start + index * job['interval']
+            if job['_cancel'].wait(max(0.0, due - time.monotonic())):
+                _update_capture_job(job, status=CaptureStatus.CANCELLED)
+                logging.info(f"Burst {job['id']} cancelled after {index} frames")
+                break
+            
+            reserved = _reserve_capture_memory(job)
+            frame_start = time.monotonic()
+            try:
+                if hold_still_mode:
+                    image = camera_actor.call("capture_array", lambda: camera.capture_array("main"),
+                                              timeout=CAPTURE_READOUT_TIMEOUT)
+                else:
+                    image = camera_actor.call("still_readout",
+                                              lambda: camera.switch_mode_and_capture_array(still_config, "main"),
+                                              timeout=CAPTURE_READOUT_TIMEOUT)
+            except Exception:
+                memory_governor.release("capture_frames", reserved)
+                raise
+            exposure_ms = (time.monotonic() - frame_start) * 1000
+            stage_seconds.observe(exposure_ms / 1000, "burst_capture")
+            
+            filename = _new_capture_filename(index)
+            frame_written = Future()
+            frame_writes.append(frame_written)
+            
+            def saved(error, filename=filename, offset=frame_start - series_start, exposure_ms=exposure_ms,
+                      save_start=time.monotonic(), frame_written=frame_written):
+                with capture_jobs_lock:
+                    if error is not None:
+                        failed_frames.append(f"{filename}: {error}")
+                    else:
+                        job['filenames'].append(filename)
+                        job['frames'].append({
+                            'filename': filename,
+                            'offset_ms': round(offset * 1000, 1),
+                            'exposure_ms': round(exposure_ms, 1),
+                            'save_ms': round((time.monotonic() - save_start) * 1000, 1),
+                        })
+                frame_written.set_result(error)
+            
+            # Blocks while earlier frames are still being encoded, which paces a long burst to the CPU
+            queue_postprocess(image, os.path.join(IMAGE_DIRECTORY, filename), _capture_exif_fields(locked_controls),
+                              saved, reserved)
+            del image
+        else:
+            cancelled = False
+        
+        # The job finishes once the last frame is on disk; the camera is free meanwhile
+        def finish(_=None):
+            if not all(future.done() for future in frame_writes):
+                return
+            with capture_jobs_lock:
+                if job.get('_finished'):
+                    return
+                job['_finished'] = True
+                job['filename'] = job['filenames'][0] if job['filenames'] else None
+            if failed_frames:
+                _update_capture_job(job, status=CaptureStatus.FAILED, error="; ".join(failed_frames))
+            elif not cancelled:
+                _update_capture_job(job, status=CaptureStatus.SAVED)
+            logging.info(f"Burst {job['id']} complete: {len(job['filenames'])} frames")
+        
+        for future in frame_writes:
+            future.add_done_callback(finish)
+        finish()
+    
+    except Exception as e:
+        logging.error(f"Burst capture failed: {e}")
+        _update_capture_job(job, status=CaptureStatus.FAILED, error=str(e), _finished=True)
+    
+    finally:
+        try:
+            camera_actor.call("restore_preview", _restore_preview, preview_config, locked_controls is not None,
+                              timeout=CAPTURE_READOUT_TIMEOUT)
+        except Exception as e:
+            logging.error(f"Failed to restore preview after burst: {e}")
+        _record_capture_timing(job, 'total_ms', job_start)
+        ledc.off()
+
+def capture_image():
+    """Queues a high-quality still capture (used by the capture button).
+
+    The button fires after being held, so the moment wanted is when it was
+    first pressed; ZSL captures use that frame.
+    """
+    try:
+        return submit_capture(trigger_at=time.monotonic() - (capture_button.active_time or 0))
+    except CaptureRejected as e:
+        logging.warning(f"Capture button ignored: {e}")
+        return None
+
+# --- Image Index ---
+
+class ImageIndex:
+    """Persistent SQLite index of IMAGE_DIRECTORY for /list_files.
+
+    The capture path adds each file as it is written and reconcile() brings
+    the index in line with the directory at startup (only new files are
+    stat()ed). Listing then walks the (mtime, name) index with keyset
+    cursors, so a page costs the same however many images there are.
+    Images that were downloaded or archived are marked exported, which the
+    storage manager's eviction policy uses.
+    """
+
+    def __init__(self, db_path, directory):
+        self._db_path = db_path
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._conn = None
+        self._count = 0
+        self._bytes = 0
+        # Changes on every add/remove and on restart; feeds the /list_files ETag
+        self._version = f"{int(time.time()):x}.0"
+        self._changes = 0
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS images ("
+                               "name TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, "
+                               "exported INTEGER NOT NULL DEFAULT 0)")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(images)")}
+            if "exported" not in columns:
+                # Index created before eviction existed
+                self._conn.execute("ALTER TABLE images ADD COLUMN exported INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS images_by_mtime ON images (mtime DESC, name DESC)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS images_for_eviction ON images (exported, mtime, name)")
+            self._count, self._bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+        return self._conn
+
+    def _changed(self):
+        self._changes += 1
+        self._version = f"{self._version.split('.')[0]}.{self._changes}"
+
+    @property
+    def count(self):
+        with self._lock:
+            self._db()
+            return self._count
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            self._db()
+            return self._bytes
+
+    @property
+    def version(self):
+        return self._version
+
+    def add(self, name):
+        """Indexes (or refreshes) a file in the image directory."""
+        try:
+            st = os.stat(os.path.join(self._directory, name))
+        except OSError as e:
+            logging.warning(f"Cannot index {name}: {e}")
+            return
+        with self._lock:
+            db = self._db()
+            with db:
+                row = db.execute("SELECT size FROM images WHERE name = ?", (name,)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE images SET mtime = ?, size = ? WHERE name = ?",
+                               (st.st_mtime, st.st_size, name))
+                    self._bytes += st.st_size - row[0]
+                else:
+                    db.execute("INSERT INTO images (name, mtime, size) VALUES (?, ?, ?)",
+                               (name, st.st_mtime, st.st_size))
+                    self._count += 1
+                    self._bytes += st.st_size
+            self._changed()
+
+    def remove(self, name):
+        with self._lock:
+            db = self._db()
+            with db:
+                row = db.execute("SELECT size FROM images WHERE name = ?", (name,)).fetchone()
+                if row is not None:
+                    db.execute("DELETE FROM images WHERE name = ?", (name,))
+                    self._count -= 1
+                    self._bytes -= row[0]
+            self._changed()
+
+    def mark_exported(self, names):
+        """Flags images as downloaded or archived, making them the first candidates for eviction."""
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("UPDATE images SET exported = 1 WHERE name = ?", [(name,) for name in names])
+
+    def eviction_candidates(self, limit, exported_only):
+        """(name, size) rows in eviction order: exported images first, then oldest first."""
+        where = "WHERE exported = 1" if exported_only else ""
+        sql = f"SELECT name, size FROM images {where} ORDER BY exported DESC, mtime ASC, name ASC LIMIT ?"
+        with self._lock:
+            return self._db().execute(sql, (limit,)).fetchall()
+
+    def reconcile(self):
+        """Adds files missing from the index and drops entries whose file is gone."""
+        start = time.monotonic()
+        with self._lock:
+            indexed = {row[0] for row in self._db().execute("SELECT name FROM images")}
+        on_disk = set()
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    on_disk.add(entry.name)
+        added = on_disk - indexed
+        removed = indexed - on_disk
+        rows = []
+        for name in added:
+            try:
+                st = os.stat(os.path.join(self._directory, name))
+                rows.append((name, st.st_mtime, st.st_size))
+            except OSError:
+                continue
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO images (name, mtime, size) VALUES (?, ?, ?)", rows)
+                db.executemany("DELETE FROM images WHERE name = ?", [(name,) for name in removed])
+            self._count, self._bytes = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+            if rows or removed:
+                self._changed()
+        logging.info(f"Image index reconciled: {self._count} files, +{len(rows)} -{len(removed)} "
+                     f"({time.monotonic() - start:.2f}s)")
+
+    def page(self, limit, cursor=None, offset=0, since=None, until=None):
+        """Returns (rows, next_cursor) newest first; rows are (name, mtime, size).
+
+        cursor continues after the last row of a previous page; offset is the
+        legacy page-number path and costs O(offset).
+        """
+        clauses, params = self._range_clauses(since, until)
+        if cursor:
+            mtime, name = decode_list_cursor(cursor)
+            clauses.append("(mtime < ? OR (mtime = ? AND name < ?))")
+            params += [mtime, mtime, name]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT name, mtime, size FROM images {where} ORDER BY mtime DESC, name DESC LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._db().execute(sql, params + [limit + 1, 0 if cursor else offset]).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_list_cursor(rows[-1][1], rows[-1][0])
+        return rows, next_cursor
+
+    def count_range(self, since=None, until=None):
+        """Number of images in [since, until); the cached total when unfiltered."""
+        if since is None and until is None:
+            return self.count
+        clauses, params = self._range_clauses(since, until)
+        with self._lock:
+            return self._db().execute(f"SELECT COUNT(*) FROM images WHERE {' AND '.join(clauses)}",
+                                      params).fetchone()[0]
+
+    @staticmethod
+    def _range_clauses(since, until):
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("mtime >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("mtime < ?")
+            params.append(until)
+        return clauses, params
+
+def encode_list_cursor(mtime, name):
+    return base64.urlsafe_b64encode(json.dumps([mtime, name]).encode()).decode().rstrip("=")
+
+def decode_list_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    mtime, name = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return float(mtime), str(name)
+
+def parse_time_param(value):
+    """Accepts epoch seconds or an ISO 8601 timestamp; None passes through."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+image_index = ImageIndex(IMAGE_INDEX_PATH, IMAGE_DIRECTORY)
+
+# --- Thumbnails ---
+
+class ThumbnailCache:
+    """Size-bounded on-disk cache of JPEG thumbnails with LRU eviction.
+
+    Thumbnails are made with libjpeg's scaled decode (IMREAD_REDUCED_COLOR_n),
+    so a 4K capture is decoded at 1/2, 1/4 or 1/8 size and never in full.
+    New captures are queued for the default size as soon as they are saved;
+    other files and sizes are generated on first request.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._generate_lock = threading.Lock()
+        self._entries = None  # OrderedDict of cache file name -> bytes, least recently used first
+        self._total = 0
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def _load(self):
+        """Indexes thumbnails left from previous runs, oldest first."""
+        if self._entries is not None:
+            return
+        found = []
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('.jpg'):
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.name, st.st_size))
+        found.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in found)
+        self._total = sum(self._entries.values())
+
+    @staticmethod
+    def cache_name(filename, size):
+        return f"{os.path.splitext(filename)[0]}_{size}.jpg"
+
+    def get(self, filename, size):
+        """Returns the thumbnail path for an image, generating it if needed (None if no such image)."""
+        name = self.cache_name(filename, size)
+        with self._lock:
+            self._load()
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                return os.path.join(self._directory, name)
+        return self._generate(filename, size)
+
+    def schedule(self, filename, size=None):
+        """Generates a thumbnail on the background worker."""
+        self._queue.put((filename, size or THUMBNAIL_DEFAULT_SIZE))
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def discard(self, filename):
+        """Deletes every cached thumbnail of an image (after the image itself was deleted)."""
+        names = {self.cache_name(filename, size) for size in THUMBNAIL_SIZES}
+        with self._lock:
+            self._load()
+            for name in names & self._entries.keys():
+                self._total -= self._entries.pop(name)
+                try:
+                    os.remove(os.path.join(self._directory, name))
+                except OSError:
+                    pass
+
+    def _run(self):
+        while True:
+            filename, size = self._queue.get()
+            try:
+                self.get(filename, size)
+            except Exception as e:
+                logging.warning(f"Thumbnail for {filename} failed: {e}")
+
+    def _generate(self, filename, size):
+        source = os.path.join(IMAGE_DIRECTORY, filename)
+        name = self.cache_name(filename, size)
+        path = os.path.join(self._directory, name)
+        with self._generate_lock:
+            with self._lock:
+                if name in self._entries:  # Made by a concurrent request meanwhile
+                    return path
+            if not os.path.isfile(source):
+                return None
+            image = self._decode_reduced(source, size)
+            if image is None:
+                raise ValueError(f"cannot decode {filename}")
+            height, width = image.shape[:2]
+            scale = size / max(height, width)
+            if scale < 1:
+                image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                   interpolation=cv2.INTER_AREA)
+            ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY])
+            if not ret:
+                raise ValueError(f"cannot encode thumbnail for {filename}")
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(buffer)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._entries[name] = len(buffer)
+            self._total += len(buffer)
+            self._evict()
+        return path
+
+    @staticmethod
+    def _decode_reduced(source, size):
+        """Decodes at the smallest 1/2^n scale that still covers `size` on the long edge."""
+        if source.lower().endswith(('.jpg', '.jpeg')):
+            try:
+                with open(source, 'rb') as f:
+                    # Image size from the JPEG header without decoding anything
+                    header = np.frombuffer(f.read(65536), dtype=np.uint8)
+                long_edge = _jpeg_long_edge(header)
+            except OSError:
+                long_edge = None
+            if long_edge:
+                for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                     (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                    if long_edge // factor >= size:
+                        return cv2.imread(source, flag)
+        return cv2.imread(source, cv2.IMREAD_COLOR)
+
+    def _evict(self):
+        """Drops least recently used thumbnails until the cache fits its budget. Caller holds _lock."""
+        while self._total > self._max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except OSError:
+                pass
+
+def _jpeg_long_edge(data):
+    """Longest image dimension from a JPEG's SOF marker, or None if not found in `data`."""
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        length = (int(data[i + 2]) << 8) | int(data[i + 3])
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (int(data[i + 5]) << 8) | int(data[i + 6])
+            width = (int(data[i + 7]) << 8) | int(data[i + 8])
+            return max(height, width)
+        i += 2 + length
+    return None
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_DIRECTORY, THUMBNAIL_CACHE_MB * 1024 * 1024)
+
+def thumbnail_size_param(value):
+    """Snaps a requested size to the nearest allowed thumbnail size."""
+    if value is None or value == "":
+        return THUMBNAIL_DEFAULT_SIZE
+    requested = int(value)
+    return min(THUMBNAIL_SIZES, key=lambda size: abs(size - requested))
+
+# --- Storage Manager ---
+
+class StorageBusy(RuntimeError):
+    """The write queue stayed full past STORAGE_WRITE_DEADLINE."""
+
+class StorageFull(RuntimeError):
+    """The card is below STORAGE_MIN_FREE_MB and the eviction policy cannot free anything."""
+
+class StorageManager:
+    """Write-behind writer for IMAGE_DIRECTORY with free-space watch and quota-based eviction.
+
+    Callers hand over encoded bytes and get a Future; they wait at most
+    STORAGE_WRITE_DEADLINE for a slot in the bounded queue, never for the
+    card itself. The writer thread takes up to STORAGE_FSYNC_BATCH queued
+    images at a time, writes them to temporary names, fsyncs them (the first
+    fsync commits the journal for the whole batch), renames them into place
+    and fsyncs the directory once, so files appear whole and survive a power
+    cut. After each batch, and when a capture asks to be admitted, the writer
+    checks free space and the quota and evicts images per
+    STORAGE_EVICTION_POLICY; nothing runs on a timer, so an idle device is
+    left alone.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._queue = queue.Queue(maxsize=STORAGE_WRITE_QUEUE)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.free_bytes = None
+        self.full = False
+        self.evicted = 0
+        self.last_batch = None
+        self._latencies = deque(maxlen=100)  # Recent queued-to-durable seconds, for status()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """Starts the writer thread, which checks free space once right away."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="storage", daemon=True)
+            self._thread.start()
+        self._request_check()
+
+    def _request_check(self):
+        """Asks the writer thread for a space check; never blocks."""
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass  # The writer checks after the batch it is busy with anyway
+
+    def admit(self):
+        """Raises StorageFull if the last check found no room; a fresh check runs on the writer thread.
+
+        Only cached state is read, so a capture never waits on the card or
+        an eviction here.
+        """
+        self._request_check()
+        if self.full:
+            raise StorageFull(f"storage full: less than {STORAGE_MIN_FREE_MB} MB free and nothing to evict")
+
+    def write(self, path, data, timeout=STORAGE_WRITE_DEADLINE):
+        """Queues data for path; the Future resolves to path once the file is durably on disk.
+
+        Raises StorageBusy if no queue slot frees up within timeout and
+        StorageFull if the card is full and nothing can be evicted.
+        """
+        self.start()
+        if self.full:
+            storage_writes_total.inc("rejected")
+            raise StorageFull(f"less than {STORAGE_MIN_FREE_MB} MB free and nothing to evict")
+        future = Future()
+        try:
+            self._queue.put((path, data, future, time.monotonic()), timeout=timeout)
+        except queue.Full:
+            storage_writes_total.inc("rejected")
+            raise StorageBusy(f"storage still busy after {timeout:.0f}s") from None
+        memory_governor.add("storage_queue", len(data))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < STORAGE_FSYNC_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            writes = [item for item in batch if item is not None]
+            if writes:
+                self._write_batch(writes)
+            try:
+                self.check_space()
+            except Exception as e:
+                logging.error(f"Storage check failed: {e}")
+
+    def _write_batch(self, batch):
+        stage_start = time.perf_counter()
+        opened = []
+        for path, data, future, queued_at in batch:
+            tmp_path = path + ".tmp"
+            fd = None
+            try:
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                opened.append((path, tmp_path, fd, future, queued_at))
+            except OSError as e:
+                if fd is not None:
+                    os.close(fd)
+                self._fail(tmp_path, future, e)
+        written = []
+        for path, tmp_path, fd, future, queued_at in opened:
+            try:
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(tmp_path, path)
+                written.append((path, future, queued_at))
+            except OSError as e:
+                self._fail(tmp_path, future, e)
+        if written:
+            try:
+                dir_fd = os.open(self._directory, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)  # Makes the renames durable
+                finally:
+                    os.close(dir_fd)
+            except OSError as e:
+                logging.warning(f"Directory fsync failed: {e}")
+        observe_stage("file_write", stage_start)
+        self.last_batch = {'images': len(batch), 'written': len(written),
+                           'ms': round((time.perf_counter() - stage_start) * 1000, 1)}
+        
+        done = time.monotonic()
+        for path, future, queued_at in written:
+            name = os.path.basename(path)
+            image_index.add(name)
+            thumbnail_cache.schedule(name)
+            storage_writes_total.inc("written")
+            storage_write_seconds.observe(done - queued_at)
+            self._latencies.append(done - queued_at)
+            future.set_result(path)
+        memory_governor.release("storage_queue", sum(len(item[1]) for item in batch))
+
+    @staticmethod
+    def _fail(tmp_path, future, error):
+        logging.error(f"Writing {os.path.basename(tmp_path[:-4])} failed: {error}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        storage_writes_total.inc("failed")
+        future.set_exception(error)
+
+    def check_space(self):
+        """Updates free space and evicts images until the quota and STORAGE_MIN_FREE_MB are met."""
+        stat = os.statvfs(self._directory)
+        self.free_bytes = stat.f_bavail * stat.f_frsize
+        need_free = STORAGE_MIN_FREE_MB * 1024 * 1024 - self.free_bytes
+        over_quota = image_index.total_bytes - STORAGE_QUOTA_MB * 1024 * 1024 if STORAGE_QUOTA_MB else 0
+        if need_free > 0:
+            self._evict(need_free, "free_space")
+        if over_quota > 0:
+            self._evict(over_quota, "quota")
+        stat = os.statvfs(self._directory)
+        self.free_bytes = stat.f_bavail * stat.f_frsize
+        full = self.free_bytes < STORAGE_MIN_FREE_MB * 1024 * 1024
+        if full and not self.full:
+            logging.error(f"Storage full: {self.free_bytes / (1024 * 1024):.0f} MB free, new captures are refused")
+        elif self.full and not full:
+            logging.info("Storage has room again")
+        self.full = full
+
+    def _evict(self, nbytes, reason):
+        """Deletes images per STORAGE_EVICTION_POLICY until nbytes are freed; returns the bytes freed."""
+        if STORAGE_EVICTION_POLICY == "off":
+            return 0
+        freed = 0
+        while freed < nbytes:
+            candidates = image_index.eviction_candidates(50, STORAGE_EVICTION_POLICY == "exported")
+            if not candidates:
+                logging.warning(f"Storage {reason}: {(nbytes - freed) / (1024 * 1024):.0f} MB still needed, "
+                                f"nothing left to evict under policy '{STORAGE_EVICTION_POLICY}'")
+                break
+            for name, size in candidates:
+                try:
+                    os.remove(os.path.join(self._directory, name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.error(f"Evicting {name} failed: {e}")
+                    return freed
+                image_index.remove(name)
+                thumbnail_cache.discard(name)
+                storage_evictions_total.inc(reason)
+                self.evicted += 1
+                freed += size
+                logging.info(f"Evicted {name} ({reason})")
+                if freed >= nbytes:
+                    break
+        return freed
+
+    def status(self):
+        used = image_index.total_bytes
+        latencies = sorted(self._latencies)
+        return {
+            'queue_depth': self.queue_depth,
+            'queue_limit': STORAGE_WRITE_QUEUE,
+            'free_mb': round(self.free_bytes / (1024 * 1024), 1) if self.free_bytes is not None else None,
+            'min_free_mb': STORAGE_MIN_FREE_MB,
+            'used_mb': round(used / (1024 * 1024), 1),
+            'quota_mb': STORAGE_QUOTA_MB or None,
+            'eviction_policy': STORAGE_EVICTION_POLICY,
+            'evicted': self.evicted,
+            'full': self.full,
+            'last_batch': self.last_batch,
+            'write_ms_p50': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            'write_ms_max': round(latencies[-1] * 1000, 1) if latencies else None,
+        }
+
+storage_manager = StorageManager(IMAGE_DIRECTORY)
+
+# --- Flask Routes ---
+
+@app.route('/ping')
+def ping():
+    """Ping endpoint - should reset idle timer and wake device."""
+    handle_ping()
+    blink()
+    return jsonify(status="pong", code=200)
+
+def handle_ping():
+    """Client keep-alive shared by /ping and /state?ping=1: marks activity and wakes the device from idle."""
+    mark_client_active()
+    update_timer()
+    
+    # Wake up from idle if needed
+    if system_state == SystemState.IDLE:
         initialize_camera()
         set_system_state(SystemState.RUNNING)
         logging.info("Device awakened from idle by client ping")
+
+@app.route('/device_status')
+def device_status():
+    return jsonify(online=True)
+
+@app.route('/system_status')
+def system_status():
+    encode_ms = encoder_stats['encode_ms']
+    return jsonify(state=system_state, power_on=device_power_on,
+                   viewers=total_viewers(),
+                   camera=camera_lifecycle.status(),
+                   encoder={
+                       'backend': encoder_stats['backend'],
+                       'encode_ms': round(encode_ms, 2) if encode_ms is not None else None,
+                       'probe_ms': encoder_stats['probe_ms'],
+                   })
+
+@app.route('/power_status')
+def power_status():
+    """Returns device power state."""
+    return jsonify(powered_on=device_power_on, state=system_state)
+
+def device_state():
+    """Everything /system_status, /power_status and the LED routes report, minus the fast-changing timings."""
+    with capture_jobs_lock:
+        finished = [job for job in capture_jobs.values()
+                    if job['status'] in (CaptureStatus.SAVED, CaptureStatus.FAILED, CaptureStatus.CANCELLED)]
+        last_capture = finished[-1] if finished else None
+        if last_capture is not None:
+            last_capture = {'job_id': last_capture['id'], 'status': last_capture['status'],
+                            'filename': last_capture['filename']}
+    return {
+        'state': system_state,
+        'power_on': device_power_on,
+        'idle': idle_mode_active,
+        'client_active': client_status['status'],
+        'UV_A': led1.is_active,
+        'UV_B': led2.is_active,
+        'viewers': total_viewers(),
+        'camera': {'state': camera_lifecycle.state, 'failed': camera_lifecycle.failed},
+        'encoder': encoder_stats['backend'],
+        'last_capture': last_capture,
+        'storage_full': storage_manager.full,
+    }
+
+@app.route('/state')
+def state():
+    """Aggregated device state with an ETag; ?ping=1 also does what /ping does.
+
+    Send the ETag back in If-None-Match to get 304 while nothing changed.
+    event_id is the latest /events id the state includes.
+    """
+    if request.args.get('ping') in ('1', 'true'):
+        handle_ping()
+    event_id = event_bus.last_id  # Read first, so no event is missed by a client resuming from it
+    body = json.dumps({**device_state(), 'event_id': event_id}, sort_keys=True)
+    etag = hashlib.md5(body.encode()).hexdigest()[:16]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _sse_message(event_type, data, event_id=None):
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event_type}", f"data: {json.dumps(data, separators=(',', ':'))}", "", ""]
+    return "\n".join(lines).encode()
+
+def _snapshot_message():
+    event_id = event_bus.last_id
+    return _sse_message("snapshot", device_state(), event_id), event_id
+
+def _event_start_id(last_event_id):
+    """Last-Event-ID (or ?since=) as an int, or None to start with a snapshot."""
+    try:
+        return int(last_event_id) if last_event_id else None
+    except ValueError:
+        return None
+
+def event_stream(last_id):
+    """Server-sent events: a snapshot (unless resuming), then every state event as it happens."""
+    yield f"retry: {int(EVENTS_KEEPALIVE * 1000)}\n\n".encode()
+    if last_id is None or event_bus.since(last_id) is None:
+        message, last_id = _snapshot_message()
+        yield message
+    while True:
+        events = event_bus.wait(last_id, EVENTS_KEEPALIVE)
+        if events is None:
+            # Fell behind the history: start over from the current state
+            message, last_id = _snapshot_message()
+            yield message
+            continue
+        if not events:
+            yield b": keepalive\n\n"  # Lets the client and proxies see the connection is alive
+            continue
+        for event in events:
+            yield _sse_message(event['type'], {**event['data'], 'time': event['time']}, event['id'])
+        last_id = events[-1]['id']
+
+@app.route('/events')
+def events():
+    """State changes as they happen: state, idle, leds and capture events.
+
+    Default is a text/event-stream (resumes from Last-Event-ID). With
+    ?since=<id> it long-polls instead: waits up to ?wait= seconds
+    (EVENTS_LONG_POLL_TIMEOUT at most) and returns the events after <id> as
+    JSON, or resync=true plus the full state if they are no longer available.
+    Neither counts as client activity, so listening never keeps the device awake.
+    """
+    since = request.args.get('since')
+    if since is None:
+        last_id = _event_start_id(request.headers.get('Last-Event-ID'))
+        response = Response(event_stream(last_id), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+        return response
     
-    blink()
-    return jsonify(status="pong", code=200)
+    try:
+        last_id = int(since)
+        wait = min(float(request.args.get('wait', EVENTS_LONG_POLL_TIMEOUT)), EVENTS_LONG_POLL_TIMEOUT)
+    except ValueError:
+        return jsonify(error="since must be an event id and wait a number of seconds"), 400
+    found = event_bus.wait(last_id, wait)
+    return jsonify(_long_poll_result(last_id, found))
+
+def _long_poll_result(last_id, found):
+    if found is None:
+        return {'resync': True, 'state': device_state(), 'last_id': event_bus.last_id, 'events': []}
+    return {'resync': False, 'events': found, 'last_id': found[-1]['id'] if found else last_id}
+
+@app.route('/capture', methods=['GET', 'POST'])
+def trigger_capture():
+    # Queue the capture so we don't block the HTTP response; poll /capture/<id> for the outcome
+    try:
+        job_id = submit_capture()
+    except CaptureRejected as e:
+        return _capture_busy_response(e)
+    return jsonify(status="capture_started", job_id=job_id, status_url=f"/capture/{job_id}"), 202
+
+def _capture_busy_response(error):
+    response = jsonify(status="busy", error=str(error))
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
+def _burst_params(require_interval):
+    """Reads and validates count/interval from JSON, form or query parameters."""
+    params = request.get_json(silent=True) or request.values
+    count = int(params.get('count', 5))
+    interval = float(params.get('interval', 0))
+    if not 1 <= count <= BURST_MAX_FRAMES:
+        raise ValueError(f"count must be between 1 and {BURST_MAX_FRAMES}")
+    if not 0 <= interval <= BURST_MAX_INTERVAL:
+        raise ValueError(f"interval must be between 0 and {BURST_MAX_INTERVAL} seconds")
+    if require_interval and interval == 0:
+        raise ValueError("interval must be greater than 0")
+    return count, interval
+
+def _queue_burst_response(require_interval):
+    try:
+        count, interval = _burst_params(require_interval)
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    try:
+        job_id = submit_burst(count, interval)
+    except CaptureRejected as e:
+        return _capture_busy_response(e)
+    return jsonify(status="capture_started", job_id=job_id, status_url=f"/capture/{job_id}",
+                   count=count, interval=interval), 202
+
+@app.route('/capture/burst', methods=['POST'])
+def trigger_burst():
+    """Back-to-back burst: count frames (interval optional, default 0)."""
+    return _queue_burst_response(require_interval=False)
+
+@app.route('/capture/interval', methods=['POST'])
+def trigger_interval():
+    """Scheduled series: count frames, one every interval seconds."""
+    return _queue_burst_response(require_interval=True)
+
+@app.route('/capture/<job_id>/cancel', methods=['POST'])
+def cancel_capture(job_id):
+    if not cancel_capture_job(job_id):
+        return jsonify(error="unknown capture job"), 404
+    return jsonify(status="cancelling", job_id=job_id)
+
+@app.route('/capture/<job_id>')
+def capture_status(job_id):
+    job = get_capture_job(job_id)
+    if job is None:
+        return jsonify(error="unknown capture job"), 404
+    return jsonify(job)
+
+@app.route('/list_files', methods=['GET'])
+def list_files():
+    """Pages through captured images newest first, served from the image index.
+
+    Pass next_cursor back as ?cursor= for the following page (page= still
+    works), and since=/until= (epoch seconds or ISO 8601) to filter by time.
+    """
+    # The index version changes whenever an image is added or removed
+    etag = f"{image_index.version}-{hashlib.md5(request.query_string).hexdigest()[:8]}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    try:
+        per_page = int(request.args.get('per_page', 10))
+        page = int(request.args.get('page', 1))
+        cursor = request.args.get('cursor')
+        since = parse_time_param(request.args.get('since'))
+        until = parse_time_param(request.args.get('until'))
+        thumbnail_size = request.args.get('thumbnails')
+        if thumbnail_size is not None:
+            # ?thumbnails (or ?thumbnails=<size>) adds thumbnail URLs to the listing
+            thumbnail_size = thumbnail_size_param(thumbnail_size)
+        if per_page < 1 or page < 1:
+            raise ValueError("page and per_page must be positive")
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    
+    try:
+        rows, next_cursor = image_index.page(per_page, cursor=cursor, offset=(page - 1) * per_page,
+                                             since=since, until=until)
+        total = image_index.count_range(since, until)
+    except (TypeError, ValueError):
+        return jsonify(error="invalid cursor"), 400
+    except Exception as e:
+        logging.error(f"Error listing files: {e}")
+        return jsonify(error=str(e)), 500
+    
+    result = {
+        "page": None if cursor else page,
+        "per_page": per_page,
+        "total": total,
+        "files": [row[0] for row in rows],
+        "next_cursor": next_cursor,
+    }
+    if thumbnail_size is not None:
+        result["thumbnails"] = [f"/thumbnails/{row[0]}?size={thumbnail_size}" for row in rows]
+    response = jsonify(result)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/images/<path:filename>')
+def get_file(filename):
+    """Serves a capture with Range, If-Modified-Since and ETag support.
+
+    Partial and conditional requests are answered with 206/304/416. Under
+    gunicorn, whole-file responses go through wsgi.file_wrapper (os.sendfile),
+    or with IMAGE_X_SENDFILE a front-end server sends the file itself.
+    A whole-file GET marks the image exported once the body is closed after
+    its last byte went out; HEAD and aborted downloads never do.
+    """
+    # Absolute path: Flask would otherwise resolve it against the script's directory
+    # rather than the working directory captures are written to
+    response = send_from_directory(os.path.abspath(IMAGE_DIRECTORY), filename, conditional=True, etag=True,
+                                   max_age=IMAGE_CACHE_MAX_AGE)
+    if response.status_code == 200 and request.method == 'GET' and 'X-Sendfile' not in response.headers:
+        # A completed download makes it a first candidate for eviction; with X-Sendfile
+        # the front-end sends the bytes, so completion is unknown and it is left unmarked
+        _track_sent(response.response, response.content_length,
+                    lambda: image_index.mark_exported([filename]))
+    return response
+
+class _SentTracking:
+    """Mixed into a file response body's own class by _track_sent().
+
+    Counts the bytes iterated and calls the completion callback from close()
+    once all of them went out. The server's sendfile path never iterates; a
+    close() without an exception in flight means it finished.
+    """
+
+    def __iter__(self):
+        for chunk in self._chunks():
+            self._sent_bytes += len(chunk)
+            yield chunk
+
+    def _chunks(self):
+        # File wrappers are their own iterators (__next__), or old-style ones like
+        # gunicorn's are iterated through __getitem__
+        if hasattr(super(), "__next__"):
+            next_chunk = super().__next__
+            while True:
+                try:
+                    yield next_chunk()
+                except StopIteration:
+                    return
+        index = 0
+        while True:
+            try:
+                chunk = super().__getitem__(index)
+            except IndexError:
+                return
+            yield chunk
+            index += 1
+
+    def close(self):
+        aborted = sys.exc_info()[0] is not None
+        if self._close_file is not None:
+            self._close_file()
+        elif hasattr(super(), "close"):
+            super().close()
+        on_complete, self._on_complete = self._on_complete, None
+        if on_complete is not None and not aborted and (self._sent_bytes == 0 or self._sent_bytes >= self._size):
+            on_complete()
+
+_sent_tracking_classes = {}
+
+def _track_sent(body, size, on_complete):
+    """Makes body call on_complete once fully sent, keeping its class (and so wsgi.file_wrapper/sendfile)."""
+    base = type(body)
+    cls = _sent_tracking_classes.get(base)
+    if cls is None:
+        cls = _sent_tracking_classes[base] = type(f"SentTracking{base.__name__}", (_SentTracking, base), {})
+    body.__class__ = cls
+    # Some wrappers bind the file's close() on the instance, which would shadow ours
+    body._close_file = body.__dict__.pop("close", None)
+    body._sent_bytes = 0
+    body._size = size or 0
+    body._on_complete = on_complete
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
 
-@app.route('/device_status')
-def device_status():
-    return jsonify(online=True)
+    def flush(self):
+        pass
 
-@app.route('/system_status')
-def system_status():
-    return jsonify(state=system_state, power_on=device_power_on)
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
 
-@app.route('/power_status')
-def power_status():
-    """Returns device power state."""
-    return jsonify(powered_on=device_power_on, state=system_state)
+def _read_chunks(path, size):
+    """Yields exactly `size` bytes of a file, zero-padding if it shrank meanwhile."""
+    remaining = size
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            chunk = f.read(min(ARCHIVE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    if remaining > 0:
+        yield bytes(remaining)
 
-@app.route('/capture', methods=['GET', 'POST'])
-def trigger_capture():
-    # Run capture in a separate thread so we don't block the HTTP response immediately
-    threading.Thread(target=capture_image, daemon=True).start()
-    return jsonify(status="capture_started")
+def stream_tar(names):
+    """Streams a ustar archive one chunk at a time; headers are built per file."""
+    for name in names:
+        path = os.path.join(IMAGE_DIRECTORY, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            logging.warning(f"Archive: skipping missing file {name}")
+            continue
+        info = tarfile.TarInfo(name)
+        info.size = st.st_size
+        info.mtime = int(st.st_mtime)
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.USTAR_FORMAT)
+        yield from _read_chunks(path, st.st_size)
+        padding = -st.st_size % tarfile.BLOCKSIZE
+        if padding:
+            yield bytes(padding)
+    yield bytes(tarfile.BLOCKSIZE * 2)
 
-@app.route('/list_files', methods=['GET'])
-def list_files():
+def stream_zip(names):
+    """Streams a stored (uncompressed - JPEGs don't shrink) zip one chunk at a time."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name in names:
+            path = os.path.join(IMAGE_DIRECTORY, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                logging.warning(f"Archive: skipping missing file {name}")
+                continue
+            info = zipfile.ZipInfo(name, date_time=time.localtime(st.st_mtime)[:6])
+            info.file_size = st.st_size
+            with archive.open(info, 'w', force_zip64=st.st_size >= 0xFFFFFFFF) as entry:
+                for chunk in _read_chunks(path, st.st_size):
+                    entry.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+def _recording(names, archived):
+    """Passes names through, appending each to `archived`."""
+    for name in names:
+        archived.append(name)
+        yield name
+
+def _mark_exported_after(body, names):
+    """Passes an archive body through, marking its images exported once it was sent completely."""
+    yield from body
+    image_index.mark_exported(names)
+
+def _archive_names(files, since, until):
+    """Explicit file names, or every indexed image in the time range, newest first."""
+    if files:
+        for name in files:
+            if os.path.basename(name) == name and name.lower().endswith(IMAGE_EXTENSIONS):
+                yield name
+        return
+    cursor = None
+    while True:
+        rows, cursor = image_index.page(200, cursor=cursor, since=since, until=until)
+        for row in rows:
+            yield row[0]
+        if cursor is None:
+            return
+
+@app.route('/images/archive')
+def get_archive():
+    """Streams a tar or zip of selected images without buffering the archive.
+
+    Select with ?files=a.jpeg,b.jpeg (or repeated files=) or with since=/until=;
+    ?format=tar (default) or zip.
+    """
+    archive_format = request.args.get('format', 'tar')
+    if archive_format not in ('tar', 'zip'):
+        return jsonify(error="format must be tar or zip"), 400
+    files = [name for value in request.args.getlist('files') for name in value.split(',') if name]
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
+        since = parse_time_param(request.args.get('since'))
+        until = parse_time_param(request.args.get('until'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if not files and since is None and until is None:
+        return jsonify(error="select images with files= or since=/until="), 400
+    
+    update_timer()
+    archived = []
+    names = _recording(_archive_names(files, since, until), archived)
+    body = stream_tar(names) if archive_format == 'tar' else stream_zip(names)
+    body = _mark_exported_after(body, archived)
+    filename = f"RF_images_{datetime.now().strftime('%Y-%m-%dT%H_%M_%S')}.{archive_format}"
+    response = Response(body, mimetype='application/x-tar' if archive_format == 'tar' else 'application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
-        # Use scandir for better performance, get stats for sorting
-        files_with_stats = []
-        with os.scandir(IMAGE_DIRECTORY) as entries:
-            for entry in entries:
-                if entry.is_file() and entry.name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                    files_with_stats.append((entry.name, entry.stat().st_mtime))
-
-        # Sort by modification time, newest first
-        files_with_stats.sort(key=lambda x: x[1], reverse=True)
-        sorted_filenames = [f[0] for f in files_with_stats]
-
-        total_files = len(sorted_filenames)
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_files = sorted_filenames[start:end]
-
-        return jsonify({
-            "page": page,
-            "per_page": per_page,
-            "total": total_files,
-            "files": paginated_files
-        })
+@app.route('/thumbnails/<filename>')
+def get_thumbnail(filename):
+    """Reduced-size JPEG of a captured image; ?size= is snapped to THUMBNAIL_SIZES."""
+    try:
+        size = thumbnail_size_param(request.args.get('size'))
+    except ValueError:
+        return jsonify(error="size must be an integer"), 400
+    if os.path.basename(filename) != filename or not filename.lower().endswith(IMAGE_EXTENSIONS):
+        return jsonify(error="invalid filename"), 400
+    try:
+        path = thumbnail_cache.get(filename, size)
     except Exception as e:
-        logging.error(f"Error listing files: {e}")
+        logging.error(f"Thumbnail for {filename} failed: {e}")
         return jsonify(error=str(e)), 500
-
-@app.route('/images/<path:filename>')
-def get_file(filename):
-    return send_from_directory(IMAGE_DIRECTORY, filename)
+    if path is None:
+        return jsonify(error="image not found"), 404
+    # Captures are never rewritten under the same name, so thumbnails can be cached for long
+    return send_file(os.path.abspath(path), mimetype='image/jpeg', max_age=86400)
 
 @app.route('/led1_status')
 def led1_status_route():
@@ -500,12 +3081,14 @@ def uv_status_route():
 def toggle_led1_route():
     update_timer()
     led1.toggle()
+    publish_leds()
     return jsonify(active=led1.is_active)
 
 @app.route('/led2_toggle')
 def toggle_led2_route():
     update_timer()
     led2.toggle()
+    publish_leds()
     return jsonify(active=led2.is_active)
 
 @app.route('/poweroff')
@@ -516,19 +3099,676 @@ def poweroff_route():
     threading.Timer(2.0, lambda: check_call(['sudo', 'poweroff'])).start()
     return jsonify(status="powering_off")
 
+# --- JPEG Encoding ---
+
+class OpenCVEncoder:
+    """Encodes BGR frames with cv2.imencode."""
+    name = "opencv"
+    needs_frame = True
+
+    def encode(self, frame, quality):
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        return buffer.tobytes() if ret else None
+
+    def detach(self):
+        pass
+
+class SimpleJpegEncoder:
+    """Encodes BGR frames with simplejpeg (libjpeg-turbo), usually faster than OpenCV on ARM."""
+    name = "simplejpeg"
+    needs_frame = True
+
+    def __init__(self):
+        import simplejpeg
+        self._simplejpeg = simplejpeg
+
+    def encode(self, frame, quality):
+        return self._simplejpeg.encode_jpeg(frame, quality=int(quality), colorspace='BGR', fastdct=True)
+
+    def detach(self):
+        pass
+
+class _JpegFrameSlot(io.BufferedIOBase):
+    """File-like sink for picamera2's FileOutput that keeps only the newest JPEG."""
+
+    def __init__(self):
+        super().__init__()
+        self.cond = threading.Condition()
+        self.frame = None
+        self.seq = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        with self.cond:
+            self.frame = bytes(data)
+            self.seq += 1
+            self.cond.notify_all()
+        return len(data)
+
+class Picamera2JpegPassthrough:
+    """Passes through JPEGs from picamera2's hardware MJPEG encoder.
+
+    The frames are compressed on the GPU, so there is no capture, conversion
+    or CPU encode on our side; the producer just hands the finished JPEG on.
+    Quality is mapped to picamera2's coarse Quality levels, and the encoder
+    is restarted when the adaptive quality crosses into another level.
+    """
+    name = "picamera2"
+    needs_frame = False
+
+    def __init__(self):
+        from picamera2.encoders import MJPEGEncoder, Quality
+        from picamera2.outputs import FileOutput
+        if not os.path.exists("/dev/video11"):
+            raise RuntimeError("hardware JPEG encoder (/dev/video11) not present")
+        self._encoder_class = MJPEGEncoder
+        self._output_class = FileOutput
+        self._quality_levels = list(Quality)
+        self._slot = _JpegFrameSlot()
+        self._last_seq = 0
+        self._encoder = None
+        self._camera = None
+        self._level = None
+
+    def start(self, cam, quality):
+        """Starts the hardware encoder on cam unless it already runs there at this quality level (camera thread)."""
+        level = self._quality_levels[min(len(self._quality_levels) - 1, int(quality) // 20)]
+        if self._encoder is None or self._camera is not cam or self._level is not level:
+            self.detach()
+            self._encoder = self._encoder_class()
+            cam.start_encoder(self._encoder, self._output_class(self._slot),
+                              name=stream_source[0], quality=level)
+            self._camera = cam
+            self._level = level
+            logging.info(f"Hardware MJPEG encoder started (quality {level.name})")
+
+    def next_frame(self, timeout=1.0):
+        """Waits for the next JPEG from the running hardware encoder; None on timeout."""
+        with self._slot.cond:
+            if not self._slot.cond.wait_for(lambda: self._slot.seq != self._last_seq, timeout):
+                return None
+            self._last_seq = self._slot.seq
+            return self._slot.frame
+
+    def detach(self):
+        """Stops the hardware encoder so the camera can be reconfigured or closed."""
+        if self._encoder is None:
+            return
+        try:
+            self._camera.stop_encoder(self._encoder)
+        except Exception as e:
+            logging.warning(f"Failed to stop hardware MJPEG encoder: {e}")
+        self._encoder = None
+        self._camera = None
+        self._level = None
+
+# Preference order when probe times tie; the hardware passthrough is only used when
+# STREAM_ENCODER names it, since it has no CPU encode to time against the others
+ENCODER_BACKENDS = (Picamera2JpegPassthrough, SimpleJpegEncoder, OpenCVEncoder)
+
+stream_encoder = None
+cpu_stream_encoder = None  # Fastest frame-based backend, for profiles the hardware encoder does not serve
+encoder_stats = {'backend': None, 'probe_ms': {}, 'encode_ms': None}
+
+def _probe_frame():
+    """Synthetic stream-sized BGR frame with gradients and noise, roughly as compressible as a real scene."""
+    width, height = STREAM_RESOLUTION
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    frame = np.broadcast_to(gradient, (height, width, 3)) + rng.normal(0, 12, (height, width, 3))
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+def select_stream_encoder():
+    """Times each available backend on a synthetic frame and picks the encoder for streaming.
+
+    STREAM_ENCODER forces a backend by name; "auto" takes the fastest of the
+    CPU backends. The hardware passthrough is never probed and only used when
+    named.
+    """
+    global stream_encoder, cpu_stream_encoder
+    available = {}
+    for backend in ENCODER_BACKENDS:
+        if not backend.needs_frame and STREAM_ENCODER != backend.name:
+            continue
+        try:
+            available[backend.name] = backend()
+        except Exception as e:
+            logging.info(f"JPEG encoder '{backend.name}' unavailable: {e}")
+
+    frame = _probe_frame()
+    probe_ms = {}
+    for name, encoder in available.items():
+        if not encoder.needs_frame:
+            continue
+        try:
+            encoder.encode(frame, STREAM_JPEG_QUALITY)  # Warm-up, excluded from timing
+            start = time.perf_counter()
+            for _ in range(ENCODER_PROBE_FRAMES):
+                encoder.encode(frame, STREAM_JPEG_QUALITY)
+            probe_ms[name] = (time.perf_counter() - start) * 1000 / ENCODER_PROBE_FRAMES
+        except Exception as e:
+            logging.warning(f"JPEG encoder '{name}' failed probe: {e}")
+
+    if STREAM_ENCODER in probe_ms or (STREAM_ENCODER in available and not available[STREAM_ENCODER].needs_frame):
+        chosen = STREAM_ENCODER
+    else:
+        if STREAM_ENCODER != "auto":
+            logging.warning(f"Configured JPEG encoder '{STREAM_ENCODER}' unavailable, choosing automatically")
+        chosen = min(probe_ms, key=probe_ms.get) if probe_ms else OpenCVEncoder.name
+    stream_encoder = available.get(chosen) or OpenCVEncoder()
+    cpu_stream_encoder = available[min(probe_ms, key=probe_ms.get)] if probe_ms else OpenCVEncoder()
+
+    encoder_stats['backend'] = stream_encoder.name
+    encoder_stats['probe_ms'] = {name: round(ms, 2) for name, ms in probe_ms.items()}
+    encoder_stats['encode_ms'] = None
+    timings = ", ".join(f"{name}={ms:.1f}ms" for name, ms in probe_ms.items())
+    logging.info(f"JPEG encoder selected: {stream_encoder.name} ({timings})")
+    return stream_encoder
+
+def get_stream_encoder():
+    return stream_encoder or select_stream_encoder()
+
+def detach_stream_encoder():
+    """Releases any hardware encoder attached to the camera before it is reconfigured."""
+    if stream_encoder is not None:
+        stream_encoder.detach()
+
+def record_encode_time(seconds):
+    """Keeps a smoothed per-frame encode time for /system_status."""
+    ms = seconds * 1000
+    previous = encoder_stats['encode_ms']
+    encoder_stats['encode_ms'] = ms if previous is None else previous * 0.9 + ms * 0.1
+
 # --- Video Streaming ---
 
-def generate_frames():
-    """Generate video frames optimized for RPi Zero W - lower res, adaptive quality."""
-    global VIDEO_STREAM_ACTIVE, client_status
+class FrameConverter:
+    """Turns stream frames into the BGR layout cv2.imencode expects.
+
+    Handles the XBGR8888 main stream and the YUV420 lores stream used when
+    the main stream is busy with ZSL frames. The output array is allocated
+    once and reused for every frame, and the conversion is a single
+    cv2.cvtColor pass straight from the camera's mapped buffer, so the hot
+    loop does no per-frame allocation. With an output_size smaller than the
+    stream (a lores profile while ZSL holds lores at the stream size), the
+    frame is scaled into a second reused buffer.
+    The returned frame is only valid until the next call.
+    """
+
+    def __init__(self, resolution, source=("main", "XBGR8888"), output_size=None):
+        width, height = resolution
+        self.source = source
+        self.resolution = tuple(resolution)
+        self._width = width
+        self._out = np.empty((height, width, 3), dtype=np.uint8)
+        self._output_size = tuple(output_size) if output_size and tuple(output_size) != self.resolution else None
+        self._scaled = np.empty((output_size[1], output_size[0], 3), dtype=np.uint8) if self._output_size else None
+
+    @property
+    def nbytes(self):
+        return self._out.nbytes + (self._scaled.nbytes if self._scaled is not None else 0)
+
+    def from_request(self, request):
+        """Converts the stream of a completed request without copying it out first."""
+        stream, fmt = self.source
+        with MappedArray(request, stream) as mapped:
+            if fmt == "YUV420":
+                frame = self.convert_yuv420(mapped.array)
+            else:
+                frame = self.convert(mapped.array)
+        if self._output_size:
+            cv2.resize(frame, self._output_size, dst=self._scaled, interpolation=cv2.INTER_AREA)
+            return self._scaled
+        return frame
+
+    def convert_yuv420(self, frame):
+        """Converts a planar (h * 3/2, w) YUV420 frame."""
+        height = frame.shape[0] * 2 // 3
+        if (height, frame.shape[1]) != self._out.shape[:2]:
+            # Rows may be padded to the ISP's stride; convert at that width once
+            # and crop the padding off the (reused) output
+            self._out = np.empty((height, frame.shape[1], 3), dtype=np.uint8)
+        cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420, dst=self._out)
+        return self._out[:, :self._width]
+
+    def convert(self, frame):
+        """Converts an XBGR frame, given as an (h, w, 4) array or a flat byte buffer."""
+        if frame.ndim != 3:
+            frame = np.frombuffer(frame, dtype=np.uint8)
+            rows = len(frame) // (self._width * 4)
+            if rows == 0:
+                raise ValueError(f"Frame buffer too small: {len(frame)} bytes")
+            if rows * self._width * 4 != len(frame):
+                logging.warning(f"Buffer size mismatch: got {len(frame)}, expected {self._out.size // 3 * 4}")
+                frame = frame[:rows * self._width * 4]
+            frame = frame.reshape((rows, self._width, 4))
+        if frame.shape[:2] != self._out.shape[:2]:
+            # Camera delivered a different geometry than configured; resize the
+            # output once and keep reusing it from here on
+            logging.warning(f"Frame geometry changed to {frame.shape[1]}x{frame.shape[0]}")
+            self._width = frame.shape[1]
+            self._out = np.empty((frame.shape[0], frame.shape[1], 3), dtype=np.uint8)
+        # XBGR8888 is R, G, B, X in memory; drop X and reverse into BGR for OpenCV
+        cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR, dst=self._out)
+        return self._out
+
+class StreamController:
+    """Adjusts stream JPEG quality and frame rate to hold STREAM_TARGET_LATENCY.
+
+    The producer reports encode times and published frames, and every viewer
+    reports how long its yield blocked (socket backpressure). Every
+    STREAM_ADAPT_INTERVAL the controller compares encode + send time and the
+    achieved frame rate against the target: over budget it lowers quality
+    first, then frame rate; with headroom it restores frame rate first, then
+    quality. Everything stays within the configured bounds.
+    """
+
+    def __init__(self, quality=STREAM_JPEG_QUALITY, framerate=STREAM_FRAMERATE, adaptive=ADAPTIVE_STREAM_ENABLED):
+        self._lock = threading.Lock()
+        self.adaptive = adaptive
+        if adaptive:
+            quality = min(max(quality, STREAM_QUALITY_BOUNDS[0]), STREAM_QUALITY_BOUNDS[1])
+            framerate = min(max(framerate, STREAM_FRAMERATE_BOUNDS[0]), STREAM_FRAMERATE_BOUNDS[1])
+        self.quality = quality
+        self.framerate = framerate
+        self.adjustments = deque(maxlen=20)
+        self.last_measurement = None
+        self.reset()
+
+    @property
+    def frame_interval(self):
+        return 1.0 / self.framerate
+
+    def reset(self):
+        """Starts a fresh measurement window, e.g. when the producer (re)starts."""
+        with self._lock:
+            self._window_start = time.monotonic()
+            self._frames = 0
+            self._unchanged = 0
+            self._encode_total = 0.0
+            self._send_total = 0.0
+            self._sends = 0
+
+    def record_encode(self, seconds):
+        with self._lock:
+            self._encode_total += seconds
+
+    def record_frame(self):
+        with self._lock:
+            self._frames += 1
+
+    def record_unchanged(self):
+        """A frame change detection skipped; counts toward the achieved frame rate only."""
+        with self._lock:
+            self._unchanged += 1
+
+    def record_send(self, seconds):
+        with self._lock:
+            self._send_total += seconds
+            self._sends += 1
+
+    def update(self):
+        """Called by the producer after each frame; decides once per window."""
+        if not self.adaptive:
+            return
+        with self._lock:
+            elapsed = time.monotonic() - self._window_start
+            if elapsed < STREAM_ADAPT_INTERVAL or self._frames == 0:
+                return
+            encode = self._encode_total / self._frames
+            send = self._send_total / self._sends if self._sends else 0.0
+            fps = (self._frames + self._unchanged) / elapsed
+        self.reset()
+
+        latency = encode + send
+        self.last_measurement = {
+            'encode_ms': round(encode * 1000, 2),
+            'send_ms': round(send * 1000, 2),
+            'latency_ms': round(latency * 1000, 2),
+            'fps': round(fps, 2),
+        }
+
+        quality, framerate = self.quality, self.framerate
+        min_quality, max_quality = STREAM_QUALITY_BOUNDS
+        min_fps, max_fps = STREAM_FRAMERATE_BOUNDS
+        falling_behind = fps < framerate * 0.8
+        if latency > STREAM_TARGET_LATENCY * 1.2 or falling_behind:
+            # Smaller frames fix slow links; fewer frames fix a saturated CPU
+            if quality > min_quality and not falling_behind:
+                quality = max(min_quality, quality - STREAM_QUALITY_STEP)
+            elif framerate > min_fps:
+                framerate = max(min_fps, framerate - 1)
+            elif quality > min_quality:
+                quality = max(min_quality, quality - STREAM_QUALITY_STEP)
+        elif latency < STREAM_TARGET_LATENCY * 0.6:
+            if framerate < max_fps:
+                framerate = min(max_fps, framerate + 1)
+            elif quality < max_quality:
+                quality = min(max_quality, quality + STREAM_QUALITY_STEP)
+
+        if (quality, framerate) != (self.quality, self.framerate):
+            adjustment = {
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'quality': [self.quality, quality],
+                'framerate': [self.framerate, framerate],
+                **self.last_measurement,
+            }
+            self.adjustments.append(adjustment)
+            logging.info(f"Stream adjusted: quality {self.quality}->{quality}, "
+                         f"{self.framerate}->{framerate} fps "
+                         f"(latency {latency * 1000:.0f}ms, achieved {fps:.1f} fps)")
+            self.quality, self.framerate = quality, framerate
+
+    def status(self):
+        return {
+            'enabled': self.adaptive,
+            'quality': self.quality,
+            'framerate': self.framerate,
+            'target_latency_ms': STREAM_TARGET_LATENCY * 1000,
+            'quality_bounds': list(STREAM_QUALITY_BOUNDS),
+            'framerate_bounds': list(STREAM_FRAMERATE_BOUNDS),
+            'last_measurement': self.last_measurement,
+            'adjustments': list(self.adjustments),
+        }
+
+class ChangeDetector:
+    """Decides whether a stream frame differs enough from the last one sent to be worth encoding.
+
+    Each frame is reduced to a thumbnail of CHANGE_DETECTION_CELL-sized cells
+    (a strided sample of the green channel, averaged per cell) and compared
+    with the thumbnail of the last frame sent. Frames where fewer than
+    CHANGE_DETECTION_MIN_AREA of the cells moved by more than
+    CHANGE_DETECTION_THRESHOLD are skipped; while the scene stays static the
+    last frame is re-sent every CHANGE_KEEPALIVE_INTERVAL seconds so viewers
+    do not time out. Savings are estimated from the measured encode time and
+    frame size of the frames that were sent.
+    """
+
+    def __init__(self, profile, enabled=CHANGE_DETECTION_ENABLED):
+        self.profile = profile
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._reference = None
+        self._last_sent = 0.0
+        self._encode_seconds = None  # Smoothed encode time of sent frames
+        self._frame_bytes = None  # Smoothed size of sent frames
+        self._stats = {'checked': 0, 'unchanged': 0, 'keepalives': 0, 'detect_seconds': 0.0,
+                       'encode_seconds_saved': 0.0, 'bytes_saved': 0}
+
+    def reset(self):
+        """Forgets the reference frame, e.g. when the producer (re)starts."""
+        self._reference = None
+
+    @staticmethod
+    def _thumbnail(frame):
+        sample = CHANGE_DETECTION_CELL // 4
+        grid = frame[::sample, ::sample, 1]
+        height, width = grid.shape[0] // 4 * 4, grid.shape[1] // 4 * 4
+        return grid[:height, :width].reshape(height // 4, 4, width // 4, 4).mean(axis=(1, 3), dtype=np.float32)
+
+    def check(self, frame):
+        """Returns "changed" (encode and send it), "unchanged" (skip it) or "keepalive" (re-send the last frame)."""
+        if not self.enabled:
+            return "changed"
+        start = time.perf_counter()
+        thumbnail = self._thumbnail(frame)
+        if self._reference is None or self._reference.shape != thumbnail.shape:
+            changed = True
+        else:
+            moved = np.count_nonzero(np.abs(thumbnail - self._reference) > CHANGE_DETECTION_THRESHOLD)
+            changed = moved >= CHANGE_DETECTION_MIN_AREA * thumbnail.size
+        if changed:
+            self._reference = thumbnail
+        with self._lock:
+            self._stats['checked'] += 1
+            self._stats['detect_seconds'] += time.perf_counter() - start
+        if changed:
+            return "changed"
+        return "keepalive" if time.monotonic() - self._last_sent >= CHANGE_KEEPALIVE_INTERVAL else "unchanged"
+
+    def record_sent(self, encode_seconds, frame_bytes):
+        """Called for every encoded frame; its cost is what a skipped frame saves."""
+        self._last_sent = time.monotonic()
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._encode_seconds is None:
+                self._encode_seconds, self._frame_bytes = encode_seconds, frame_bytes
+            else:
+                self._encode_seconds = self._encode_seconds * 0.9 + encode_seconds * 0.1
+                self._frame_bytes = self._frame_bytes * 0.9 + frame_bytes * 0.1
+
+    def record_keepalive(self):
+        self._last_sent = time.monotonic()
+        with self._lock:
+            self._stats['keepalives'] += 1
+
+    def record_unchanged(self, viewers):
+        with self._lock:
+            self._stats['unchanged'] += 1
+            if self._encode_seconds is None:
+                return
+            saved_bytes = int(self._frame_bytes * viewers)
+            self._stats['encode_seconds_saved'] += self._encode_seconds
+            self._stats['bytes_saved'] += saved_bytes
+            encode_seconds = self._encode_seconds
+        stream_encode_seconds_saved.inc(self.profile, encode_seconds)
+        stream_bytes_saved.inc(self.profile, saved_bytes)
+
+    def status(self):
+        with self._lock:
+            stats = dict(self._stats)
+        # Net CPU saving: encodes avoided minus the cost of checking every frame
+        return {
+            'enabled': self.enabled,
+            'threshold': CHANGE_DETECTION_THRESHOLD,
+            'min_area': CHANGE_DETECTION_MIN_AREA,
+            'keepalive_interval': CHANGE_KEEPALIVE_INTERVAL,
+            'frames_checked': stats['checked'],
+            'frames_unchanged': stats['unchanged'],
+            'keepalives': stats['keepalives'],
+            'detect_ms_avg': round(stats['detect_seconds'] * 1000 / stats['checked'], 3) if stats['checked'] else None,
+            'cpu_ms_saved': round((stats['encode_seconds_saved'] - stats['detect_seconds']) * 1000, 1),
+            'bytes_saved': stats['bytes_saved'],
+        }
+
+class FrameBroadcaster:
+    """Runs a single capture-and-encode producer and fans its frames out to every viewer.
+
+    The producer publishes each multipart JPEG chunk once into a shared slot.
+    Viewers read the latest chunk at their own pace, so slow clients simply
+    skip frames and never hold up the producer or each other. There is one
+    broadcaster per stream profile, each with its own rate controller.
+    """
+
+    def __init__(self, profile=STREAM_DEFAULT_PROFILE):
+        spec = STREAM_PROFILES[profile]
+        self.profile = profile
+        self.controller = StreamController(spec["quality"], spec["framerate"], spec["adaptive"])
+        self.change_detector = ChangeDetector(profile)
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._subscribers = 0
+        self._thread = None
+        self._listeners = set()
+        self._shed = False
+
+    @property
+    def subscriber_count(self):
+        with self._cond:
+            return self._subscribers
+
+    @property
+    def producing(self):
+        with self._cond:
+            return self._thread is not None
+
+    def add_listener(self, callback):
+        """Registers a callback run on the producer thread after each publish (used by async mode)."""
+        with self._cond:
+            self._listeners.add(callback)
+
+    def remove_listener(self, callback):
+        with self._cond:
+            self._listeners.discard(callback)
+
+    def poll(self, last_seq):
+        """Non-blocking: (seq, frame_data) if a frame newer than last_seq exists, else None."""
+        with self._cond:
+            if self._seq == last_seq or self._frame is None or self._shed:
+                return None
+            return self._seq, self._frame
+
+    def subscribe(self):
+        """Registers a viewer, starting the producer for the first one."""
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None:
+                self._shed = False
+                self._thread = threading.Thread(target=self._run, name=f"stream-{self.profile}", daemon=True)
+                self._thread.start()
+                logging.info(f"Frame producer started ({self.profile})")
+            return self._seq
+
+    def unsubscribe(self):
+        """Removes a viewer; the producer stops once the last one has gone."""
+        with self._cond:
+            self._subscribers = max(0, self._subscribers - 1)
+            if self._subscribers == 0:
+                self._set_frame(None)
+                self._shed = False
+            self._cond.notify_all()
+
+    def shed(self):
+        """Ends every viewer of this profile and stops its producer, to give memory back."""
+        with self._cond:
+            if self._subscribers == 0 or self._shed:
+                return 0
+            self._shed = True
+            self._cond.notify_all()
+            return self._subscribers
+
+    def _set_frame(self, frame_data):
+        """Replaces the published frame, accounting its size to encoded_frames; caller holds the lock."""
+        old_size = len(self._frame) if self._frame is not None else 0
+        memory_governor.add("encoded_frames", (len(frame_data) if frame_data is not None else 0) - old_size)
+        self._frame = frame_data
+
+    def keep_running(self):
+        """Called by the producer loop; False once nobody is watching any more."""
+        with self._cond:
+            if self._subscribers > 0 and not self._shed:
+                return True
+            # Detach now so the next viewer starts a fresh producer immediately
+            if self._thread is threading.current_thread():
+                self._thread = None
+            return False
+
+    def publish(self, frame_data):
+        with self._cond:
+            self._set_frame(frame_data)
+            self._seq += 1
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    def wait_frame(self, last_seq, timeout=STREAM_TIMEOUT):
+        """Blocks until a frame newer than last_seq exists.
+
+        Returns (seq, frame_data), or None if the producer stopped or no new
+        frame arrived within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._seq == last_seq or self._frame is None or self._shed:
+                if self._thread is None or self._shed:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._seq, self._frame
+
+    def _run(self):
+        try:
+            for frame_data in generate_frames(self.profile):
+                self.publish(frame_data)
+        except Exception as e:
+            logging.error(f"Frame producer error: {e}")
+        finally:
+            with self._cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                self._cond.notify_all()
+                listeners = list(self._listeners)
+            for callback in listeners:
+                callback()  # Lets async viewers notice the producer is gone
+            logging.info(f"Frame producer stopped ({self.profile})")
+
+frame_broadcasters = {profile: FrameBroadcaster(profile) for profile in STREAM_PROFILES}
+frame_broadcaster = frame_broadcasters[STREAM_DEFAULT_PROFILE]
+stream_controller = frame_broadcaster.controller
+
+def total_viewers():
+    return sum(broadcaster.subscriber_count for broadcaster in frame_broadcasters.values())
+
+def shed_stream_profiles():
+    """Ends the viewers of every profile except the default one; returns how many were shed."""
+    shed = 0
+    for profile, broadcaster in frame_broadcasters.items():
+        if profile == STREAM_DEFAULT_PROFILE:
+            continue
+        viewers = broadcaster.shed()
+        if viewers:
+            memory_degradations_total.inc("viewers_shed", viewers)
+            logging.warning(f"Memory pressure: shed {viewers} {profile} viewer(s)")
+            shed += viewers
+    return shed
+
+def admit_viewer(profile):
+    """False if memory is exhausted and this viewer would start a new producer (joining a running one is free)."""
+    if frame_broadcasters[profile].producing or memory_governor.pressure() != "critical":
+        return True
+    memory_degradations_total.inc("viewer_refused")
+    logging.warning(f"Memory exhausted: refused a new {profile} viewer")
+    return False
+
+def _profile_source(profile):
+    """((camera stream, format), resolution) of the camera output a profile is served from."""
+    if STREAM_PROFILES[profile]["stream"] == "lores" and lores_resolution:
+        return ("lores", "YUV420"), lores_resolution
+    return stream_source, STREAM_RESOLUTION
+
+def generate_frames(profile=STREAM_DEFAULT_PROFILE):
+    """Generate video frames optimized for RPi Zero W - lower res, adaptive quality.
+
+    Runs on the profile's producer thread for as long as anyone is watching it.
+    """
+    global client_status
     
+    broadcaster = frame_broadcasters[profile]
+    stream_controller = broadcaster.controller
+    change_detector = broadcaster.change_detector
+    change_detector.reset()
+    last_frame_data = None
     frames_without_data = 0
     max_frames_without_data = 30  # Increased to allow more retries
     frame_skip_counter = 0
-    skip_rate = 1 if RPI_ZERO_MODE else 0
-    last_frame_time = time.time()
-    frame_interval = 1.0 / STREAM_FRAMERATE
-    jpeg_quality = STREAM_JPEG_QUALITY
+    # The adaptive controller paces frames itself, so fixed skipping only applies without it
+    skip_rate = 1 if RPI_ZERO_MODE and not ADAPTIVE_STREAM_ENABLED else 0
+    last_frame_time = 0.0  # First frame goes out immediately; pacing starts after it
+    stream_controller.reset()
+    source, resolution = _profile_source(profile)
+    frame_converter = FrameConverter(resolution, source, STREAM_PROFILES[profile]["resolution"])
+    converter_bytes = frame_converter.nbytes
+    memory_governor.add("stream_frames", converter_bytes)
+    encoder = get_stream_encoder()
+    if not encoder.needs_frame and profile != STREAM_DEFAULT_PROFILE:
+        # The hardware encoder serves the default profile's stream only
+        encoder = cpu_stream_encoder
     
     # Retry counter for initialization
     init_retry_count = 0
@@ -553,16 +3793,17 @@ def generate_frames():
             
         logging.info("Camera successfully initialized for streaming")
         
-        while VIDEO_STREAM_ACTIVE:
+        while broadcaster.keep_running():
             # Periodically update client status to prevent timeout
             current_time = time.time()
             if current_time - last_ping_time > ping_interval:
-                with state_lock:
-                    client_status['last_ping'] = datetime.now()
-                    client_status['status'] = True
+                mark_client_active()
                 last_ping_time = current_time
             
             try:
+                frame_interval = stream_controller.frame_interval
+                jpeg_quality = stream_controller.quality
+                
                 # Frame rate limiting for smoother playback
                 current_time = time.time()
                 time_since_last = current_time - last_frame_time
@@ -572,91 +3813,122 @@ def generate_frames():
                 
                 last_frame_time = time.time()
                 
-                # Use lock with timeout to prevent hanging on Zero W
-                if not camera_lock.acquire(timeout=2.0):  # Increased timeout
-                    logging.warning("Camera lock timeout")
-                    continue
-                
+                capture_error = None
+                jpeg_bytes = None
+                frame = None
                 try:
-                    # Use capture_buffer instead of capture_array for better compatibility
-                    frame_buffer = camera.capture_buffer("main")
-                    if frame_buffer is None:
-                        frames_without_data += 1
-                        logging.warning(f"Empty frame captured ({frames_without_data}/{max_frames_without_data})")
-                        if frames_without_data > max_frames_without_data:
-                            logging.error("Too many empty frames, stopping stream")
-                            break
-                        time.sleep(0.1)
-                        continue
-                    
-                    # Convert buffer to numpy array for OpenCV processing
-                    import numpy as np
-                    frame_array = np.frombuffer(frame_buffer, dtype=np.uint8)
-                    
-                    # Calculate expected buffer size based on actual camera configuration
-                    width, height = STREAM_RESOLUTION
-                    # Assuming XBGR8888 format (4 bytes per pixel)
-                    expected_size = width * height * 4
-                    
-                    # Check if buffer size matches expectation
-                    if len(frame_array) != expected_size:
-                        logging.warning(f"Buffer size mismatch: got {len(frame_array)}, expected {expected_size}")
-                        # Try to adjust resolution dynamically
-                        adjusted_height = len(frame_array) // (width * 4)
-                        if adjusted_height > 0:
-                            frame_bgra = frame_array.reshape((adjusted_height, width, 4))
-                            # Extract only the BGR channels (indices 2,1,0) from XBGR format
-                            frame = frame_bgra[:, :, 0:3]  # Remove padding channel
-                            frame = frame[:, :, [2, 1, 0]]  # Convert BGR to RGB for OpenCV
-                        else:
-                            logging.error("Cannot reshape frame array due to size mismatch")
+                    if encoder.needs_frame:
+                        source, resolution = _profile_source(profile)
+                        if (source, resolution) != (frame_converter.source, frame_converter.resolution):
+                            # Camera was reconfigured (e.g. ZSL toggled) under the running stream
+                            frame_converter = FrameConverter(resolution, source, STREAM_PROFILES[profile]["resolution"])
+                            memory_governor.add("stream_frames", frame_converter.nbytes - converter_bytes)
+                            converter_bytes = frame_converter.nbytes
+                        # Time-limited so a long still readout cannot hang the stream on Zero W
+                        frame = camera_actor.call("stream_frame", _grab_stream_frame, frame_converter, timeout=2.0)
+                        if frame is None:
+                            # Sensor is held in still mode by a burst; wait for the preview
+                            stream_frames_total.inc("skipped")
+                            time.sleep(0.1)
                             continue
                     else:
-                        # Reshape based on stream resolution (assuming XBGR format)
-                        frame_bgra = frame_array.reshape((height, width, 4))
-                        # Extract only the BGR channels (indices 2,1,0) from XBGR format
-                        frame = frame_bgra[:, :, 0:3]  # Remove padding channel
-                        frame = frame[:, :, [2, 1, 0]]  # Convert BGR to RGB for OpenCV
-                    
-                    frames_without_data = 0  # Reset counter on successful frame
-                    
-                except Exception as capture_error:
-                    camera_lock.release()
+                        # Hardware encoder hands over finished JPEGs; nothing to convert.
+                        # Only starting it touches the camera; the wait for a frame does not
+                        stage_start = time.perf_counter()
+                        if not camera_actor.call("start_encoder", _start_hw_stream_encoder, encoder, jpeg_quality,
+                                                 timeout=2.0):
+                            # Sensor is held in still mode by a burst; restart once the preview is back
+                            stream_frames_total.inc("skipped")
+                            time.sleep(0.1)
+                            continue
+                        jpeg_bytes = encoder.next_frame()
+                        hw_seconds = time.perf_counter() - stage_start
+                        stage_seconds.observe(hw_seconds, "stream_hw_encode")
+                        if jpeg_bytes is None:
+                            camera_lifecycle.frame_failed()
+                            raise RuntimeError("no frame from hardware JPEG encoder")
+                        camera_lifecycle.frame_ok()
+                        # Reported as encode_ms, but kept out of the controller: it includes the
+                        # wait for the sensor's next frame, which is not encoder load
+                        record_encode_time(hw_seconds)
+                except TimeoutError:
+                    logging.warning("Camera busy, stream frame skipped")
+                    continue
+                except Exception as e:
+                    capture_error = e
+                
+                if capture_error is not None:
+                    stream_frames_total.inc("error")
                     frames_without_data += 1
                     logging.warning(f"Frame capture error: {capture_error} ({frames_without_data}/{max_frames_without_data})")
                     if frames_without_data > max_frames_without_data:
                         logging.error("Too many frame capture errors, stopping stream")
                         break
+                    if frames_without_data % 10 == 0:
+                        # Grabs keep failing: the camera is marked failed, so this re-creates it
+                        initialize_camera()
                     time.sleep(0.2)
                     continue
-                finally:
-                    camera_lock.release()
+                
+                frames_without_data = 0  # Reset counter on successful frame
                 
                 # Skip frames on Zero W for smoother playback
                 if RPI_ZERO_MODE:
                     frame_skip_counter += 1
                     if frame_skip_counter % (skip_rate + 1) != 0:
+                        stream_frames_total.inc("skipped")
                         continue
                 
-                # Encode frame to JPEG with optimized quality
-                ret, buffer = cv2.imencode('.jpg', frame, 
-                                          [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)])
+                frame_data = None
+                if jpeg_bytes is None:
+                    # Static scene: skip the encode, re-sending the last frame now and then
+                    change = change_detector.check(frame)
+                    if change == "unchanged":
+                        if profile == STREAM_DEFAULT_PROFILE:
+                            snapshot_cache.touch()
+                        stream_frames_total.inc("unchanged")
+                        change_detector.record_unchanged(broadcaster.subscriber_count)
+                        stream_controller.record_unchanged()
+                        continue
+                    if change == "keepalive" and last_frame_data is not None:
+                        if profile == STREAM_DEFAULT_PROFILE:
+                            snapshot_cache.touch()
+                        stream_frames_total.inc("keepalive")
+                        change_detector.record_keepalive()
+                        frame_data = last_frame_data
                 
-                if not ret:
-                    logging.warning("JPEG encoding failed")
-                    continue
-                    
-                frame_bytes = buffer.tobytes()
-                # Yield frame and catch client disconnection
+                # Encode frame to JPEG with the selected backend
+                if jpeg_bytes is None and frame_data is None:
+                    encode_start = time.perf_counter()
+                    jpeg_bytes = encoder.encode(frame, jpeg_quality)
+                    encode_seconds = time.perf_counter() - encode_start
+                    record_encode_time(encode_seconds)
+                    stream_controller.record_encode(encode_seconds)
+                    stage_seconds.observe(encode_seconds, "stream_encode")
+                    if jpeg_bytes is None:
+                        stream_frames_total.inc("error")
+                        logging.warning("JPEG encoding failed")
+                        continue
+                    change_detector.record_sent(encode_seconds, len(jpeg_bytes))
+                
+                # Hand the frame to the producer thread, which publishes it to every viewer
                 try:
-                    frame_data = (b'--frame\r\n'
-                                  b'Content-Type: image/jpeg\r\n'
-                                  b'Content-Length: ' + str(len(frame_bytes)).encode() + b'\r\n'
-                                  b'\r\n' + frame_bytes + b'\r\n')
+                    if frame_data is None:
+                        frame_bytes = jpeg_bytes
+                        if profile == STREAM_DEFAULT_PROFILE:
+                            snapshot_cache.store(frame_bytes)
+                        frame_data = (b'--frame\r\n'
+                                      b'Content-Type: image/jpeg\r\n'
+                                      b'Content-Length: ' + str(len(frame_bytes)).encode() + b'\r\n'
+                                      b'\r\n' + frame_bytes + b'\r\n')
+                        last_frame_data = frame_data
                     yield frame_data
+                    stream_frames_total.inc("produced")
+                    stream_controller.record_frame()
+                    stream_controller.update()
                 except GeneratorExit:
-                    # Client disconnected, stop the stream
-                    logging.info("Client disconnected, stopping video stream")
+                    # The producer closed the generator; viewers leaving end the loop via keep_running()
+                    logging.info("Frame producer closed the stream")
                     break
                 except Exception as e:
                     # Other error during yield
@@ -672,8 +3944,163 @@ def generate_frames():
     except Exception as e:
         logging.error(f"Fatal error in frame generation: {e}")
     finally:
-        VIDEO_STREAM_ACTIVE = False
-        logging.info("Frame generation loop ended") 
+        memory_governor.release("stream_frames", converter_bytes)
+        try:
+            camera_actor.call("detach_encoder", encoder.detach)
+        except Exception as e:
+            logging.warning(f"Failed to detach stream encoder: {e}")
+        logging.info("Frame generation loop ended")
+
+def _start_hw_stream_encoder(encoder, quality):
+    """Camera-thread command: (re)starts the hardware stream encoder; False while in still mode."""
+    if camera_mode != "preview":
+        return False
+    encoder.start(camera, quality)
+    return True
+
+def _grab_stream_frame(frame_converter):
+    """Camera-thread command: converts the current stream frame, or None while in still mode."""
+    if camera_mode != "preview":
+        return None
+    # Map the request's buffer in place and convert it straight into the
+    # converter's reusable BGR frame - nothing is allocated per frame
+    stage_start = time.perf_counter()
+    try:
+        frame_request = camera.capture_request()
+    except Exception:
+        camera_lifecycle.frame_failed()
+        raise
+    observe_stage("stream_capture", stage_start)
+    camera_lifecycle.frame_ok()
+    try:
+        stage_start = time.perf_counter()
+        frame = frame_converter.from_request(frame_request)
+        observe_stage("stream_convert", stage_start)
+    finally:
+        frame_request.release()
+    return frame
+
+class SnapshotCache:
+    """Latest encoded preview frame, served by /snapshot.jpg.
+
+    The default profile's stream producer stores every frame it encodes (and
+    refreshes the timestamp when change detection finds the scene unchanged).
+    When the cached frame is older than a caller accepts, the first caller
+    starts a grab (camera start included) and concurrent callers share it
+    instead of starting their own. Everyone waits until SNAPSHOT_GRAB_TIMEOUT
+    after the grab began; a grab that overruns still fills the cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jpeg = None
+        self._taken_at = 0.0
+        self._pending = None  # Future of the grab in progress
+        self._grab_deadline = 0.0  # When callers stop waiting for it (monotonic)
+        self._converter = None
+
+    def store(self, jpeg_bytes):
+        with self._lock:
+            self._jpeg = jpeg_bytes
+            self._taken_at = time.monotonic()
+
+    def touch(self):
+        """The scene still matches the cached frame, so it counts as current."""
+        with self._lock:
+            if self._jpeg is not None:
+                self._taken_at = time.monotonic()
+
+    def _cached(self):
+        """(jpeg, age in seconds) of the cached frame, (None, None) if there is none. Caller holds the lock."""
+        if self._jpeg is None:
+            return None, None
+        return self._jpeg, time.monotonic() - self._taken_at
+
+    def get(self, max_age=SNAPSHOT_MAX_AGE):
+        """Returns (jpeg, age, source); source is "cache", "grab", "stale" (grab failed) or "none"."""
+        with self._lock:
+            jpeg, age = self._cached()
+            if jpeg is not None and age <= max_age:
+                return jpeg, age, "cache"
+            pending = self._pending
+            if pending is None:
+                pending = self._pending = Future()
+                self._grab_deadline = time.monotonic() + SNAPSHOT_GRAB_TIMEOUT
+                threading.Thread(target=self._run_grab, args=(pending,), name="snapshot", daemon=True).start()
+            deadline = self._grab_deadline
+        
+        try:
+            grabbed = pending.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            logging.warning(f"Snapshot grab did not finish within {SNAPSHOT_GRAB_TIMEOUT}s")
+            grabbed = False
+        except Exception as e:
+            logging.warning(f"Snapshot grab failed: {e}")
+            grabbed = False
+        
+        with self._lock:
+            jpeg, age = self._cached()
+        if jpeg is None:
+            return None, None, "none"
+        return jpeg, age, "grab" if grabbed else "stale"
+
+    def _run_grab(self, pending):
+        try:
+            pending.set_result(self._grab())
+        except Exception as e:
+            pending.set_exception(e)
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def _grab(self):
+        """Grabs and encodes one preview frame into the cache; False if the camera had none to give."""
+        start = time.perf_counter()
+        initialize_camera()
+        if not camera_initialized:
+            return False
+        if self._converter is None or (self._converter.source, self._converter.resolution) != (stream_source, STREAM_RESOLUTION):
+            self._converter = FrameConverter(STREAM_RESOLUTION, stream_source)
+        frame = camera_actor.call("snapshot", _grab_stream_frame, self._converter, timeout=SNAPSHOT_GRAB_TIMEOUT)
+        if frame is None:
+            return False  # Sensor is held in still mode by a burst
+        encoder = get_stream_encoder()
+        if not encoder.needs_frame:
+            encoder = cpu_stream_encoder
+        jpeg_bytes = encoder.encode(frame, STREAM_JPEG_QUALITY)
+        if jpeg_bytes is None:
+            return False
+        self.store(jpeg_bytes)
+        observe_stage("snapshot_grab", start)
+        return True
+
+snapshot_cache = SnapshotCache()
+
+def stream_frames(profile=STREAM_DEFAULT_PROFILE):
+    """Per-viewer generator that relays the profile broadcaster's latest frames."""
+    frame_broadcaster = frame_broadcasters[profile]
+    stream_controller = frame_broadcaster.controller
+    last_seq = frame_broadcaster.subscribe()
+    logging.info(f"Viewer joined {profile} ({frame_broadcaster.subscriber_count} watching)")
+    try:
+        while True:
+            result = frame_broadcaster.wait_frame(last_seq)
+            if result is None:
+                logging.info("No frames from producer, ending viewer stream")
+                break
+            if result[0] > last_seq + 1 and last_seq:
+                # Producer published frames this viewer was too slow to take
+                stream_frames_total.inc("dropped", result[0] - last_seq - 1)
+            last_seq, frame_data = result
+            # Time blocked in yield is the socket write, i.e. this viewer's backpressure
+            send_start = time.perf_counter()
+            yield frame_data
+            send_seconds = time.perf_counter() - send_start
+            stream_controller.record_send(send_seconds)
+            stage_seconds.observe(send_seconds, "stream_send")
+    finally:
+        frame_broadcaster.unsubscribe()
+        logging.info(f"Viewer left {profile} ({frame_broadcaster.subscriber_count} watching)")
 
 @app.route('/')
 def index():
@@ -682,9 +4109,16 @@ def index():
     <h1>Raspberry Pi Camera Controller</h1>
     <ul>
         <li><a href="/video_feed">Live Video Feed</a></li>
+        <li><a href="/snapshot.jpg">Snapshot</a></li>
         <li><a href="/capture">Capture Image</a></li>
+        <li><a href="/state">State</a></li>
+        <li><a href="/events">Events</a></li>
         <li><a href="/device_status">Device Status</a></li>
         <li><a href="/system_status">System Status</a></li>
+        <li><a href="/stream_status">Stream Status</a></li>
+        <li><a href="/metrics">Metrics</a></li>
+        <li><a href="/memory">Memory</a></li>
+        <li><a href="/storage_status">Storage Status</a></li>
         <li><a href="/power_status">Power Status</a></li>
         <li><a href="/led1_status">LED1 Status</a></li>
         <li><a href="/led2_status">LED2 Status</a></li>
@@ -697,44 +4131,309 @@ def index():
     </ul>
     """
 
-@app.route('/video_feed')
-def video_feed():
-    """Video feed endpoint - enables lazy camera startup and shutdown."""
-
-    global VIDEO_STREAM_ACTIVE, system_state, client_status
+def start_video_feed():
+    """Wakes the camera for a new viewer; False if it could not be initialized."""
+    global system_state, client_status
     
     update_timer()  # Reset activity timer
     
     # Update client status to prevent timeout
-    with state_lock:
-        client_status['last_ping'] = datetime.now()
-        client_status['status'] = True
-        initialize_camera()
-        set_system_state(SystemState.RUNNING)
+    mark_client_active()
     
-    # Add a small delay to ensure camera is ready
-    time.sleep(0.1)
+    # Camera start-up runs on the camera thread; state_lock is not held meanwhile
+    initialize_camera()
+    set_system_state(SystemState.RUNNING)
     
     # Only start streaming if camera is properly initialized
     if not camera_initialized:
         logging.error("Camera failed to initialize, cannot start video stream")
-        return "Camera initialization failed", 500
+        return False
     
-    VIDEO_STREAM_ACTIVE = True
     logging.info("Video stream started")
+    return True
+
+STREAM_HEADERS = {
+    # Prevent caching
+    'Cache-Control': 'no-cache, no-store, must-revalidate',
+    'Pragma': 'no-cache',
+    'Expires': '0',
+}
+
+@app.route('/video_feed')
+def video_feed():
+    """Video feed endpoint - enables lazy camera startup and shutdown.
+
+    ?profile=low|medium|high picks the stream size and quality (default STREAM_DEFAULT_PROFILE).
+    """
+    profile = request.args.get('profile', STREAM_DEFAULT_PROFILE)
+    if profile not in STREAM_PROFILES:
+        return jsonify(error=f"profile must be one of {', '.join(STREAM_PROFILES)}"), 400
+    if not admit_viewer(profile):
+        response = jsonify(error="Memory budget exhausted, try again later")
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    if not start_video_feed():
+        return "Camera initialization failed", 500
     
     try:
-        response = Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
-        # Add headers to prevent caching
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+        response = Response(stream_frames(profile), mimetype='multipart/x-mixed-replace; boundary=frame')
+        response.headers.update(STREAM_HEADERS)
         return response
     except Exception as e:
         logging.error(f"Error in video feed response: {e}")
-        VIDEO_STREAM_ACTIVE = False
         return "Video stream error", 500
 
+@app.route('/snapshot.jpg')
+def snapshot():
+    """Latest preview frame as a JPEG: the stream's cached frame, or one fresh grab shared by concurrent callers.
+
+    ?max_age=<seconds> sets how old a cached frame may be (default SNAPSHOT_MAX_AGE).
+    """
+    try:
+        max_age = float(request.args.get('max_age', SNAPSHOT_MAX_AGE))
+    except ValueError:
+        return jsonify(error="max_age must be a number"), 400
+    update_timer()
+    
+    jpeg_bytes, age, source = snapshot_cache.get(max_age)
+    snapshots_total.inc(source)
+    if jpeg_bytes is None:
+        return "No frame available", 503
+    response = Response(jpeg_bytes, mimetype='image/jpeg')
+    response.headers.update(STREAM_HEADERS)
+    response.headers['X-Frame-Age-Ms'] = str(int(age * 1000))
+    response.headers['X-Frame-Source'] = source
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Per-stage timings, frame and capture counters and lock contention, Prometheus text format."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/storage_status')
+def storage_status():
+    """Write queue, write latency, free space, quota and eviction state of the image directory."""
+    return jsonify(storage_manager.status())
+
+@app.route('/memory')
+def memory_status():
+    """Budget, pressure and current/peak bytes per buffer consumer; top allocation sites while profiling."""
+    return jsonify(memory_governor.status())
+
+@app.route('/memory/profiling', methods=['POST'])
+def memory_profiling():
+    """Switches the tracemalloc profiling mode on or off: enabled=true|false."""
+    params = request.get_json(silent=True) or request.values
+    enabled = str(params.get('enabled', '')).lower()
+    if enabled not in ('true', 'false', '1', '0'):
+        return jsonify(error="enabled must be true or false"), 400
+    memory_governor.set_profiling(enabled in ('true', '1'))
+    return jsonify(memory_governor.status())
+
+@app.route('/stream_status')
+def stream_status():
+    """Adaptive stream controller state, bounds and recent adjustments; per profile under "profiles"."""
+    profiles = {
+        profile: {'viewers': broadcaster.subscriber_count, 'producing': broadcaster.producing,
+                  'resolution': list(STREAM_PROFILES[profile]['resolution']),
+                  'camera_stream': _profile_source(profile)[0][0], **broadcaster.controller.status(),
+                  'change_detection': broadcaster.change_detector.status()}
+        for profile, broadcaster in frame_broadcasters.items()
+    }
+    return jsonify(viewers=frame_broadcaster.subscriber_count, **stream_controller.status(),
+                   default_profile=STREAM_DEFAULT_PROFILE, profiles=profiles)
+
+# --- Async Serving Mode ---
+
+def _call_wsgi(environ):
+    """Runs the Flask app for one request; returns (status, headers, body iterable)."""
+    captured = {}
+    
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = headers
+    
+    body = app(environ, start_response)
+    return captured['status'], captured['headers'], body
+
+def run_async_server(host, port):
+    """Serves the same routes from one asyncio event loop (aiohttp).
+
+    MJPEG viewers are coroutines fed by the frame broadcaster, so idle or
+    slow stream clients cost no thread. Every other route runs the Flask
+    view on a small executor (ASYNC_EXECUTOR_WORKERS threads) because the
+    views make blocking camera, GPIO and disk calls; at most
+    ASYNC_MAX_PENDING requests may queue for it before clients get 503.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from aiohttp import web
+    from werkzeug.test import EnvironBuilder
+    
+    executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="async-io")
+    pending = None  # Semaphore, created inside the running loop
+    
+    async def video_feed_async(request):
+        profile = request.query.get('profile', STREAM_DEFAULT_PROFILE)
+        if profile not in STREAM_PROFILES:
+            return web.json_response({'error': f"profile must be one of {', '.join(STREAM_PROFILES)}"}, status=400)
+        if not admit_viewer(profile):
+            return web.json_response({'error': "Memory budget exhausted, try again later"}, status=503,
+                                     headers={'Retry-After': '5'})
+        frame_broadcaster = frame_broadcasters[profile]
+        stream_controller = frame_broadcaster.controller
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(executor, start_video_feed):
+            return web.Response(status=500, text="Camera initialization failed")
+        
+        response = web.StreamResponse(headers={
+            'Content-Type': 'multipart/x-mixed-replace; boundary=frame', **STREAM_HEADERS})
+        await response.prepare(request)
+        
+        new_frame = asyncio.Event()
+        listener = lambda: loop.call_soon_threadsafe(new_frame.set)
+        frame_broadcaster.add_listener(listener)
+        last_seq = frame_broadcaster.subscribe()
+        logging.info(f"Viewer joined {profile} ({frame_broadcaster.subscriber_count} watching, async)")
+        try:
+            while True:
+                new_frame.clear()
+                result = frame_broadcaster.poll(last_seq)
+                if result is None:
+                    if not frame_broadcaster.producing:
+                        break
+                    try:
+                        await asyncio.wait_for(new_frame.wait(), STREAM_TIMEOUT)
+                    except (asyncio.TimeoutError, TimeoutError):
+                        logging.info("No frames from producer, ending viewer stream")
+                        break
+                    continue
+                if result[0] > last_seq + 1 and last_seq:
+                    stream_frames_total.inc("dropped", result[0] - last_seq - 1)
+                last_seq, frame_data = result
+                # Awaiting the write is this viewer's backpressure; others are unaffected
+                send_start = time.perf_counter()
+                await response.write(frame_data)
+                send_seconds = time.perf_counter() - send_start
+                stream_controller.record_send(send_seconds)
+                stage_seconds.observe(send_seconds, "stream_send")
+        except ConnectionError:
+            pass  # Viewer went away
+        finally:
+            frame_broadcaster.remove_listener(listener)
+            frame_broadcaster.unsubscribe()
+            logging.info(f"Viewer left {profile} ({frame_broadcaster.subscriber_count} watching, async)")
+        return response
+    
+    async def events_async(request):
+        """/events without a thread per listener: waits on event_bus from the event loop."""
+        loop = asyncio.get_running_loop()
+        published = asyncio.Event()
+        listener = lambda: loop.call_soon_threadsafe(published.set)
+        
+        async def next_events(last_id, timeout):
+            """event_bus.wait() for coroutines."""
+            deadline = loop.time() + timeout
+            while True:
+                published.clear()
+                found = event_bus.since(last_id)
+                if found != []:
+                    return found
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return []
+                try:
+                    await asyncio.wait_for(published.wait(), remaining)
+                except (asyncio.TimeoutError, TimeoutError):
+                    return []
+        
+        event_bus.add_listener(listener)
+        try:
+            since = request.query.get('since')
+            if since is not None:
+                try:
+                    last_id = int(since)
+                    wait = min(float(request.query.get('wait', EVENTS_LONG_POLL_TIMEOUT)), EVENTS_LONG_POLL_TIMEOUT)
+                except ValueError:
+                    return web.json_response({'error': "since must be an event id and wait a number of seconds"},
+                                             status=400)
+                found = await next_events(last_id, wait)
+                return web.json_response(_long_poll_result(last_id, found))
+            
+            response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                                   'X-Accel-Buffering': 'no'})
+            await response.prepare(request)
+            last_id = _event_start_id(request.headers.get('Last-Event-ID'))
+            await response.write(f"retry: {int(EVENTS_KEEPALIVE * 1000)}\n\n".encode())
+            try:
+                while True:
+                    found = None if last_id is None else await next_events(last_id, EVENTS_KEEPALIVE)
+                    if found is None:
+                        message, last_id = _snapshot_message()
+                        await response.write(message)
+                    elif not found:
+                        await response.write(b": keepalive\n\n")
+                    else:
+                        for event in found:
+                            await response.write(_sse_message(event['type'], {**event['data'], 'time': event['time']},
+                                                              event['id']))
+                        last_id = found[-1]['id']
+            except ConnectionError:
+                pass  # Listener went away
+            return response
+        finally:
+            event_bus.remove_listener(listener)
+    
+    async def flask_route(request):
+        nonlocal pending
+        if pending is None:
+            pending = asyncio.Semaphore(ASYNC_EXECUTOR_WORKERS + ASYNC_MAX_PENDING)
+        if pending.locked():
+            return web.Response(status=503, text="Server busy")
+        
+        async with pending:
+            loop = asyncio.get_running_loop()
+            environ = EnvironBuilder(
+                path=request.path,
+                method=request.method,
+                headers=list(request.headers.items()),
+                query_string=request.query_string,
+                data=await request.read(),
+            ).get_environ()
+            if request.remote:
+                environ['REMOTE_ADDR'] = request.remote
+            status, headers, body = await loop.run_in_executor(executor, _call_wsgi, environ)
+            
+            response = web.StreamResponse(status=int(status.split()[0]), reason=status[4:])
+            for name, value in headers:
+                response.headers.add(name, value)
+            try:
+                await response.prepare(request)
+                # Bodies are pulled in the executor too: file and archive reads block
+                iterator = iter(body)
+                while True:
+                    chunk = await loop.run_in_executor(executor, next, iterator, None)
+                    if chunk is None:
+                        break
+                    if chunk:
+                        await response.write(chunk)
+            except BaseException:
+                # Closed inline so the body sees the failure (a download is then not marked exported)
+                if hasattr(body, 'close'):
+                    body.close()
+                raise
+            if hasattr(body, 'close'):
+                await loop.run_in_executor(executor, body.close)
+            await response.write_eof()
+            return response
+    
+    web_app = web.Application()
+    web_app.router.add_get('/video_feed', video_feed_async)
+    web_app.router.add_get('/events', events_async)
+    web_app.router.add_route('*', '/{tail:.*}', flask_route)
+    logging.info(f"Async server listening on {host}:{port} ({ASYNC_EXECUTOR_WORKERS} executor threads)")
+    web.run_app(web_app, host=host, port=port, print=None, handle_signals=False)
+
 # --- Main Entry Point ---
 
 def hardware_button_listener():
@@ -750,6 +4449,7 @@ def hardware_button_listener():
             initialize_camera()
             set_system_state(SystemState.RUNNING)
         led1.toggle()
+        publish_leds()
     
     def handle_led2_press():
         # Skip if device is powered off
@@ -760,6 +4460,7 @@ def hardware_button_listener():
             initialize_camera()
             set_system_state(SystemState.RUNNING)
         led2.toggle()
+        publish_leds()
     
     def handle_capture_press():
         # Skip if device is powered off
@@ -794,13 +4495,25 @@ def hardware_button_listener():
 if __name__ == '__main__':
     # Start background threads as daemons so they die when main app dies
     threading.Thread(target=hardware_button_listener, daemon=True).start()
-    threading.Thread(target=shutdown_monitor, daemon=True).start()
-    threading.Thread(target=monitor_client, daemon=True).start()
+    if ZSL_ENABLED:
+        threading.Thread(target=zsl_recorder, daemon=True).start()
+    
+    # Bring the image index up to date without delaying startup
+    threading.Thread(target=image_index.reconcile, daemon=True).start()
+    
+    # Image writer and free-space watch
+    storage_manager.start()
+    
+    # Pick the fastest JPEG backend before the first viewer arrives
+    select_stream_encoder()
     
     # Initialize camera immediately after app launch
     logging.info("Initializing camera...")
     initialize_camera()
     
+    # Idle and shutdown deadlines run from boot even if no client ever connects
+    arm_inactivity_deadlines()
+    
     # System is now fully booted and running
     set_system_state(SystemState.RUNNING)
     logging.info(f"System boot complete. RPi Zero W mode: {RPI_ZERO_MODE}")
@@ -813,7 +4526,10 @@ if __name__ == '__main__':
     # Use Gunicorn in production: 
     # gunicorn -w 1 -b 0.0.0.0:5000 --threads 2 --timeout 120 --worker-class sync "final_new:app"
     
-    if RPI_ZERO_MODE:
+    if SERVER_MODE == "async":
+        # One event loop for all connections; blocking calls go to a small executor
+        run_async_server('0.0.0.0', 5000)
+    elif RPI_ZERO_MODE:
         # Optimized for RPi Zero W with limited resources
         app.run(
             host='0.0.0.0',
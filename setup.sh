@@ -57,6 +57,8 @@ pip install -r requirements.txt
 echo "Handling optional dependencies..."
 # These may fail on some systems - that's okay
 pip install python-prctl || echo "Note: python-prctl install skipped (optional)"
+pip install simplejpeg || echo "Note: simplejpeg install skipped (optional, faster stream JPEG encoding)"
+pip install aiohttp || echo "Note: aiohttp install skipped (optional, SERVER_MODE = \"async\")"
 
 echo "[5/6] Creating image directory..."
 mkdir -p img